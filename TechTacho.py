@@ -1,17 +1,2930 @@
-import tkinter as tk, sqlite3, os, pandas as pd, ctypes, matplotlib.pyplot as plt, webbrowser, urllib.parse, sys
-from tkinter import ttk, messagebox,simpledialog
-from tkcalendar import Calendar
+import tkinter as tk, sqlite3, os, urllib.parse, sys, re, importlib
+from tkinter import ttk, messagebox,simpledialog, filedialog
 from datetime import datetime, timedelta
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from faker import Faker
-from functools import partial
+from functools import partial, wraps
+from collections import deque, OrderedDict
+from itertools import islice
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from contextlib import contextmanager
+import time, json, io, threading, argparse, heapq, csv, tempfile, shutil
+
+
+class LazyModule:
+    # Stands in for a module and only imports it on first use
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+# The heavy libraries are only needed for CSV files, charts, date pickers and fake data, so they are imported
+# when first used instead of delaying the window: matplotlib when a chart tab is first shown, tkcalendar once
+# the window is on screen, Faker only by the fake data shortcut. Standard modules that only one feature or
+# command uses (asyncio, smtplib, the profilers, gzip, the process pools, ...) are imported inside it.
+pd = LazyModule('pandas')
+mpl_figure = LazyModule('matplotlib.figure')
+mpl_tkagg = LazyModule('matplotlib.backends.backend_tkagg')
+tkcalendar = LazyModule('tkcalendar')
+faker = LazyModule('faker')
+
+
+def set_dpi_awareness():
+    # Make text and elements clear on high DPI screens (Windows only, before the first window is created)
+    import ctypes
+    if sys.platform != 'win32':
+        return
+    try:
+        # Try to set DPI awareness to make text and elements clear
+        ctypes.windll.shcore.SetProcessDpiAwareness(1)  # 1: System DPI aware, 2: Per monitor DPI aware
+    except AttributeError:
+        # Fallback if SetProcessDpiAwareness does not exist (Windows versions < 8.1)
+        ctypes.windll.user32.SetProcessDPIAware()
+
+
+class PerfMonitor:
+    # Records, for each user action, the wall time, the number of SQL statements, the rows fetched and
+    # the Treeview items touched. Only the outermost action collects; nested ones are part of it.
+    def __init__(self, max_records=2000):
+        self.records = deque(maxlen=max_records)
+        self.current = None
+        self.profiler = None
+        self.errors = deque(maxlen=200)
+
+    @contextmanager
+    def action(self, name):
+        if self.current is not None:
+            yield self.current
+            return
+
+        record = {'action': name, 'started': datetime.now().isoformat(timespec='seconds'),
+                  'wall_ms': 0.0, 'queries': 0, 'rows': 0, 'tree_items': 0, 'lock_retries': 0, 'file_reads': 0}
+        self.current = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['wall_ms'] = round((time.perf_counter() - start) * 1000, 2)
+            self.current = None
+            self.records.append(record)
+
+    def timed(self, name):
+        # Decorator form of action()
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.action(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, counter, amount=1):
+        if self.current is not None:
+            self.current[counter] += amount
+
+    def error(self, where, error):
+        # Errors of background work and other paths without a dialog of their own, listed by the diagnostics
+        # window; safe to call from worker threads
+        self.errors.append({'started': datetime.now().isoformat(timespec='seconds'), 'where': where,
+                            'error': str(error)})
+
+    def dump_jsonl(self, path):
+        with open(path, 'w') as f:
+            for record in self.records:
+                f.write(json.dumps(record) + '\n')
+
+    def start_profile(self):
+        import cProfile
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_profile(self, limit=30):
+        # Stops the running cProfile session and returns the top functions by cumulative time
+        import pstats
+        if self.profiler is None:
+            return "Profiler is not running."
+        self.profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats('cumulative').print_stats(limit)
+        self.profiler = None
+        return output.getvalue()
+
+    def memory_snapshot(self, limit=20):
+        # The first call starts tracemalloc, later calls report the biggest allocation sites since then
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            return "Memory tracing started, take another snapshot to see allocations."
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: {current / 1024:.0f} KiB (peak {peak / 1024:.0f} KiB)"]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:limit]]
+        return '\n'.join(lines)
+
+
+perf = PerfMonitor()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Counts executed statements and fetched rows for the action in progress
+    def execute(self, sql, parameters=()):
+        perf.count('queries')
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        perf.count('queries')
+        return super().executemany(sql, seq_of_parameters)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            perf.count('rows')
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        perf.count('rows', len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        perf.count('rows', len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        perf.count('rows')
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Several clerks can share one database file: a connection waits this long for another clerk's lock,
+# and a write that still finds the database locked is retried a few times with an increasing delay
+BUSY_TIMEOUT_SECONDS = 5
+LOCK_RETRIES = 4
+LOCK_RETRY_DELAY = 0.2
+
+# How often the app checks the open database for changes made by other clerks
+CHANGE_POLL_MS = 2000
+
+# How often the running app marks loans that became overdue (the job itself runs at most once a day)
+OVERDUE_CHECK_MS = 3600000
+
+# Database maintenance runs by itself when it is due and nobody used the app for a while. The incremental
+# vacuum frees pages in slices of at most MAINTENANCE_SLICE_SECONDS with a pause in between for other writers.
+MAINTENANCE_INTERVAL_DAYS = 7
+MAINTENANCE_IDLE_SECONDS = 600
+MAINTENANCE_CHECK_MS = 60000
+MAINTENANCE_SLICE_SECONDS = 0.2
+MAINTENANCE_SLICE_PAUSE = 0.05
+MAINTENANCE_VACUUM_PAGES = 256
+
+# Users whose Trust Index counts the Confidence Index tab keeps, and how many listbox neighbours on each side
+# of the displayed user are fetched ahead in the background
+TRUST_CACHE_SIZE = 256
+TRUST_PREFETCH_NEIGHBORS = 2
+
+# Memory the cache of recent grid result sets may use before the least recently used ones are dropped
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Scan mode commits the scans in batches of up to SCAN_BATCH_SIZE at least every SCAN_FLUSH_MS; the grid and the
+# charts catch up once nothing was scanned for SCAN_IDLE_MS. Loans lent by scanning are due in SCAN_LOAN_DAYS.
+SCAN_BATCH_SIZE = 50
+SCAN_FLUSH_MS = 300
+SCAN_IDLE_MS = 1500
+SCAN_LOAN_DAYS = 14
+
+# Bulk checkout of kits (Tools > Bulk Checkout..., checkout-kit)
+KIT_LOAN_DAYS = 14
+DEFAULT_KIT = 'Laptop, Mouse, Keyboard, Monitor'
+
+# Startup snapshot: the first grid page, chart counts and summary of the last database, written on close and
+# painted on the next launch before the database is read
+SNAPSHOT_FILE = 'last_snapshot.json'
+SNAPSHOT_ROWS = 200
+SNAPSHOT_FORMAT = 1
+
+# Storage profiles: the pragmas a connection is opened with. cache_size is negative KiB per connection, mmap_size
+# bytes. page_size only takes effect when a database is created or rebuilt (maintain --full-vacuum). synchronous
+# NORMAL is safe in WAL mode (a power cut can lose the last commits, but never corrupts the file); OFF is not,
+# so 'bulk import' is only used for data that can be generated again and is never recommended by calibrate.
+STORAGE_PROFILES = {
+    'sqlite defaults': {'cache_size': -2000, 'mmap_size': 0, 'synchronous': 'FULL', 'temp_store': 'DEFAULT',
+                        'page_size': 4096, 'safe': True},
+    'interactive': {'cache_size': -16384, 'mmap_size': 268435456, 'synchronous': 'NORMAL', 'temp_store': 'DEFAULT',
+                    'page_size': 4096, 'safe': True},
+    'reporting': {'cache_size': -262144, 'mmap_size': 1073741824, 'synchronous': 'NORMAL', 'temp_store': 'MEMORY',
+                  'page_size': 8192, 'safe': True},
+    'bulk import': {'cache_size': -262144, 'mmap_size': 268435456, 'synchronous': 'OFF', 'temp_store': 'MEMORY',
+                    'page_size': 4096, 'safe': False},
+}
+# Databases that were never calibrated keep SQLite's defaults
+DEFAULT_STORAGE_PROFILE = 'sqlite defaults'
+
+# Profile of each database file, as recommended by calibrate and stored in its app_state (read by prepare_database)
+_storage_profiles = {}
+
+
+def storage_profile_sql(name):
+    profile = STORAGE_PROFILES[name]
+    return ''.join(f"PRAGMA {pragma}={profile[pragma]};"
+                   for pragma in ('page_size', 'cache_size', 'mmap_size', 'synchronous', 'temp_store'))
+
+
+def open_db(db_file, read_only=False, check_same_thread=True, profile=None):
+    # Every database connection of the app goes through here. The pragmas of the storage profile (the given one,
+    # else the database's calibrated one) are set with executescript, so they don't count as queries of the action.
+    profile = profile or _storage_profiles.get(os.path.abspath(db_file), DEFAULT_STORAGE_PROFILE)
+    if read_only:
+        path = os.path.abspath(db_file).replace(os.sep, '/')
+        uri = 'file:' + urllib.parse.quote(path if path.startswith('/') else '/' + path) + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_SECONDS, factory=InstrumentedConnection,
+                               check_same_thread=check_same_thread)
+    else:
+        conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_SECONDS, factory=InstrumentedConnection,
+                               check_same_thread=check_same_thread)
+    conn.executescript(storage_profile_sql(profile))
+    return conn
+
+
+def is_lock_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def run_with_retry(operation, retries=LOCK_RETRIES, delay=LOCK_RETRY_DELAY):
+    # Runs operation() and retries it when the database stays locked past the busy timeout
+    for attempt in range(retries + 1):
+        try:
+            return operation()
+        except sqlite3.OperationalError as e:
+            if attempt == retries or not is_lock_error(e):
+                raise
+            perf.count('lock_retries')
+            time.sleep(delay * (2 ** attempt))
+
+
+class InstrumentedTreeview(ttk.Treeview):
+    # Treeview that reports how many items each action inserts, updates, moves or deletes
+    def insert(self, parent, index, iid=None, **kw):
+        perf.count('tree_items')
+        return super().insert(parent, index, iid, **kw)
+
+    def delete(self, *items):
+        perf.count('tree_items', len(items))
+        return super().delete(*items)
+
+    def move(self, item, parent, index):
+        perf.count('tree_items')
+        return super().move(item, parent, index)
+
+    def item(self, item, option=None, **kw):
+        if kw:
+            perf.count('tree_items')
+        return super().item(item, option, **kw)
+
+
+class DiagnosticsWindow(tk.Toplevel):
+    # Hidden diagnostics panel (Ctrl + Shift + P) listing the recorded actions
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Diagnostics")
+        self.geometry("900x500")
+
+        columns = ("Started", "Action", "Wall (ms)", "Queries", "Rows", "Tree Items", "Lock Retries", "File Reads")
+        self.tree_view = ttk.Treeview(self, columns=columns, show='headings', height=12)
+        for col in columns:
+            self.tree_view.heading(col, text=col, anchor="center")
+            self.tree_view.column(col, anchor="center", width=115)
+        self.tree_view.pack(fill='both', expand=True)
+
+        button_frame = ttk.Frame(self)
+        button_frame.pack(fill='x', pady=5)
+        ttk.Button(button_frame, text="Refresh", command=self.refresh).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Dump JSONL", command=self.dump).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Start Profiler", command=perf.start_profile).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Stop Profiler", command=self.stop_profile).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Memory Snapshot", command=self.memory_snapshot).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Errors", command=self.show_errors).pack(side=tk.LEFT, padx=5)
+
+        self.output = tk.Text(self, height=12, wrap='none')
+        self.output.pack(fill='both', expand=True)
+
+        self.refresh()
+
+    def refresh(self):
+        self.tree_view.delete(*self.tree_view.get_children())
+        for record in reversed(perf.records):
+            self.tree_view.insert('', 'end', values=(record['started'], record['action'], record['wall_ms'],
+                                                     record['queries'], record['rows'], record['tree_items'],
+                                                     record['lock_retries'], record.get('file_reads', 0)))
+
+    def show_output(self, text):
+        self.output.delete('1.0', tk.END)
+        self.output.insert(tk.END, text)
+
+    def dump(self):
+        path = filedialog.asksaveasfilename(parent=self, defaultextension='.jsonl',
+                                            initialfile=f"techtacho_perf_{datetime.now():%Y%m%d_%H%M%S}.jsonl")
+        if path:
+            perf.dump_jsonl(path)
+            self.show_output(f"{len(perf.records)} records written to {path}")
+
+    def stop_profile(self):
+        self.show_output(perf.stop_profile())
+
+    def memory_snapshot(self):
+        self.show_output(perf.memory_snapshot())
+
+    def show_errors(self):
+        self.show_output('\n'.join(f"{error['started']}  {error['where']}: {error['error']}"
+                                   for error in reversed(perf.errors)) or "No errors recorded.")
+
+
+# Database files whose schema extras (indexes, triggers, ...) were already checked during this session
+_prepared_databases = set()
+
+
+def prepare_database(db_file):
+    # Bring an equipment database up to date with the indexes the app relies on; only done once per file
+    key = os.path.abspath(db_file)
+    if key in _prepared_databases or not os.path.exists(db_file):
+        return
+
+    conn = open_db(db_file)
+    try:
+        # WAL lets clerks keep reading while another one writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        ensure_loan_tables(conn)
+        ensure_change_tracking(conn)
+        ensure_app_state(conn)
+        ensure_search_index(conn)
+        ensure_interval_index(conn)
+        ensure_filter_indexes(conn)
+        profile = get_state(conn, 'storage_profile')
+        if profile in STORAGE_PROFILES:
+            _storage_profiles[key] = profile
+        _prepared_databases.add(key)
+    except sqlite3.Error as e:
+        perf.error(f"prepare {db_file}", e)
+    finally:
+        conn.close()
+
+
+# Emails and equipment names are stored once, in users and equipment_types, and loans refer to them by ID.
+# The equipment view joins the names back in, so reads keep using the familiar columns; writes go to loans.
+LOAN_TABLES = '''
+    CREATE TABLE IF NOT EXISTS users (ID INTEGER PRIMARY KEY, Email TEXT NOT NULL UNIQUE);
+    CREATE TABLE IF NOT EXISTS equipment_types (ID INTEGER PRIMARY KEY, Name TEXT NOT NULL UNIQUE);
+    CREATE TABLE IF NOT EXISTS loans (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Date TEXT,
+        UserID INTEGER REFERENCES users (ID),
+        EquipmentTypeID INTEGER REFERENCES equipment_types (ID),
+        DueDate TEXT,
+        Status TEXT DEFAULT 'Not Returned',
+        ReturnDate TEXT,
+        RowVersion INTEGER NOT NULL DEFAULT 0,
+        Uid TEXT);
+'''
+
+LOAN_VIEW = '''
+    CREATE VIEW IF NOT EXISTS equipment AS
+    SELECT l.ID, l.Date, u.Email, t.Name AS Equipment, l.DueDate, l.Status, l.ReturnDate, l.RowVersion
+    FROM loans l LEFT JOIN users u ON u.ID = l.UserID LEFT JOIN equipment_types t ON t.ID = l.EquipmentTypeID;
+'''
+
+
+def create_loan_tables(conn):
+    conn.executescript(LOAN_TABLES + LOAN_VIEW)
+
+
+def ensure_loan_tables(conn):
+    # Files from before the normalized layout have a plain equipment table with the email and equipment name
+    # in every row; it is converted once, in one transaction, keeping the loan IDs. Its triggers and indexes go
+    # with it and are created again on loans by the ensure_* functions. Returns True if the file was converted.
+    tables = dict(conn.execute("SELECT name, type FROM sqlite_master WHERE name IN ('loans', 'equipment')"))
+    if 'loans' in tables:
+        return False
+    if tables.get('equipment') != 'table':
+        create_loan_tables(conn)
+        return False
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(equipment)")]
+    row_version = "e.RowVersion" if 'RowVersion' in columns else "0"
+    # Files older than ReturnDate get their return dates derived from the status ('Returned +N': N days late)
+    return_date = "e.ReturnDate" if 'ReturnDate' in columns else '''CASE
+        WHEN e.Status LIKE 'Returned +%' THEN date(e.DueDate, '+' || CAST(substr(e.Status, 11) AS INTEGER) || ' days')
+        WHEN e.Status LIKE 'Returned%' THEN e.DueDate END'''
+    has_app_state = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'app_state'").fetchone()
+
+    conn.executescript(f'''
+        BEGIN IMMEDIATE;
+        {LOAN_TABLES}
+        INSERT OR IGNORE INTO users (Email)
+        SELECT DISTINCT Email FROM equipment WHERE Email IS NOT NULL ORDER BY Email;
+        INSERT OR IGNORE INTO equipment_types (Name)
+        SELECT DISTINCT Equipment FROM equipment WHERE Equipment IS NOT NULL ORDER BY Equipment;
+
+        INSERT INTO loans (ID, Date, UserID, EquipmentTypeID, DueDate, Status, ReturnDate, RowVersion)
+        SELECT e.ID, e.Date, u.ID, t.ID, e.DueDate, e.Status, {return_date}, {row_version}
+        FROM equipment e LEFT JOIN users u ON u.Email = e.Email LEFT JOIN equipment_types t ON t.Name = e.Equipment
+        ORDER BY e.ID;
+
+        -- IDs of deleted loans are never handed out again, the change log and other clerks still know them
+        UPDATE sqlite_sequence SET seq = max(seq, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'equipment'), 0))
+        WHERE name = 'loans';
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'loans', seq FROM sqlite_sequence WHERE name = 'equipment'
+        AND NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'loans');
+
+        -- The rollups' change triggers go with the old table, so they are rebuilt when the Trends tab needs them
+        DROP TABLE IF EXISTS loan_rollups;
+        DROP TABLE IF EXISTS rollup_dirty;
+        {"DELETE FROM app_state WHERE Key = 'rollups_built';" if has_app_state else ""}
+
+        DROP TABLE equipment;
+        {LOAN_VIEW}
+        COMMIT;
+    ''')
+    return True
+
+
+def lookup_id(conn, table, column, value):
+    # ID of a user (users, Email) or an equipment type (equipment_types, Name), added if it is new
+    if value is None:
+        return None
+    row = conn.execute(f"SELECT ID FROM {table} WHERE {column} = ?", (value,)).fetchone()
+    if row:
+        return row[0]
+    return conn.execute(f"INSERT INTO {table} ({column}) VALUES (?)", (value,)).lastrowid
+
+
+def lookup_ids(conn, table, column, values):
+    # lookup_id for many values at once: {value: ID}, adding the new ones in one statement (Email and Name are
+    # UNIQUE) and reading the IDs back in chunks that stay under SQLite's parameter limit
+    values = list({value for value in values if value is not None})
+    conn.executemany(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", ((value,) for value in values))
+    ids = {}
+    for start in range(0, len(values), 500):
+        chunk = values[start:start + 500]
+        ids.update((name, row_id) for row_id, name in conn.execute(
+            f"SELECT ID, {column} FROM {table} WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk))
+    return ids
+
+
+# Columns of the equipment view stored as references: view column -> (loans column, table, name column)
+LOAN_REFERENCES = {'Email': ('UserID', 'users', 'Email'), 'Equipment': ('EquipmentTypeID', 'equipment_types', 'Name')}
+
+
+def loan_assignments(conn, fields):
+    # SET list and values of an UPDATE of loans given in equipment view columns (names become IDs)
+    assignments = []
+    values = []
+    for column, value in fields.items():
+        if column in LOAN_REFERENCES:
+            column, table, name_column = LOAN_REFERENCES[column]
+            value = lookup_id(conn, table, name_column, value)
+        assignments.append(f"{column} = ?")
+        values.append(value)
+    return ', '.join(assignments), values
+
+
+def insert_loans(conn, rows):
+    # Add (Date, Email, Equipment, DueDate, Status, ReturnDate[, Uid]) loans; returns the ID of the last one.
+    # New loans get a random Uid, loans copied from another database by sync keep theirs.
+    rows = list(rows)
+    if not rows:
+        return None
+    users = lookup_ids(conn, 'users', 'Email', (row[1] for row in rows))
+    types = lookup_ids(conn, 'equipment_types', 'Name', (row[2] for row in rows))
+    conn.executemany("INSERT INTO loans (Date, UserID, EquipmentTypeID, DueDate, Status, ReturnDate, Uid) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     ((date, users.get(email), types.get(equipment), due_date, status, return_date,
+                       uid[0] if uid else os.urandom(16).hex())
+                      for date, email, equipment, due_date, status, return_date, *uid in rows))
+    # The triggers' own inserts don't change it, so this is the last loan's ID
+    return conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+
+def borrower_emails(conn):
+    # Emails of everybody with at least one loan, sorted
+    return [row[0] for row in conn.execute(
+        "SELECT Email FROM users u WHERE EXISTS (SELECT 1 FROM loans WHERE UserID = u.ID) ORDER BY Email")]
+
+
+def equipment_names(conn):
+    # Equipment types that have at least one loan, sorted
+    return [row[0] for row in conn.execute(
+        "SELECT Name FROM equipment_types t WHERE EXISTS (SELECT 1 FROM loans WHERE EquipmentTypeID = t.ID) "
+        "ORDER BY Name")]
+
+
+def ensure_change_tracking(conn):
+    # RowVersion is bumped by every write of the app and lets an update detect that another clerk changed
+    # the row since it was loaded. equipment_changes keeps, per loan, the update sequence number (Usn) of
+    # its latest change (Deleted = 1 once removed), so other clerks can pick up exactly the changed rows.
+    # For the sync between copies of a database the log also keeps the loan's Uid, which is the same in every
+    # copy, and the time of the change. Loans from before the Uid column have none; every copy knows them by
+    # their ID, as 'L' + ID.
+    change_columns = [row[1] for row in conn.execute("PRAGMA table_info(equipment_changes)")]
+    if 'ChangedAt' in change_columns:
+        return
+
+    loan_columns = [row[1] for row in conn.execute("PRAGMA table_info(loans)")]
+    next_usn = "(SELECT COALESCE(MAX(Usn), 0) + 1 FROM equipment_changes)"
+    now = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+    conn.executescript(f'''
+        BEGIN IMMEDIATE;
+        {"" if 'Uid' in loan_columns else "ALTER TABLE loans ADD COLUMN Uid TEXT;"}
+        CREATE TABLE IF NOT EXISTS equipment_changes (
+            ID INTEGER PRIMARY KEY, Usn INTEGER NOT NULL, Deleted INTEGER NOT NULL DEFAULT 0, Uid TEXT,
+            ChangedAt TEXT);
+        {"ALTER TABLE equipment_changes ADD COLUMN Uid TEXT; ALTER TABLE equipment_changes ADD COLUMN ChangedAt TEXT;"
+         if change_columns else ""}
+        CREATE INDEX IF NOT EXISTS idx_equipment_changes_usn ON equipment_changes (Usn);
+        CREATE INDEX IF NOT EXISTS idx_equipment_changes_uid ON equipment_changes (Uid);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_loans_uid ON loans (Uid) WHERE Uid IS NOT NULL;
+
+        -- The Uid is read back from the row, loans_uid may have just given it one
+        DROP TRIGGER IF EXISTS equipment_changes_insert;
+        CREATE TRIGGER equipment_changes_insert AFTER INSERT ON loans BEGIN
+            INSERT OR REPLACE INTO equipment_changes (ID, Usn, Deleted, Uid, ChangedAt)
+            VALUES (NEW.ID, {next_usn}, 0, (SELECT Uid FROM loans WHERE ID = NEW.ID), {now});
+        END;
+
+        DROP TRIGGER IF EXISTS equipment_changes_update;
+        CREATE TRIGGER equipment_changes_update AFTER UPDATE ON loans BEGIN
+            INSERT OR REPLACE INTO equipment_changes (ID, Usn, Deleted, Uid, ChangedAt)
+            VALUES (NEW.ID, {next_usn}, 0, NEW.Uid, {now});
+        END;
+
+        DROP TRIGGER IF EXISTS equipment_changes_delete;
+        CREATE TRIGGER equipment_changes_delete AFTER DELETE ON loans BEGIN
+            INSERT OR REPLACE INTO equipment_changes (ID, Usn, Deleted, Uid, ChangedAt)
+            VALUES (OLD.ID, {next_usn}, 1, OLD.Uid, {now});
+        END;
+
+        -- Loans added by other tools, without insert_loans, still get a Uid
+        CREATE TRIGGER IF NOT EXISTS loans_uid AFTER INSERT ON loans WHEN NEW.Uid IS NULL BEGIN
+            UPDATE loans SET Uid = lower(hex(randomblob(16))) WHERE ID = NEW.ID;
+        END;
+        COMMIT;
+    ''')
+
+
+def ensure_app_state(conn):
+    # Small key/value table for per-database bookkeeping (watermarks of background jobs, ...)
+    conn.execute("CREATE TABLE IF NOT EXISTS app_state (Key TEXT PRIMARY KEY, Value TEXT)")
+    conn.commit()
+
+
+def get_state(conn, key, default=None):
+    row = conn.execute("SELECT Value FROM app_state WHERE Key = ?", (key,)).fetchone()
+    return row[0] if row else default
+
+
+def set_state(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO app_state (Key, Value) VALUES (?, ?)", (key, value))
+
+
+def mark_newly_overdue(db_file, today=None, force=False):
+    # Store the overdue status ('+N') of loans whose due date passed since the last run, in one transaction.
+    # The partial index (created by prepare_database) only holds loans that are still 'Not Returned', and the
+    # ones already marked overdue leave it, so every run only visits the loans that became overdue since the
+    # previous one.
+    # Returns the number of loans marked, or None if the job already ran today.
+    today = (today or datetime.now().date()).strftime('%Y-%m-%d')
+    prepare_database(db_file)
+    conn = open_db(db_file)
+    try:
+        if not force and get_state(conn, 'overdue_watermark', '') >= today:
+            return None
+
+        def mark():
+            marked = conn.execute('''UPDATE loans
+                                     SET Status = '+' || CAST(julianday(:today) - julianday(DueDate) AS INTEGER),
+                                         RowVersion = RowVersion + 1
+                                     WHERE Status = 'Not Returned' AND DueDate < :today''', {'today': today}).rowcount
+            set_state(conn, 'overdue_watermark', today)
+            conn.commit()
+            return marked
+
+        return run_with_retry(mark)
+    finally:
+        conn.close()
+
+
+def current_usn(conn):
+    # Sequence number of the latest change made to the loans of this database
+    return conn.execute("SELECT COALESCE(MAX(Usn), 0) FROM equipment_changes").fetchone()[0]
+
+
+def fetch_loans_by_id(conn, loan_ids):
+    # Current rows of the given loans, looked up in chunks to stay below SQLite's parameter limit
+    loan_ids = list(loan_ids)
+    rows = []
+    for start in range(0, len(loan_ids), 500):
+        chunk = loan_ids[start:start + 500]
+        placeholders = ', '.join('?' * len(chunk))
+        rows += conn.execute(f"SELECT ID, Date, Email, Equipment, DueDate, Status, RowVersion FROM equipment "
+                             f"WHERE ID IN ({placeholders})", chunk).fetchall()
+    return rows
+
+
+def ensure_search_index(conn):
+    # Full-text index (FTS5) over the email, the user name part of the email and the equipment name.
+    # Triggers on loans keep it in sync (the names come from the equipment view), so it is only built once.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'equipment_fts_insert'").fetchone():
+        return
+    build = not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'equipment_fts'").fetchone()
+
+    user_name = "CASE WHEN instr({0}.Email, '@') > 0 THEN substr({0}.Email, 1, instr({0}.Email, '@') - 1) ELSE {0}.Email END"
+    indexed = f"SELECT e.ID, e.Email, {user_name.format('e')}, e.Equipment FROM equipment e"
+
+    conn.executescript(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS equipment_fts USING fts5(
+            Email, UserName, Equipment, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3');
+
+        CREATE TRIGGER equipment_fts_insert AFTER INSERT ON loans BEGIN
+            INSERT INTO equipment_fts (rowid, Email, UserName, Equipment) {indexed} WHERE e.ID = NEW.ID;
+        END;
+
+        CREATE TRIGGER equipment_fts_update AFTER UPDATE OF UserID, EquipmentTypeID ON loans BEGIN
+            DELETE FROM equipment_fts WHERE rowid = OLD.ID;
+            INSERT INTO equipment_fts (rowid, Email, UserName, Equipment) {indexed} WHERE e.ID = NEW.ID;
+        END;
+
+        CREATE TRIGGER equipment_fts_delete AFTER DELETE ON loans BEGIN
+            DELETE FROM equipment_fts WHERE rowid = OLD.ID;
+        END;
+
+        {f"INSERT INTO equipment_fts (rowid, Email, UserName, Equipment) {indexed};" if build else ""}
+    ''')
+
+
+# Upper bound used as the interval end of loans that are still out
+OPEN_LOAN_END = 2147483647
+
+
+def derive_return_date(due_date, status):
+    # Best guess of the return date for rows recorded before ReturnDate existed: 'Returned +N' came back
+    # N days after the due date, a plain 'Returned' is counted as returned on the due date
+    if not status or not status.startswith('Returned') or not due_date:
+        return None
+    match = re.match(r'Returned \+(\d+)', status)
+    days_late = int(match.group(1)) if match else 0
+    return (datetime.strptime(due_date, "%Y-%m-%d") + timedelta(days=days_late)).strftime("%Y-%m-%d")
+
+
+def ensure_interval_index(conn):
+    # Every loan is an interval [borrow date, return date) stored in an R*Tree (as julian day numbers),
+    # so "what was out on day D" is a stabbing query instead of a scan of the whole table.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'equipment_intervals_insert'").fetchone():
+        return
+    build = not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'equipment_intervals'").fetchone()
+
+    # Coordinates: borrow day, return day (open loans never end) and due day (twice, R*Trees store ranges)
+    start = "CAST(julianday({0}.Date) AS INTEGER)"
+    end = f"max({start}, COALESCE(CAST(julianday({{0}}.ReturnDate) AS INTEGER), {OPEN_LOAN_END}))"
+    due = f"COALESCE(CAST(julianday({{0}}.DueDate) AS INTEGER), {OPEN_LOAN_END})"
+    interval = f"{start}, {end}, {due}, {due}"
+
+    # Returns are also counted per day (on time / late), so the returned slices of a past day are a
+    # sum over a few hundred days rather than over every returned loan
+    late = "COALESCE({0}.ReturnDate > {0}.DueDate, 0)"
+    add_return = f'''INSERT INTO equipment_return_days (Day, OnTime, Late)
+                     SELECT NEW.ReturnDate, 1 - {late.format('NEW')}, {late.format('NEW')}
+                     WHERE NEW.ReturnDate IS NOT NULL
+                     ON CONFLICT (Day) DO UPDATE SET OnTime = OnTime + excluded.OnTime, Late = Late + excluded.Late;'''
+    remove_return = f'''UPDATE equipment_return_days
+                        SET OnTime = OnTime - (1 - {late.format('OLD')}), Late = Late - {late.format('OLD')}
+                        WHERE Day = OLD.ReturnDate;'''
+
+    populate = f'''
+        INSERT INTO equipment_intervals
+        SELECT ID, {interval.format('loans')} FROM loans WHERE julianday(Date) IS NOT NULL;
+
+        INSERT INTO equipment_return_days (Day, OnTime, Late)
+        SELECT ReturnDate, SUM(1 - {late.format('loans')}), SUM({late.format('loans')})
+        FROM loans WHERE ReturnDate IS NOT NULL GROUP BY ReturnDate;
+    '''
+
+    conn.executescript(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS equipment_intervals USING rtree_i32(id, start, end, due_from, due_to);
+
+        CREATE TABLE IF NOT EXISTS equipment_return_days (
+            Day TEXT PRIMARY KEY, OnTime INTEGER NOT NULL, Late INTEGER NOT NULL) WITHOUT ROWID;
+
+        CREATE TRIGGER equipment_intervals_insert AFTER INSERT ON loans BEGIN
+            INSERT INTO equipment_intervals
+            SELECT NEW.ID, {interval.format('NEW')} WHERE julianday(NEW.Date) IS NOT NULL;
+            {add_return}
+        END;
+
+        CREATE TRIGGER equipment_intervals_update AFTER UPDATE OF Date, DueDate, ReturnDate ON loans BEGIN
+            DELETE FROM equipment_intervals WHERE id = OLD.ID;
+            INSERT INTO equipment_intervals
+            SELECT NEW.ID, {interval.format('NEW')} WHERE julianday(NEW.Date) IS NOT NULL;
+            {remove_return}
+            {add_return}
+        END;
+
+        CREATE TRIGGER equipment_intervals_delete AFTER DELETE ON loans BEGIN
+            DELETE FROM equipment_intervals WHERE id = OLD.ID;
+            {remove_return}
+        END;
+
+        {populate if build else ""}
+    ''')
+
+
+def loans_out_on(conn, as_of):
+    # Loans that were out on the given day (YYYY-MM-DD), with the status they had on that day
+    cursor = conn.execute('''SELECT e.ID, e.Date, e.Email, e.Equipment, e.DueDate,
+                                    CASE WHEN e.DueDate < :day
+                                         THEN '+' || CAST(julianday(:day) - julianday(e.DueDate) AS INTEGER)
+                                         ELSE 'Not Returned' END,
+                                    e.RowVersion
+                             FROM equipment_intervals i JOIN equipment e ON e.ID = i.id
+                             WHERE i.start <= CAST(julianday(:day) AS INTEGER)
+                               AND i.end > CAST(julianday(:day) AS INTEGER)''', {'day': as_of})
+    return cursor.fetchall()
+
+
+def status_counts_as_of(conn, as_of):
+    # [Pending, Returned On Time, Returned Late, Currently Late] as they stood on the given day
+    out_filter = "start <= CAST(julianday(:day) AS INTEGER) AND end > CAST(julianday(:day) AS INTEGER)"
+    out = conn.execute(f"SELECT COUNT(*) FROM equipment_intervals WHERE {out_filter}", {'day': as_of}).fetchone()[0]
+    late = conn.execute(f"SELECT COUNT(*) FROM equipment_intervals WHERE {out_filter} "
+                        f"AND due_to < CAST(julianday(:day) AS INTEGER)", {'day': as_of}).fetchone()[0]
+    on_time, returned_late = conn.execute('''SELECT COALESCE(SUM(OnTime), 0), COALESCE(SUM(Late), 0)
+                                             FROM equipment_return_days WHERE Day <= ?''', (as_of,)).fetchone()
+    return [out - late, on_time, returned_late, late]
+
+
+def build_fts_query(text):
+    # Turn what the clerk typed ("lapt* smith") into an FTS5 query: every word becomes a quoted token
+    # (so '@', '.' or '-' can't break the MATCH syntax) and a trailing '*' keeps its prefix meaning.
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        tokens = re.findall(r'\w+', word)
+        if not tokens:
+            continue
+        terms.extend(f'"{token}"' for token in tokens[:-1])
+        terms.append(f'"{tokens[-1]}"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+
+def search_loans(conn, text, limit=1000):
+    # Ranked (bm25) full-text lookup of loans; all terms must match
+    query = build_fts_query(text)
+    if not query:
+        return []
+    cursor = conn.execute('''SELECT e.ID, e.Date, e.Email, e.Equipment, e.DueDate, e.Status, e.RowVersion
+                             FROM equipment_fts JOIN equipment e ON e.ID = equipment_fts.rowid
+                             WHERE equipment_fts MATCH ?
+                             ORDER BY equipment_fts.rank
+                             LIMIT ?''', (query, limit))
+    return cursor.fetchall()
+
+
+# SMTP settings for the reminder digests (host, port, sender, username, password, use_tls, cooldown_days)
+SMTP_SETTINGS_FILE = 'smtp_settings.json'
+
+
+def load_smtp_settings(path=SMTP_SETTINGS_FILE):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class ReminderEngine:
+    # Sends one digest per user listing all of their overdue loans. Overdue loans are found in a single
+    # query; the digests go out over SMTP from a few concurrent workers, rate limited and retried.
+    # reminder_log remembers when each loan was last reminded so it isn't reminded again within the cooldown.
+    def __init__(self, db_file, host, port=25, sender='it-desk@localhost', username=None, password=None,
+                 use_tls=False, cooldown_days=7, concurrency=4, rate_per_second=5.0, retries=3,
+                 smtp_factory=None):
+        self.db_file = db_file
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.cooldown_days = cooldown_days
+        self.concurrency = concurrency
+        self.rate_per_second = rate_per_second
+        self.retries = retries
+        self.smtp_factory = smtp_factory
+
+    @classmethod
+    def from_settings(cls, db_file, settings):
+        return cls(db_file, settings['host'], settings.get('port', 25), settings.get('sender', 'it-desk@localhost'),
+                   settings.get('username'), settings.get('password'), settings.get('use_tls', False),
+                   settings.get('cooldown_days', 7))
+
+    def find_due_reminders(self, today=None):
+        # {email: [(loan id, equipment, due date), ...]} for every overdue loan outside its cooldown
+        today = today or datetime.now().date()
+        cutoff = (today - timedelta(days=self.cooldown_days)).strftime('%Y-%m-%d')
+        conn = open_db(self.db_file)
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS reminder_log (LoanID INTEGER PRIMARY KEY, SentAt TEXT NOT NULL)")
+            rows = conn.execute('''SELECT e.ID, e.Email, e.Equipment, e.DueDate
+                                   FROM equipment e LEFT JOIN reminder_log r ON r.LoanID = e.ID
+                                   WHERE (e.Status LIKE '+%' OR (e.Status = 'Not Returned' AND e.DueDate < ?))
+                                     AND (r.SentAt IS NULL OR r.SentAt <= ?)
+                                   ORDER BY e.Email, e.DueDate''', (today.strftime('%Y-%m-%d'), cutoff)).fetchall()
+        finally:
+            conn.close()
+
+        digests = {}
+        for loan_id, email, equipment, due_date in rows:
+            if email:
+                digests.setdefault(email, []).append((loan_id, equipment, due_date))
+        return digests
+
+    def build_message(self, email, loans):
+        from email.message import EmailMessage
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = email
+        if len(loans) == 1:
+            message['Subject'] = f"[IT DESK BRUGES] Kind Reminder: Please Return the Equipment ({loans[0][1]})"
+        else:
+            message['Subject'] = f"[IT DESK BRUGES] Kind Reminder: Please Return {len(loans)} Equipment Items"
+        items = '\n'.join(f"  - {equipment} (due {due_date})" for _, equipment, due_date in loans)
+        message.set_content(f"Hello,\n\nThis is a kind reminder to please return the equipment you borrowed:\n\n"
+                            f"{items}\n\nThis email is generated automatically. If you have already returned "
+                            "the items, please disregard this message.\n\nThank you.")
+        return message
+
+    def send_message(self, message):
+        # Blocking SMTP delivery, run in a worker thread
+        import smtplib
+        with (self.smtp_factory or smtplib.SMTP)(self.host, self.port, timeout=30) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+    async def send_all(self, digests):
+        import asyncio
+        import smtplib
+        semaphore = asyncio.Semaphore(self.concurrency)
+        rate_lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        next_slot = loop.time()
+        report = {'digests': len(digests), 'sent': 0, 'failed': 0, 'loans': 0, 'errors': []}
+        sent_loans = []
+
+        async def wait_for_slot():
+            nonlocal next_slot
+            async with rate_lock:
+                delay = next_slot - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_slot = max(next_slot, loop.time()) + 1 / self.rate_per_second
+
+        async def deliver(email, loans):
+            message = self.build_message(email, loans)
+            async with semaphore:
+                for attempt in range(self.retries + 1):
+                    await wait_for_slot()
+                    try:
+                        await asyncio.to_thread(self.send_message, message)
+                        report['sent'] += 1
+                        report['loans'] += len(loans)
+                        sent_loans.extend(loan_id for loan_id, _, _ in loans)
+                        return
+                    except (smtplib.SMTPException, OSError) as e:
+                        if attempt == self.retries:
+                            report['failed'] += 1
+                            report['errors'].append(f"{email}: {e}")
+                            return
+                        await asyncio.sleep(2 ** attempt)
+
+        await asyncio.gather(*(deliver(email, loans) for email, loans in digests.items()))
+        return report, sent_loans
+
+    def record_sent(self, loan_ids):
+        now = datetime.now().strftime('%Y-%m-%d')
+        conn = open_db(self.db_file)
+        try:
+            run_with_retry(lambda: (conn.executemany("INSERT OR REPLACE INTO reminder_log (LoanID, SentAt) VALUES (?, ?)",
+                                                     [(loan_id, now) for loan_id in loan_ids]), conn.commit()))
+        finally:
+            conn.close()
+
+    def run(self, dry_run=False):
+        # Find, send and log; returns a small report dictionary
+        import asyncio
+        started = time.perf_counter()
+        digests = self.find_due_reminders()
+        if dry_run:
+            report = {'digests': len(digests), 'sent': 0, 'failed': 0,
+                      'loans': sum(len(loans) for loans in digests.values()), 'errors': []}
+        else:
+            report, sent_loans = asyncio.run(self.send_all(digests))
+            self.record_sent(sent_loans)
+        report['seconds'] = round(time.perf_counter() - started, 2)
+        return report
+
+
+# Period label of a date for each rollup grain: the Monday of the week, or the month
+ROLLUP_PERIODS = {
+    'week': "date({0}, '-6 days', 'weekday 1')",
+    'month': "strftime('%Y-%m', {0})",
+}
+
+
+def ensure_rollups(conn):
+    # loan_rollups holds, per grain, period and equipment type, the loans opened, returned, returned late
+    # and still outstanding at the end of the period. Triggers note the earliest day touched by any write
+    # in rollup_dirty, so a refresh only recomputes the periods from there on.
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rollup_dirty_insert'").fetchone():
+        return
+
+    touched = "INSERT OR IGNORE INTO rollup_dirty (Day) SELECT {0}.{1} WHERE {0}.{1} IS NOT NULL;"
+    new_days = touched.format('NEW', 'Date') + touched.format('NEW', 'ReturnDate')
+    old_days = touched.format('OLD', 'Date') + touched.format('OLD', 'ReturnDate')
+
+    conn.executescript(f'''
+        CREATE TABLE IF NOT EXISTS loan_rollups (
+            Grain TEXT, Period TEXT, Equipment TEXT,
+            Opened INTEGER, Returned INTEGER, ReturnedLate INTEGER, Outstanding INTEGER,
+            PRIMARY KEY (Grain, Period, Equipment)) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS rollup_dirty (Day TEXT PRIMARY KEY) WITHOUT ROWID;
+
+        CREATE INDEX IF NOT EXISTS idx_loans_date ON loans (Date);
+        CREATE INDEX IF NOT EXISTS idx_loans_return_date ON loans (ReturnDate);
+
+        CREATE TRIGGER rollup_dirty_insert AFTER INSERT ON loans BEGIN {new_days} END;
+        CREATE TRIGGER rollup_dirty_update AFTER UPDATE OF Date, EquipmentTypeID, DueDate, ReturnDate ON loans
+        BEGIN {old_days} {new_days} END;
+        CREATE TRIGGER rollup_dirty_delete AFTER DELETE ON loans BEGIN {old_days} END;
+    ''')
+
+
+def refresh_rollups(conn):
+    # Extend the rollups up to date. The first call builds them; later calls recompute only the periods
+    # from the earliest day touched since the previous refresh (usually just the current one).
+    ensure_rollups(conn)
+    built = get_state(conn, 'rollups_built')
+    from_day = '' if not built else conn.execute("SELECT MIN(Day) FROM rollup_dirty").fetchone()[0]
+    if from_day is None:
+        return False
+
+    for grain, period in ROLLUP_PERIODS.items():
+        # The first day of the period containing from_day
+        start = '' if not from_day else conn.execute(
+            "SELECT " + (period.format('?') if grain == 'week' else "strftime('%Y-%m', ?) || '-01'"),
+            (from_day,)).fetchone()[0]
+        start_period = '' if not start else conn.execute(f"SELECT {period.format('?')}", (start,)).fetchone()[0]
+
+        conn.execute("DELETE FROM loan_rollups WHERE Grain = ? AND Period >= ?", (grain, start_period))
+
+        # One windowed pass: count opened/returned events per period, and carry the outstanding count on
+        # from the last stored period of each equipment type
+        conn.execute(f'''
+            INSERT INTO loan_rollups (Grain, Period, Equipment, Opened, Returned, ReturnedLate, Outstanding)
+            WITH events AS (
+                SELECT {period.format('Date')} AS Period, Equipment, 1 AS Opened, 0 AS Returned, 0 AS Late
+                FROM equipment WHERE Date >= :start AND julianday(Date) IS NOT NULL
+                UNION ALL
+                SELECT {period.format('ReturnDate')}, Equipment, 0, 1, COALESCE(ReturnDate > DueDate, 0)
+                FROM equipment WHERE ReturnDate >= :start AND julianday(ReturnDate) IS NOT NULL
+            ),
+            counts AS (
+                SELECT Period, COALESCE(Equipment, '') AS Equipment,
+                       SUM(Opened) AS Opened, SUM(Returned) AS Returned, SUM(Late) AS Late
+                FROM events GROUP BY Period, COALESCE(Equipment, '')
+            ),
+            baseline AS (
+                SELECT Equipment, Outstanding FROM loan_rollups r
+                WHERE Grain = :grain AND Period = (SELECT MAX(Period) FROM loan_rollups
+                                                   WHERE Grain = :grain AND Equipment = r.Equipment)
+            )
+            SELECT :grain, c.Period, c.Equipment, c.Opened, c.Returned, c.Late,
+                   COALESCE(b.Outstanding, 0)
+                   + SUM(c.Opened - c.Returned) OVER (PARTITION BY c.Equipment ORDER BY c.Period)
+            FROM counts c LEFT JOIN baseline b ON b.Equipment = c.Equipment
+        ''', {'start': start, 'grain': grain})
+
+    conn.execute("DELETE FROM rollup_dirty")
+    set_state(conn, 'rollups_built', datetime.now().isoformat(timespec='seconds'))
+    conn.commit()
+    return True
+
+
+def read_trends(conn, grain, equipment=None):
+    # [(period, opened, returned, returned late, outstanding)] for one equipment type or all of them.
+    # Periods without activity for a type have no row, so its outstanding count is carried forward.
+    if equipment:
+        rows = conn.execute("SELECT Period, Equipment, Opened, Returned, ReturnedLate, Outstanding FROM loan_rollups "
+                            "WHERE Grain = ? AND Equipment = ? ORDER BY Period", (grain, equipment)).fetchall()
+    else:
+        rows = conn.execute("SELECT Period, Equipment, Opened, Returned, ReturnedLate, Outstanding FROM loan_rollups "
+                            "WHERE Grain = ? ORDER BY Period", (grain,)).fetchall()
+
+    trends = []
+    outstanding = {}
+    for period, equipment_type, opened, returned, late, still_out in rows:
+        outstanding[equipment_type] = still_out
+        if trends and trends[-1][0] == period:
+            _, total_opened, total_returned, total_late, _ = trends[-1]
+            trends[-1] = (period, total_opened + opened, total_returned + returned, total_late + late,
+                          sum(outstanding.values()))
+        else:
+            trends.append((period, opened, returned, late, sum(outstanding.values())))
+    return trends
+
+
+# Slices of the overall status chart, in this order
+STATUS_LABELS = ['Pending', 'Returned On Time', 'Returned Late', 'Currently Late']
+
+
+def overall_status_counts(conn):
+    # [Pending, Returned On Time, Returned Late, Currently Late] in a single pass over the table
+    row = conn.execute('''SELECT COALESCE(SUM(Status = 'Not Returned'), 0),
+                                  COALESCE(SUM(Status = 'Returned'), 0),
+                                  COALESCE(SUM(Status LIKE 'Returned +%'), 0),
+                                  COALESCE(SUM(Status LIKE '+%'), 0)
+                           FROM loans''').fetchone()
+    return list(row)
+
+
+# Status choices of the grid filter
+STATUS_FILTERS = ['All', 'Not Returned', 'Overdue', 'Returned', 'Returned Late']
+
+# Status conditions are equality and range tests so they can use the indexes below: overdue statuses ('+N')
+# sort between '+' and ',', late returns ('Returned +N') between 'Returned +' and 'Returned ,'
+OVERDUE_STATUS_SQL = "(Status >= '+' AND Status < ',')"
+LATE_RETURN_STATUS_SQL = "(Status >= 'Returned +' AND Status < 'Returned ,')"
+
+
+def ensure_filter_indexes(conn):
+    # Compound indexes for the grid filters: user (+ due window), equipment + status (+ due window),
+    # equipment + due window, status (+ due window) and the due window on its own. A user or equipment filter
+    # on the equipment view finds the ID in users / equipment_types and continues in these indexes.
+    # The partial index of the open loans by due date is what the overdue scheduler walks.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_open_due ON loans (DueDate) WHERE Status = 'Not Returned'")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_loans_type_due'").fetchone():
+        return
+    conn.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_loans_user_due ON loans (UserID, DueDate, Status);
+        CREATE INDEX IF NOT EXISTS idx_loans_type_status_due ON loans (EquipmentTypeID, Status, DueDate);
+        CREATE INDEX IF NOT EXISTS idx_loans_status_due ON loans (Status, DueDate);
+        CREATE INDEX IF NOT EXISTS idx_loans_due ON loans (DueDate);
+        CREATE INDEX IF NOT EXISTS idx_loans_type_due ON loans (EquipmentTypeID, DueDate);
+    """)
+    # Without statistics the planner can't tell that a user is far more selective than an equipment type;
+    # a sampled ANALYZE only takes a moment even on large tables
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+
+
+class LoanFilter:
+    # Any combination of user, equipment, status and due-date window, compiled into one parameterized query
+    def __init__(self, email=None, equipment=None, status=None, due_from=None, due_to=None, today=None):
+        self.email = email or None
+        self.equipment = equipment or None
+        self.status = None if status in (None, '', 'All') else status
+        self.due_from = due_from or None
+        self.due_to = due_to or None
+        self.today = (today or datetime.now().date()).strftime('%Y-%m-%d')
+        if self.status is not None and self.status not in STATUS_FILTERS:
+            raise ValueError(f"Unknown status filter: {self.status}")
+
+    def is_empty(self):
+        return not (self.email or self.equipment or self.status or self.due_from or self.due_to)
+
+    def key(self):
+        # Identifies the result set; 'Overdue' depends on the day it is evaluated
+        return ('filter', self.email, self.equipment, self.status, self.due_from, self.due_to,
+                self.today if self.status == 'Overdue' else None)
+
+    def where(self):
+        # (WHERE clause, parameters)
+        conditions = []
+        params = []
+        if self.email:
+            conditions.append("Email = ?")
+            params.append(self.email)
+        if self.equipment:
+            conditions.append("Equipment = ?")
+            params.append(self.equipment)
+        if self.status == 'Not Returned':
+            conditions.append(f"(Status = 'Not Returned' OR {OVERDUE_STATUS_SQL})")
+        elif self.status == 'Overdue':
+            conditions.append(f"((Status = 'Not Returned' AND DueDate < ?) OR {OVERDUE_STATUS_SQL})")
+            params.append(self.today)
+        elif self.status == 'Returned':
+            conditions.append(f"(Status = 'Returned' OR {LATE_RETURN_STATUS_SQL})")
+        elif self.status == 'Returned Late':
+            conditions.append(LATE_RETURN_STATUS_SQL)
+        if self.due_from:
+            conditions.append("DueDate >= ?")
+            params.append(self.due_from)
+        if self.due_to:
+            conditions.append("DueDate <= ?")
+            params.append(self.due_to)
+        return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
+
+    def fetch(self, conn):
+        where, params = self.where()
+        return conn.execute(f"SELECT ID, Date, Email, Equipment, DueDate, Status, RowVersion FROM equipment {where}",
+                            params).fetchall()
+
+    def fetch_page(self, conn, after_id=0, limit=100):
+        # The next `limit` matching loans with an ID above after_id (keyset pagination, no OFFSET scans)
+        where, params = self.where()
+        where = f"{where} AND ID > ?" if where else "WHERE ID > ?"
+        return conn.execute(f"SELECT ID, Date, Email, Equipment, DueDate, Status, RowVersion FROM equipment {where} "
+                            "ORDER BY ID LIMIT ?", params + [after_id, limit]).fetchall()
+
+
+def stream_rows(conn, sql, params=(), chunk_size=50000):
+    # Yield the rows of a query chunk by chunk instead of fetching them all at once
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def concurrent_utilization(conn, chunk_size=50000):
+    # Number of loans out at the same time, per equipment type, from one sweep over the borrow (+1) and
+    # return (-1) events. Both event streams come sorted from an index and are merged, so the whole pass is
+    # O(n log n) and only holds one chunk of rows plus the resulting curve in memory.
+    # Returns ({equipment: (peak, first day of the peak)}, {equipment: [(day, loans out at the end of day)]}).
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_borrow_events ON loans (Date, ReturnDate, EquipmentTypeID)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_return_events ON loans (ReturnDate, Date, EquipmentTypeID)")
+
+    # On the same day returns (0) sort before borrows (1): a loan is out from its borrow day up to its return
+    # day. Loans recorded as returned before they were borrowed never count as out.
+    name = "LEFT JOIN equipment_types t ON t.ID = l.EquipmentTypeID"
+    returns = stream_rows(conn, "SELECT l.ReturnDate, 0, COALESCE(t.Name, '') "
+                                f"FROM loans l INDEXED BY idx_loans_return_events {name} WHERE l.ReturnDate >= l.Date ORDER BY l.ReturnDate", (), chunk_size)
+    borrows = stream_rows(conn, "SELECT l.Date, 1, COALESCE(t.Name, '') "
+                                f"FROM loans l INDEXED BY idx_loans_borrow_events {name} WHERE l.Date IS NOT NULL AND (l.ReturnDate IS NULL OR l.ReturnDate >= l.Date) "
+                                "ORDER BY l.Date", (), chunk_size)
+
+    out = {}
+    peaks = {}
+    curve = {}
+    changed = set()
+    current_day = None
+
+    def close_day(day):
+        for equipment in changed:
+            curve.setdefault(equipment, []).append((day, out[equipment]))
+        changed.clear()
+
+    for day, kind, equipment in heapq.merge(returns, borrows):
+        if day != current_day:
+            if current_day is not None:
+                close_day(current_day)
+            current_day = day
+
+        out[equipment] = out.get(equipment, 0) + (1 if kind else -1)
+        changed.add(equipment)
+        if out[equipment] > peaks.get(equipment, (0, None))[0]:
+            peaks[equipment] = (out[equipment], day)
+
+    if current_day is not None:
+        close_day(current_day)
+    return peaks, curve
+
+
+def combine_utilization_curves(curve):
+    # Total loans out across all equipment types, from the per-type curves
+    events = heapq.merge(*([(day, equipment, count) for day, count in points] for equipment, points in curve.items()))
+    latest = {}
+    combined = []
+    for day, equipment, count in events:
+        latest[equipment] = count
+        total = sum(latest.values())
+        if combined and combined[-1][0] == day:
+            combined[-1] = (day, total)
+        else:
+            combined.append((day, total))
+    return combined
+
+
+def standing_score(total_items, returned_on_time, returned_late, pending):
+    # Points for on-time returns, more points deducted for late returns and pending items, between 0 and 100
+    if total_items <= 0:
+        return 0  # Minimum grade if no items are borrowed
+    standing = ((returned_on_time / total_items) * 100) - ((returned_late + pending) / total_items * 50)
+    return int(max(0, min(standing, 100)))
+
+
+def user_metrics(conn, email=None, after_email=None, limit=None):
+    # (Email, Total Items, Returned On Time, Returned Late, Pending, Standing) per user, ordered by email, in one
+    # grouped query; optionally only one user, or the page of users after a given email. Users are walked in
+    # email order and each one's loans come from the (UserID, DueDate) index.
+    conditions = ["1"]
+    params = []
+    if email is not None:
+        conditions.append("u.Email = ?")
+        params.append(email)
+    if after_email is not None:
+        conditions.append("u.Email > ?")
+        params.append(after_email)
+    sql = f'''SELECT u.Email, COUNT(*),
+                      SUM(l.Status = 'Returned'),
+                      SUM(l.Status LIKE 'Returned +%' AND l.DueDate < datetime('now')),
+                      SUM(l.Status = 'Not Returned' OR (l.Status LIKE 'Returned +%' AND l.DueDate >= datetime('now')))
+               FROM users u JOIN loans l ON l.UserID = u.ID
+               WHERE {' AND '.join(conditions)} GROUP BY u.Email ORDER BY u.Email'''
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [row + (standing_score(*row[1:]),) for row in conn.execute(sql, params)]
+
+
+# Local JSON API (the serve command)
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_CACHE_ENTRIES = 1024
+
+
+class ReadPool:
+    # A fixed set of read-only connections shared by the API's worker threads, each used by one thread at a time
+    def __init__(self, db_file, size=4):
+        import queue
+        self.connections = queue.Queue()
+        for _ in range(size):
+            self.connections.put(open_db(db_file, read_only=True, check_same_thread=False, profile='reporting'))
+
+    def run(self, query, *args):
+        conn = self.connections.get()
+        try:
+            return query(conn, *args)
+        finally:
+            self.connections.put(conn)
+
+    async def read(self, query, *args):
+        import asyncio
+        return await asyncio.to_thread(self.run, query, *args)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+
+def api_page_size(params):
+    limit = int(params.get('limit', API_PAGE_SIZE))
+    if not 0 < limit <= API_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {API_MAX_PAGE_SIZE}")
+    return limit
+
+
+def api_loans(conn, params):
+    # GET /loans?email=&equipment=&status=&due_from=&due_to=&after=&limit=  (the grid filters)
+    loan_filter = LoanFilter(email=params.get('email'), equipment=params.get('equipment'), status=params.get('status'),
+                             due_from=params.get('due_from'), due_to=params.get('due_to'))
+    limit = api_page_size(params)
+    rows = loan_filter.fetch_page(conn, int(params.get('after', 0)), limit)
+    columns = ('id', 'date', 'email', 'equipment', 'due_date', 'status', 'version')
+    return {'loans': [dict(zip(columns, row)) for row in rows],
+            'next_after': rows[-1][0] if len(rows) == limit else None}
+
+
+def api_summary(conn, params):
+    # GET /summary?after=&limit=  (the Summary tab, paged by email)
+    limit = api_page_size(params)
+    rows = user_metrics(conn, after_email=params.get('after'), limit=limit)
+    columns = ('email', 'total_items', 'returned_on_time', 'returned_late', 'pending', 'standing')
+    return {'users': [dict(zip(columns, row)) for row in rows],
+            'next_after': rows[-1][0] if len(rows) == limit else None}
+
+
+def api_user(conn, params):
+    # GET /users/<email>  (one user's counts, as behind the trust index chart)
+    rows = user_metrics(conn, email=params['email'])
+    if not rows:
+        return None
+    columns = ('email', 'total_items', 'returned_on_time', 'returned_late', 'pending', 'standing')
+    return dict(zip(columns, rows[0]))
+
+
+def api_status(conn, params):
+    # GET /status?as_of=  (the overall equipment status chart)
+    as_of = params.get('as_of')
+    if as_of:
+        datetime.strptime(as_of, "%Y-%m-%d")
+        counts = status_counts_as_of(conn, as_of)
+    else:
+        counts = overall_status_counts(conn)
+    return {'as_of': as_of, 'counts': dict(zip(STATUS_LABELS, counts))}
+
+
+def api_equipment(conn, params):
+    # GET /equipment  (equipment types with their number of loans)
+    rows = conn.execute("SELECT t.Name, c.Loans FROM (SELECT EquipmentTypeID, COUNT(*) AS Loans FROM loans "
+                        "GROUP BY EquipmentTypeID) c LEFT JOIN equipment_types t ON t.ID = c.EquipmentTypeID "
+                        "ORDER BY t.Name")
+    return {'equipment': [{'equipment': name, 'loans': count} for name, count in rows]}
+
+
+class LoanApiServer:
+    # Minimal asyncio HTTP/1.1 server (GET only, keep-alive) answering JSON from pooled read connections.
+    # Responses carry an ETag made of the database's change sequence number (Usn) and the request, are cached
+    # until the Usn moves on, and a matching If-None-Match is answered with 304 Not Modified.
+    ROUTES = {'/loans': api_loans, '/summary': api_summary, '/status': api_status, '/equipment': api_equipment}
+
+    def __init__(self, db_file, pool_size=4, cache_entries=API_CACHE_ENTRIES):
+        self.db_file = db_file
+        self.pool = ReadPool(db_file, pool_size)
+        self.cache = OrderedDict()
+        self.cache_entries = cache_entries
+
+    async def serve(self, host='127.0.0.1', port=8080, ready=None):
+        import asyncio
+        server = await asyncio.start_server(self.handle_client, host, port)
+        if ready:
+            ready(server.sockets[0].getsockname())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.close()
+
+    async def handle_client(self, reader, writer):
+        import asyncio
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    status, body, etag = 400, {'error': 'Malformed request line'}, None
+                    keep_alive = False
+                else:
+                    method, target, version = parts
+                    status, body, etag = await self.respond(method, target, headers)
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                if isinstance(body, dict):
+                    body = json.dumps(body).encode()
+                head = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+                        "Content-Type: application/json", f"Content-Length: {len(body)}",
+                        "Connection: " + ("keep-alive" if keep_alive else "close")]
+                if etag:
+                    head.append(f"ETag: {etag}")
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, target, headers):
+        # (status, body bytes or dict, ETag)
+        import zlib
+        if method != 'GET':
+            return 405, {'error': 'Only GET is supported'}, None
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        handler = self.ROUTES.get(url.path)
+        if handler is None and url.path.startswith('/users/'):
+            handler = api_user
+            params['email'] = urllib.parse.unquote(url.path[len('/users/'):])
+        if handler is None:
+            return 404, {'error': f'Unknown path {url.path}'}, None
+
+        try:
+            usn = await self.pool.read(current_usn)
+            key = url.path + '?' + urllib.parse.urlencode(sorted(params.items()))
+            etag = f'"{usn}-{zlib.crc32(key.encode()):08x}"'
+            if headers.get('if-none-match') == etag:
+                return 304, b'', etag
+
+            cached = self.cache.get(key)
+            if cached and cached[0] == usn:
+                self.cache.move_to_end(key)
+                return 200, cached[1], etag
+
+            data = await self.pool.read(handler, params)
+            if data is None:
+                return 404, {'error': 'Not found'}, None
+            body = json.dumps(data).encode()
+            self.cache[key] = (usn, body)
+            self.cache.move_to_end(key)
+            if len(self.cache) > self.cache_entries:
+                self.cache.popitem(last=False)
+            return 200, body, etag
+        except ValueError as e:
+            return 400, {'error': str(e)}, None
+        except sqlite3.Error as e:
+            perf.error(f"api {url.path}", e)
+            return 500, {'error': 'Database error'}, None
+
+
+HTTP_REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+
+
+def trust_counts(conn, emails=None, today=None):
+    # {email: (returned on time, returned late with a past due date, total items)} of every user (or the given
+    # ones) in a single grouped query; these are the numbers behind the Trust Index chart
+    today = (today or datetime.now().date()).strftime('%Y-%m-%d')
+    sql = '''SELECT u.Email, SUM(l.Status = 'Returned'), SUM(l.Status LIKE 'Returned +%' AND l.DueDate < ?), COUNT(*)
+             FROM users u JOIN loans l ON l.UserID = u.ID'''
+    params = [today]
+    if emails is not None:
+        sql += f" WHERE u.Email IN ({', '.join('?' * len(emails))})"
+        params += list(emails)
+    return {row[0]: row[1:] for row in conn.execute(sql + " GROUP BY u.Email", params)}
+
+
+def draw_trust_pie(ax, returned_on_time, pending, total_items):
+    # The Trust Index pie of one user (on time / late / rest), drawn on an axis whose title and user label are set
+    if total_items > 0:
+        # Calculate percentages
+        on_time_pct = (returned_on_time / total_items) * 100
+        pending_pct = (pending / total_items) * 100
+        late_pct = 100 - on_time_pct - pending_pct
+
+        # Enhance the pie chart with a pseudo-3D effect
+        explode = (0.1, 0.1, 0.1)  # 'Explode' all slices a bit for a 3D effect
+        colors = ['green', 'red', 'grey']  # Adjust colors for a modern look
+        wedgeprops = {"edgecolor": "1", 'linewidth': 1, 'linestyle': 'solid', 'antialiased': True}
+
+        ax.pie(
+            [on_time_pct, pending_pct, late_pct],
+            labels=['', '', ''],
+            autopct='%1.1f%%',
+            startangle=90,
+            colors=colors,
+            explode=explode,
+            shadow=True,
+            wedgeprops=wedgeprops,
+            textprops={'weight': 'bold'}
+        )
+
+        ax.axis('equal')
+    else:
+        ax.axis('off')
+        ax.text(0.5, 0.5, 'No items to display', horizontalalignment='center',
+                verticalalignment='center', transform=ax.transAxes)
+
+
+def draw_status_pie(ax, sizes, title):
+    # The overall equipment status donut ([Pending, Returned On Time, Returned Late, Currently Late])
+    slice_colors = ['grey', 'green', 'red', 'orange']  # Define slice colors
+    wedges, texts, autotexts = ax.pie(
+        sizes,
+        autopct='%1.1f%%',
+        startangle=90,
+        colors=slice_colors,
+        wedgeprops={'edgecolor': 'white', 'linewidth': 1.0, 'width': 0.3},
+        textprops={'fontsize': 9, 'color': 'black', 'weight': 'bold'},
+        shadow=True
+    )
+
+    # Improve the autopct positioning
+    for autotext in autotexts:
+        autotext.set_color('black')
+        autotext.set_fontsize('10')
+
+    # Place the legend below the pie chart
+    ax.legend(
+        wedges,
+        STATUS_LABELS,
+        title="",
+        loc='upper center',
+        bbox_to_anchor=(0.5, -0.1),
+        frameon=False
+    )
+
+    # Equal aspect ratio ensures that pie is drawn as a circle
+    ax.axis('equal')
+    ax.set_title(title, loc='center', fontweight='bold')
+
+
+# Bump when the look of the report charts changes, so render-report redraws every chart
+REPORT_CHART_VERSION = 1
+REPORT_MANIFEST = 'manifest.json'
+
+
+def report_file_name(email):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', email.replace('@', '_at_')) + '.png'
+
+
+def render_report_chart(task):
+    # Draw one report chart to a PNG with the Agg backend (no display needed); runs in a worker process.
+    # task: ('user', email, counts, path) or ('overall', title, sizes, path)
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    kind, name, counts, path = task
+    figure = Figure(figsize=(4, 3), dpi=100)
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(111)
+    if kind == 'user':
+        ax.set_title('Trust Index', loc='center', fontweight='bold')
+        ax.set_xlabel(name.split('@')[0], fontsize=10, fontstyle='italic')
+        draw_trust_pie(ax, *counts)
+    else:
+        draw_status_pie(ax, counts, name)
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+
+def render_report(db_file, out_dir, pdf_file=None, workers=None, force=False):
+    # Render the overall status chart and every user's Trust Index chart into out_dir as PNGs, in parallel.
+    # A chart is only redrawn when its content hash (its numbers and the chart version) differs from the one
+    # stored in the manifest of the previous run. Optionally the charts are also collected into one PDF.
+    # Returns (charts drawn, charts skipped).
+    import concurrent.futures
+    import hashlib
+    os.makedirs(out_dir, exist_ok=True)
+    conn = open_db(db_file, profile='reporting')
+    try:
+        counts = trust_counts(conn)
+        sizes = overall_status_counts(conn)
+    finally:
+        conn.close()
+
+    manifest_path = os.path.join(out_dir, REPORT_MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    charts = [('overall', 'Overall Equipment Status', list(sizes), os.path.join(out_dir, 'overall.png'))]
+    charts += [('user', email, list(user_counts), os.path.join(out_dir, report_file_name(email)))
+               for email, user_counts in sorted(counts.items())]
+
+    hashes = {}
+    tasks = []
+    for chart in charts:
+        kind, name, numbers, path = chart
+        digest = hashlib.sha256(json.dumps([REPORT_CHART_VERSION, kind, name, numbers]).encode()).hexdigest()
+        hashes[path] = digest
+        if force or manifest.get(os.path.basename(path)) != digest or not os.path.exists(path):
+            tasks.append(chart)
+
+    if tasks:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render_report_chart, tasks, chunksize=16))
+
+    with open(manifest_path, 'w') as f:
+        json.dump({os.path.basename(path): digest for path, digest in hashes.items()}, f, indent=1)
+
+    if pdf_file:
+        write_report_pdf(pdf_file, [chart[3] for chart in charts])
+    return len(tasks), len(charts) - len(tasks)
+
+
+def write_report_pdf(pdf_file, image_files, per_page=6):
+    # Collect the rendered PNGs into one PDF, a grid of 2 x 3 charts per A4 page
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.image import imread
+
+    with PdfPages(pdf_file) as pdf:
+        for start in range(0, len(image_files), per_page):
+            figure = Figure(figsize=(8.27, 11.69))
+            FigureCanvasAgg(figure)
+            for index, image_file in enumerate(image_files[start:start + per_page]):
+                ax = figure.add_subplot(3, 2, index + 1)
+                ax.imshow(imread(image_file))
+                ax.axis('off')
+            figure.tight_layout()
+            pdf.savefig(figure)
+
+
+BACKUP_DIR = 'backups'
+BACKUP_KEEP = 10
+BACKUP_PAGES_PER_STEP = 256  # 1 MiB per step with the default 4 KiB pages
+BACKUP_MAX_RESTARTS = 3
+BACKUP_GZIP_LEVEL = 1  # Most of the size reduction at several times the speed of the default level
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+def backup_snapshots(db_file, backup_dir=BACKUP_DIR):
+    # Snapshots of a database in backup_dir, oldest first (the timestamp in the name sorts chronologically)
+    base = os.path.splitext(os.path.basename(db_file))[0]
+    pattern = re.compile(re.escape(base) + r'_\d{8}_\d{6}\.db(\.gz)?$')
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(os.path.join(backup_dir, name) for name in os.listdir(backup_dir) if pattern.match(name))
+
+
+def backup_database(db_file, backup_dir=BACKUP_DIR, compress=False, keep=BACKUP_KEEP, pages=BACKUP_PAGES_PER_STEP,
+                    progress=None):
+    # Snapshot a live database with SQLite's online backup API, a few pages per step so the other connections
+    # keep reading and writing in between. A write from another connection restarts the copy; after a few
+    # restarts the rest is copied in one step, which in WAL mode still doesn't block the writers. The snapshot
+    # only gets its timestamped name (gzipped if asked) once complete, then all but the newest `keep` snapshots
+    # are deleted. progress(copied_pages, total_pages) is called after every step, from the calling thread.
+    import gzip
+    os.makedirs(backup_dir, exist_ok=True)
+    base = os.path.splitext(os.path.basename(db_file))[0]
+    path = os.path.join(backup_dir, f"{base}_{datetime.now():%Y%m%d_%H%M%S}.db")
+    partial_path = path + '.part'
+    state = {'remaining': None, 'restarts': 0, 'steps': 0}
+
+    def on_step(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > BACKUP_MAX_RESTARTS and pages > 0:
+                raise BackupRestarted()
+        state['remaining'] = remaining
+        state['steps'] += 1
+        if progress:
+            progress(total - remaining, total)
+
+    started = time.perf_counter()
+    source = open_db(db_file)
+    try:
+        for step_pages in (pages, -1):
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            target = open_db(partial_path)
+            try:
+                source.backup(target, pages=step_pages, progress=on_step)
+                page_count = target.execute("PRAGMA page_count").fetchone()[0]
+                page_size = target.execute("PRAGMA page_size").fetchone()[0]
+                break
+            except BackupRestarted:
+                pages = -1
+                state['remaining'] = None
+            finally:
+                target.close()
+    except Exception:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    finally:
+        source.close()
+    copy_seconds = time.perf_counter() - started
+
+    if compress:
+        with open(partial_path, 'rb') as src, gzip.open(path + '.gz.part', 'wb', compresslevel=BACKUP_GZIP_LEVEL) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.remove(partial_path)
+        path += '.gz'
+        partial_path = path + '.part'
+    os.replace(partial_path, path)
+
+    for old_snapshot in backup_snapshots(db_file, backup_dir)[:-max(keep, 1)]:
+        os.remove(old_snapshot)
+
+    seconds = time.perf_counter() - started
+    size = page_count * page_size
+    return {'path': path, 'bytes': size, 'file_bytes': os.path.getsize(path), 'steps': state['steps'],
+            'restarts': state['restarts'], 'copy_seconds': round(copy_seconds, 2), 'seconds': round(seconds, 2),
+            'mb_per_s': round(size / 1048576 / max(seconds, 1e-9), 1)}
+
+
+def standard_view_timings(conn, repeat=3):
+    # Median milliseconds of the queries behind the standard views: the grid, the status chart, the summary tab,
+    # the Trust Index, the borrower list and the overdue filter
+    views = [
+        ('grid', lambda: conn.execute("SELECT ID, Date, Email, Equipment, DueDate, Status FROM equipment "
+                                      "ORDER BY Date DESC").fetchall()),
+        ('status counts', lambda: overall_status_counts(conn)),
+        ('user metrics', lambda: user_metrics(conn)),
+        ('trust counts', lambda: trust_counts(conn)),
+        ('borrowers', lambda: borrower_emails(conn)),
+        ('overdue filter', lambda: LoanFilter(status='Overdue').fetch(conn)),
+    ]
+    timings = {}
+    for name, query in views:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query()
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[name] = round(sorted(samples)[len(samples) // 2], 2)
+    return timings
+
+
+def database_pages(conn):
+    return {name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+            for name in ('page_count', 'freelist_count', 'page_size', 'auto_vacuum')}
+
+
+def run_maintenance(db_file, full_vacuum=False, max_seconds=None, should_stop=None, timings=True):
+    # ANALYZE (sampled) and PRAGMA optimize for the query planner, an incremental vacuum in short slices, a
+    # quick integrity check and a WAL checkpoint. Free pages can only be given back incrementally once the file
+    # is in auto_vacuum=INCREMENTAL mode, which takes one full VACUUM (full_vacuum=True; it blocks other writers
+    # while it runs). The vacuum stops after max_seconds or when should_stop() returns True.
+    # Returns a report dict, which is also stored in app_state.
+    conn = open_db(db_file)
+    report = {'database': db_file, 'started': datetime.now().isoformat(timespec='seconds')}
+    try:
+        ensure_app_state(conn)
+        before = database_pages(conn)
+        report['pages_before'] = before['page_count']
+        report['free_before'] = before['freelist_count']
+        if timings:
+            report['before_ms'] = standard_view_timings(conn)
+
+        started = time.perf_counter()
+        page_size = STORAGE_PROFILES[get_state(conn, 'storage_profile', DEFAULT_STORAGE_PROFILE)]['page_size']
+        if full_vacuum and (before['auto_vacuum'] != 2 or before['page_size'] != page_size):
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # The page size of a WAL database can't change, so the rebuild leaves WAL mode for a moment. That only
+            # works while no other connection is open; otherwise the page size stays as it is.
+            if before['page_size'] != page_size and \
+                    conn.execute("PRAGMA journal_mode=DELETE").fetchone()[0].lower() == 'delete':
+                conn.execute(f"PRAGMA page_size={page_size}")
+                conn.execute("VACUUM")
+                conn.execute("PRAGMA journal_mode=WAL")
+            else:
+                conn.execute("VACUUM")
+            report['full_vacuum_seconds'] = round(time.perf_counter() - started, 2)
+
+        started = time.perf_counter()
+        conn.execute("PRAGMA analysis_limit=1000")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        report['analyze_seconds'] = round(time.perf_counter() - started, 2)
+
+        report['auto_vacuum'] = ('none', 'full', 'incremental')[conn.execute("PRAGMA auto_vacuum").fetchone()[0]]
+        slices = 0
+        started = time.perf_counter()
+        if report['auto_vacuum'] == 'incremental':
+            while conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                if (should_stop and should_stop()) or (max_seconds and time.perf_counter() - started > max_seconds):
+                    break
+                slice_started = time.perf_counter()
+                while time.perf_counter() - slice_started < MAINTENANCE_SLICE_SECONDS:
+                    # executescript() runs the pragma to the end, execute() would only free one page per call
+                    conn.executescript(f"PRAGMA incremental_vacuum({MAINTENANCE_VACUUM_PAGES});")
+                    if not conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                        break
+                slices += 1
+                time.sleep(MAINTENANCE_SLICE_PAUSE)
+        report['vacuum_slices'] = slices
+        report['vacuum_seconds'] = round(time.perf_counter() - started, 2)
+
+        started = time.perf_counter()
+        problems = [row[0] for row in conn.execute("PRAGMA quick_check(20)")]
+        report['integrity'] = 'ok' if problems == ['ok'] else problems
+        report['check_seconds'] = round(time.perf_counter() - started, 2)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+
+        after = database_pages(conn)
+        report['pages_after'] = after['page_count']
+        report['free_after'] = after['freelist_count']
+        # In pages of the old size, in case the full vacuum changed the page size
+        report['reclaimed_pages'] = before['page_count'] - after['page_count'] * after['page_size'] // before['page_size']
+        report['file_bytes'] = os.path.getsize(db_file)
+        if timings:
+            report['after_ms'] = standard_view_timings(conn)
+
+        set_state(conn, 'maintenance_watermark', datetime.now().strftime('%Y-%m-%d'))
+        set_state(conn, 'maintenance_report', json.dumps(report))
+        conn.commit()
+    finally:
+        conn.close()
+    return report
+
+
+def maintenance_due(db_file, today=None):
+    # True when maintenance didn't run on this database in the last MAINTENANCE_INTERVAL_DAYS days
+    today = today or datetime.now().date()
+    conn = open_db(db_file)
+    try:
+        ensure_app_state(conn)
+        watermark = get_state(conn, 'maintenance_watermark', '')
+    finally:
+        conn.close()
+    return watermark < (today - timedelta(days=MAINTENANCE_INTERVAL_DAYS)).strftime('%Y-%m-%d')
+
+
+def format_maintenance_report(report):
+    lines = [f"Pages: {report['pages_before']} -> {report['pages_after']} ({report['reclaimed_pages']} reclaimed, "
+             f"{report['free_after']} still free, auto_vacuum {report['auto_vacuum']}), file {report['file_bytes'] / 1048576:.1f} MB",
+             f"ANALYZE/optimize {report['analyze_seconds']} s, vacuum {report['vacuum_seconds']} s in "
+             f"{report['vacuum_slices']} slices, quick check {report['check_seconds']} s: "
+             f"{report['integrity'] if report['integrity'] == 'ok' else '; '.join(report['integrity'])}"]
+    if 'full_vacuum_seconds' in report:
+        lines.append(f"Full VACUUM (switch to incremental vacuum) {report['full_vacuum_seconds']} s")
+    if report['auto_vacuum'] != 'incremental' and report['free_after']:
+        lines.append(f"{report['free_after']} free pages can't be reclaimed until maintenance runs once "
+                     "with a full vacuum.")
+    if 'before_ms' in report:
+        lines.append(f"{'View':<16}{'Before ms':>11}{'After ms':>10}")
+        for name, before_ms in report['before_ms'].items():
+            lines.append(f"{name:<16}{before_ms:>11.2f}{report['after_ms'][name]:>10.2f}")
+    return '\n'.join(lines)
+
+
+def calibration_workload(db_file, profile, repeat=3, writes=200):
+    # Milliseconds of the standard workload with the given storage profile, one connection per operation like the
+    # app: the standard views (median of repeat runs), writes single loan updates committed one by one like
+    # update_loan, and one 1000-loan import in a single transaction
+    import random
+    samples = {}
+    for _ in range(repeat):
+        conn = open_db(db_file, profile=profile)
+        try:
+            for name, ms in standard_view_timings(conn, repeat=1).items():
+                samples.setdefault(name, []).append(ms)
+        finally:
+            conn.close()
+    timings = {name: sorted(values)[len(values) // 2] for name, values in samples.items()}
+
+    conn = open_db(db_file, profile=profile)
+    try:
+        max_id = conn.execute("SELECT MAX(ID) FROM loans").fetchone()[0] or 1
+        emails = borrower_emails(conn)[:100] or ['calibration@example.com']
+    finally:
+        conn.close()
+    rng = random.Random(1)
+    started = time.perf_counter()
+    for _ in range(writes):
+        conn = open_db(db_file, profile=profile)
+        try:
+            conn.execute("UPDATE loans SET Status = 'Returned', RowVersion = RowVersion + 1 WHERE ID = ?",
+                         (rng.randint(1, max_id),))
+            conn.commit()
+        finally:
+            conn.close()
+    timings[f"{writes} updates"] = (time.perf_counter() - started) * 1000
+
+    today = datetime.now().strftime("%Y-%m-%d")
+    started = time.perf_counter()
+    conn = open_db(db_file, profile=profile)
+    try:
+        insert_loans(conn, [(today, rng.choice(emails), rng.choice(BENCH_EQUIPMENT_TYPES), today, 'Not Returned', None)
+                            for _ in range(1000)])
+        conn.commit()
+    finally:
+        conn.close()
+    timings['1000-loan import'] = (time.perf_counter() - started) * 1000
+    return {name: round(ms, 2) for name, ms in timings.items()}
+
+
+def calibrate_storage(db_file, repeat=3, writes=200):
+    # Run the standard workload with every storage profile on copies of the database, rebuilt at the profile's
+    # page size. The copies are made next to the database so they are measured on the same storage. The fastest
+    # safe profile is recommended; the report is stored in the database's app_state.
+    work_dir = tempfile.mkdtemp(prefix='techtacho_calibrate_', dir=os.path.dirname(os.path.abspath(db_file)))
+    results = {}
+    try:
+        bases = {}
+        for name, profile in STORAGE_PROFILES.items():
+            page_size = profile['page_size']
+            if page_size not in bases:
+                bases[page_size] = os.path.join(work_dir, f"base_{page_size}.db")
+                source = open_db(db_file)
+                copy = open_db(bases[page_size])
+                try:
+                    source.backup(copy)
+                    copy.execute("PRAGMA journal_mode=DELETE")
+                    copy.execute(f"PRAGMA page_size={page_size}")
+                    copy.execute("VACUUM")
+                    copy.execute("PRAGMA journal_mode=WAL")
+                finally:
+                    copy.close()
+                    source.close()
+            # Each profile gets a fresh copy, so the writes of one run don't change the next one's data
+            run_file = os.path.join(work_dir, 'run.db')
+            shutil.copyfile(bases[page_size], run_file)
+            timings = calibration_workload(run_file, name, repeat, writes)
+            timings['total'] = round(sum(timings.values()), 2)
+            results[name] = timings
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(run_file + suffix):
+                    os.remove(run_file + suffix)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    recommended = min((name for name in results if STORAGE_PROFILES[name]['safe']),
+                      key=lambda name: results[name]['total'])
+    report = {'database': db_file, 'calibrated': datetime.now().isoformat(timespec='seconds'),
+              'results': results, 'recommended': recommended}
+    conn = open_db(db_file)
+    try:
+        ensure_app_state(conn)
+        set_state(conn, 'storage_calibration', json.dumps(report))
+        conn.commit()
+    finally:
+        conn.close()
+    return report
+
+
+def set_storage_profile(db_file, name):
+    # Every later connection to the database (in this and other sessions) is opened with this profile
+    conn = open_db(db_file)
+    try:
+        ensure_app_state(conn)
+        set_state(conn, 'storage_profile', name)
+        conn.commit()
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        conn.close()
+    _storage_profiles[os.path.abspath(db_file)] = name
+    return page_size
+
+
+# Columns of a loan exchanged by sync
+SYNC_FIELDS = ('Date', 'Email', 'Equipment', 'DueDate', 'Status', 'ReturnDate')
+# The change log is looked up by key explicitly: its statistics are often from when it was still empty, and the
+# planner would then scan it
+SYNC_LOAN_SQL = '''SELECT l.ID, l.Date, u.Email, t.Name, l.DueDate, l.Status, l.ReturnDate,
+                           (SELECT ChangedAt FROM equipment_changes WHERE ID = l.ID)
+                    FROM loans l LEFT JOIN users u ON u.ID = l.UserID
+                    LEFT JOIN equipment_types t ON t.ID = l.EquipmentTypeID'''
+
+
+def database_id(conn, db_file, renew=False):
+    # Random ID of a database file, under which its sync peers keep their watermarks. A copy of the file gets its
+    # own ID once it is opened at another path, or when sync finds that both files still have the same one.
+    # A moved file can't be told from a copy, so it gets a new ID too; its next sync sends all its loans once,
+    # and the peer, which has them all, applies none.
+    path = os.path.abspath(db_file)
+    db_id = get_state(conn, 'database_id')
+    if renew or db_id is None or get_state(conn, 'database_path') != path:
+        db_id = os.urandom(16).hex()
+        set_state(conn, 'database_id', db_id)
+        set_state(conn, 'database_path', path)
+    return db_id
+
+
+def sync_version(changed_at, deleted, values):
+    # Versions of a loan compare by the time of the change, then deletion over update, then by their values,
+    # so two copies always agree on which one wins
+    return changed_at or '', deleted, tuple('' if value is None else str(value) for value in values)
+
+
+def sync_changes(conn, since):
+    # Changes to loans after Usn since: (sync key, deleted, changed at, values in SYNC_FIELDS order)
+    rows = conn.execute('''SELECT COALESCE(l.Uid, c.Uid, 'L' || c.ID), c.Deleted OR l.ID IS NULL, c.ChangedAt,
+                                   l.Date, u.Email, t.Name, l.DueDate, l.Status, l.ReturnDate
+                            FROM equipment_changes c LEFT JOIN loans l ON l.ID = c.ID
+                            LEFT JOIN users u ON u.ID = l.UserID LEFT JOIN equipment_types t ON t.ID = l.EquipmentTypeID
+                            WHERE c.Usn > ? ORDER BY c.Usn''', (since,))
+    return [(key, deleted, changed_at, () if deleted else values)
+            for key, deleted, changed_at, *values in rows]
+
+
+def local_sync_version(conn, key):
+    # (ID, version, values) of the loan with the given sync key in this copy; the ID and values are None once it
+    # was deleted here and the version None if this copy never had it
+    legacy_id = int(key[1:]) if key.startswith('L') else None
+    row = conn.execute(f"{SYNC_LOAN_SQL} WHERE l.Uid = ?", (key,)).fetchone()
+    if row is None and legacy_id is not None:
+        row = conn.execute(f"{SYNC_LOAN_SQL} WHERE l.ID = ? AND l.Uid IS NULL", (legacy_id,)).fetchone()
+    if row:
+        return row[0], sync_version(row[7], 0, row[1:7]), row[1:7]
+    tombstone = conn.execute("SELECT ChangedAt FROM equipment_changes INDEXED BY idx_equipment_changes_uid "
+                             "WHERE Deleted = 1 AND Uid = ? "
+                             "UNION ALL SELECT ChangedAt FROM equipment_changes WHERE Deleted = 1 AND ID = ? "
+                             "AND Uid IS NULL", (key, legacy_id)).fetchone()
+    return None, (sync_version(tombstone[0], 1, ()) if tombstone else None), None
+
+
+def current_sync_change(conn, key):
+    # This copy's version of a loan as a change, to send back to a copy whose own change of it lost
+    loan_id, (changed_at, deleted, _), values = local_sync_version(conn, key)
+    return key, deleted, changed_at, values or ()
+
+
+def apply_sync_changes(conn, changes, newer=None):
+    # Apply another copy's changes where they win over this copy's version of the loan; returns how many did.
+    # The keys of loans whose version here is newer than the change are added to newer.
+    applied = 0
+    for key, deleted, changed_at, values in changes:
+        loan_id, current, current_values = local_sync_version(conn, key)
+        version = sync_version(changed_at, deleted, values)
+        if current is not None and current >= version:
+            if newer is not None and current > version:
+                newer.append(key)
+            continue
+        if deleted:
+            if loan_id is None:
+                continue
+            conn.execute("DELETE FROM loans WHERE ID = ?", (loan_id,))
+        elif loan_id is None:
+            loan_id = insert_loans(conn, [tuple(values) + (key,)])
+        else:
+            # Only the columns that differ, so the search and interval triggers only run when their columns change
+            fields = {field: value for field, value, current_value in zip(SYNC_FIELDS, values, current_values)
+                      if value != current_value}
+            assignments, params = loan_assignments(conn, fields)
+            conn.execute(f"UPDATE loans SET {assignments + ', ' if fields else ''}RowVersion = RowVersion + 1 "
+                         "WHERE ID = ?", params + [loan_id])
+        # The change keeps the time it was made at in the other copy, so the versions compare alike everywhere
+        conn.execute("UPDATE equipment_changes SET ChangedAt = ? WHERE ID = ?", (changed_at, loan_id))
+        applied += 1
+    return applied
+
+
+def sync_databases(db_file, peer_file):
+    # Exchange the loans changed since the last sync between two copies of a database, both ways. Each copy keeps,
+    # per peer, the peer's Usn up to which it has the peer's changes, and stores it in the transaction that
+    # applies them. Where both copies changed a loan the later change wins (sync_version). Returns a report dict.
+    for path in (db_file, peer_file):
+        prepare_database(path)
+    started = time.perf_counter()
+    conn = open_db(db_file)
+    peer = open_db(peer_file)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        peer.execute("BEGIN IMMEDIATE")
+        local_id = database_id(conn, db_file)
+        peer_id = database_id(peer, peer_file)
+        if peer_id == local_id:
+            peer_id = database_id(peer, peer_file, renew=True)
+
+        local_top = current_usn(conn)
+        outgoing = sync_changes(conn, int(get_state(peer, f'sync_received:{local_id}', 0)))
+        incoming = sync_changes(peer, int(get_state(conn, f'sync_received:{peer_id}', 0)))
+        # A change that loses against a version the other copy has had since before its watermark (an older
+        # ChangedAt, e.g. from a clock running behind) would leave the copies apart; the winner goes back instead
+        newer_there = []
+        newer_here = []
+        applied_there = apply_sync_changes(peer, outgoing, newer_there)
+        incoming_keys = {change[0] for change in incoming}
+        applied_here = apply_sync_changes(conn, incoming + [current_sync_change(peer, key) for key in newer_there
+                                                            if key not in incoming_keys], newer_here)
+        sent_keys = {change[0] for change in outgoing}
+        applied_there += apply_sync_changes(peer, [current_sync_change(conn, key) for key in newer_here
+                                                   if key not in sent_keys])
+
+        # The peer is committed first and only notes this copy's changes from before the sync: what the sync
+        # writes here comes back once next time and is skipped as identical. This copy can then skip the
+        # peer's changes written by the sync, which are already committed.
+        set_state(peer, f'sync_received:{local_id}', str(local_top))
+        peer.commit()
+        set_state(conn, f'sync_received:{peer_id}', str(current_usn(peer)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        peer.rollback()
+        raise
+    finally:
+        conn.close()
+        peer.close()
+
+    seconds = time.perf_counter() - started
+    return {'sent': len(outgoing), 'received': len(incoming), 'applied_there': applied_there,
+            'applied_here': applied_here, 'conflicts': sum(1 for change in incoming if change[0] in sent_keys),
+            'seconds': round(seconds, 2), 'rows_per_s': round((len(outgoing) + len(incoming)) / max(seconds, 1e-9))}
+
+
+def format_sync_report(report):
+    return (f"Sent {report['sent']} changed loans ({report['applied_there']} applied), received {report['received']} "
+            f"({report['applied_here']} applied), {report['conflicts']} changed on both sides, "
+            f"in {report['seconds']} s ({report['rows_per_s']} rows/s)")
+
+
+def display_status(status, due_date, current_date):
+    # Status text and row tag shown in the grid for a stored status: open loans past their due date show
+    # '+days overdue', stale '+N' statuses of loans that are no longer overdue show 'Not Returned'
+    status = str(status)
+    if status.startswith('Returned'):
+        return status, 'returned'
+    try:
+        due = datetime.strptime(due_date, "%Y-%m-%d").date() if due_date else None
+    except ValueError:
+        due = None
+    if due is not None and (status == 'Not Returned' or status.startswith('+')):
+        if due < current_date:
+            return f"+{(current_date - due).days}", 'overdue'
+        if status.startswith('+'):
+            return 'Not Returned', 'default'
+    return status, 'default'
+
+
+class LoanStore:
+    # Compact in-memory model of the loans behind the grid. Every column is an array of machine integers;
+    # the text columns hold indexes into one pool of interned strings, so each distinct email, equipment
+    # name, date or status is stored once. Rows are kept sorted by loan ID (binary search lookups) and
+    # `order` holds the loan IDs in display order.
+    TEXT_COLUMNS = ('Date', 'Email', 'Equipment', 'DueDate', 'Status')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ids = array('q')
+        self.order = array('q')
+        self.columns = {name: array('i') for name in self.TEXT_COLUMNS}
+        self.versions = array('i')
+        self.strings = []
+        self.string_index = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, value):
+        index = self.string_index.get(value)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(value)
+            self.string_index[value] = index
+        return index
+
+    def load(self, rows):
+        # rows: (ID, Date, Email, Equipment, DueDate, Status, RowVersion) tuples in display order
+        self.clear()
+        for row in rows:
+            self.order.append(row[0])
+        for row in sorted(rows, key=itemgetter(0)):
+            self._append(row)
+
+    def _append(self, row):
+        self.ids.append(row[0])
+        for name, value in zip(self.TEXT_COLUMNS, row[1:6]):
+            self.columns[name].append(self.intern(value))
+        self.versions.append(row[6])
+
+    def position(self, loan_id):
+        loan_id = int(loan_id)
+        position = bisect_left(self.ids, loan_id)
+        if position < len(self.ids) and self.ids[position] == loan_id:
+            return position
+        return None
+
+    def __contains__(self, loan_id):
+        return self.position(loan_id) is not None
+
+    def _row_at(self, position):
+        return (self.ids[position],) + tuple(self.strings[self.columns[name][position]] for name in self.TEXT_COLUMNS)
+
+    def row(self, loan_id):
+        # (ID, Date, Email, Equipment, DueDate, Status) of a loan, or None
+        position = self.position(loan_id)
+        return None if position is None else self._row_at(position)
+
+    def page(self, count):
+        # The first `count` loans in display order as (ID, Date, Email, Equipment, DueDate, Status, RowVersion)
+        page = []
+        for loan_id in islice(self.order, count):
+            position = self.position(loan_id)
+            page.append(self._row_at(position) + (self.versions[position],))
+        return page
+
+    def get(self, loan_id, column):
+        position = self.position(loan_id)
+        if position is None:
+            return None
+        if column == 'RowVersion':
+            return self.versions[position]
+        return self.strings[self.columns[column][position]]
+
+    def set(self, loan_id, **values):
+        # Columns the grid doesn't show (e.g. ReturnDate) are not stored and are skipped
+        position = self.position(loan_id)
+        if position is None:
+            return
+        for column, value in values.items():
+            if column == 'RowVersion':
+                self.versions[position] = value
+            elif column in self.columns:
+                self.columns[column][position] = self.intern(value)
+
+    def upsert(self, row, first=False):
+        # Insert or replace a (ID, ..., RowVersion) row; new loans go to the end (or the top) of the display order
+        position = self.position(row[0])
+        if position is not None:
+            self.set(row[0], **dict(zip(self.TEXT_COLUMNS, row[1:6])), RowVersion=row[6])
+            return
+        position = bisect_left(self.ids, row[0])
+        if position == len(self.ids):
+            self._append(row)
+        else:
+            self.ids.insert(position, row[0])
+            for name, value in zip(self.TEXT_COLUMNS, row[1:6]):
+                self.columns[name].insert(position, self.intern(value))
+            self.versions.insert(position, row[6])
+        if first:
+            self.order.insert(0, row[0])
+        else:
+            self.order.append(row[0])
+
+    def remove(self, *loan_ids):
+        # One loan is cut out of the arrays in place; for several every array is rebuilt once, so a bulk delete
+        # stays linear
+        positions = {position for position in map(self.position, loan_ids) if position is not None}
+        if not positions:
+            return
+        if len(positions) == 1:
+            position = positions.pop()
+            loan_id = self.ids[position]
+            del self.ids[position]
+            for name in self.TEXT_COLUMNS:
+                del self.columns[name][position]
+            del self.versions[position]
+            self.order.remove(loan_id)
+            return
+        removed = {self.ids[position] for position in positions}
+        kept = [position for position in range(len(self.ids)) if position not in positions]
+        self.ids = array('q', (self.ids[position] for position in kept))
+        for name in self.TEXT_COLUMNS:
+            column = self.columns[name]
+            self.columns[name] = array('i', (column[position] for position in kept))
+        self.versions = array('i', (self.versions[position] for position in kept))
+        self.order = array('q', (loan_id for loan_id in self.order if loan_id not in removed))
+
+    def rows(self):
+        # (ID, Date, Email, Equipment, DueDate, Status) tuples in display order
+        strings = self.strings
+        ids = self.ids
+        date, email, equipment, due_date, status = (self.columns[name] for name in self.TEXT_COLUMNS)
+        for loan_id in self.order:
+            position = bisect_left(ids, loan_id)
+            yield (loan_id, strings[date[position]], strings[email[position]], strings[equipment[position]],
+                   strings[due_date[position]], strings[status[position]])
+
+    def sort(self, column=None, reverse=False, key=None):
+        # Reorder the display order by a column, or by key(row) for computed values
+        if key is None:
+            strings, values = self.strings, self.columns[column]
+            positions = sorted(range(len(self.ids)), key=lambda position: strings[values[position]], reverse=reverse)
+            self.order = array('q', (self.ids[position] for position in positions))
+        else:
+            self.order = array('q', (row[0] for row in sorted(self.rows(), key=key, reverse=reverse)))
+
+    def copy(self):
+        store = LoanStore()
+        store.ids = array('q', self.ids)
+        store.order = array('q', self.order)
+        store.columns = {name: array('i', column) for name, column in self.columns.items()}
+        store.versions = array('i', self.versions)
+        store.strings = list(self.strings)
+        store.string_index = dict(self.string_index)
+        return store
+
+    def nbytes(self):
+        # Approximate memory used by the store: the arrays plus the interned strings and their index
+        arrays = [self.ids, self.order, self.versions] + list(self.columns.values())
+        total = sum(column.itemsize * column.buffer_info()[1] for column in arrays)
+        total += sys.getsizeof(self.strings) + sys.getsizeof(self.string_index)
+        total += sum(sys.getsizeof(value) for value in self.strings)
+        return total
+
+
+class ResultCache:
+    # Least recently used cache of grid result sets (loan stores), keyed by (database, filter, sort). Every
+    # entry remembers the database's change sequence number (Usn) it was read at and is only served while the
+    # database is still at that Usn, so any change, from this app or another clerk, invalidates it.
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, usn):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != usn:
+            if entry is not None:
+                self.discard(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1].copy()
+
+    def peek(self, key):
+        # The cached store itself (not a copy, whatever Usn it was read at) for reading, or None; doesn't count
+        # as a hit or miss
+        entry = self.entries.get(key)
+        return entry[1] if entry is not None else None
+
+    def put(self, key, usn, store):
+        self.discard(key)
+        size = store.nbytes()
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (usn, store.copy(), size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+result_cache = ResultCache()
+
+
+class DatabaseSession:
+    # What the tabs show about the open database besides the grid: the users CSV, the borrowers, the equipment
+    # types, the per-user metrics and the status counts. Each is loaded the first time a tab asks for it and
+    # then shared by all tabs, so switching databases reads the CSV and runs each of these queries once.
+    # changed() drops the query results after a write; add_user() keeps the CSV list current; revalidate()
+    # keeps what is still current when the same database is selected again.
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.emails_file = f"{os.path.splitext(db_file)[0]}_users.csv"
+        self.users = None
+        self.users_mtime = None
+        self.data = {}
+        self.loaded = {}  # dataset name -> (Usn, day) it was read at, for the startup snapshot
+        self.tag = None  # (Usn, day) of the database when the current datasets started loading
+
+    def user_emails(self):
+        if self.users is None:
+            # Every database has its users CSV, an empty one is created on first use
+            if not os.path.exists(self.emails_file):
+                pd.DataFrame(columns=['User Email']).to_csv(self.emails_file, index=False)
+            perf.count('file_reads')
+            try:
+                self.users_mtime = os.path.getmtime(self.emails_file)
+                df = pd.read_csv(self.emails_file)
+                self.users = df['User Email'].dropna().unique().tolist()
+            except Exception as e:
+                print(f"An error occurred while loading the CSV: {e}")
+                self.users = []
+        return self.users
+
+    def add_user(self, email):
+        # Appends a new email to the CSV (and the loaded list); known emails are left alone
+        return bool(self.add_users([email]))
+
+    def add_users(self, new_emails):
+        # Appends all new emails to the CSV in one write; returns the ones that were added
+        emails = self.user_emails()
+        known = set(emails)
+        added = []
+        for email in new_emails:
+            if email not in known:
+                known.add(email)
+                added.append(email)
+        if added:
+            pd.DataFrame({'User Email': added}).to_csv(self.emails_file, mode='a', header=False, index=False)
+            emails.extend(added)
+            self.users_mtime = os.path.getmtime(self.emails_file)
+        return added
+
+    def load(self, name, query):
+        # A database error is raised to the tab, which can tell it from an empty result; nothing is kept
+        if name not in self.data:
+            conn = open_db(self.db_file)
+            try:
+                tag = self.current_tag(conn)
+                self.data[name] = query(conn)
+                self.loaded[name] = tag
+            finally:
+                conn.close()
+        return self.data[name]
+
+    def borrower_emails(self):
+        return self.load('borrowers', borrower_emails)
+
+    def equipment_types(self):
+        return self.load('equipment', equipment_names)
+
+    def user_metrics(self):
+        return self.load('user_metrics', user_metrics)
+
+    def status_counts(self):
+        return self.load('status_counts', overall_status_counts)
+
+    def current_tag(self, conn):
+        # Read once until the next change; datasets loaded later can only be newer than it, which makes the
+        # startup snapshot leave them out rather than trust stale ones
+        if self.tag is None:
+            self.tag = (current_usn(conn), datetime.now().strftime('%Y-%m-%d'))
+        return self.tag
+
+    def revalidate(self):
+        # The same database was selected again: the CSV is read again only if the file changed, a dataset only
+        # if the database changed since it was read (or the day did, the metrics depend on it)
+        try:
+            if self.users is not None and os.path.getmtime(self.emails_file) != self.users_mtime:
+                self.users = None
+        except OSError:
+            self.users = None
+        self.tag = None
+        conn = open_db(self.db_file)
+        try:
+            tag = self.current_tag(conn)
+        except sqlite3.Error as e:
+            # Nothing can be confirmed current, so every dataset is read again
+            perf.error(f"revalidate {self.db_file}", e)
+            tag = None
+        finally:
+            conn.close()
+        for name in list(self.data):
+            if self.loaded.get(name) != tag:
+                del self.data[name]
+                self.loaded.pop(name, None)
+
+    def changed(self):
+        self.data.clear()
+        self.loaded.clear()
+        self.tag = None
+
+    def restore(self, name, value, tag):
+        # A dataset from the startup snapshot, served until it is revalidated
+        self.data[name] = value
+        self.loaded[name] = tag
+
+
+# Session datasets kept in the startup snapshot and how to read them again
+SNAPSHOT_DATASETS = {'status_counts': overall_status_counts, 'user_metrics': user_metrics}
+
+
+def database_stamp(db_file):
+    # Modification time and size of the database file and its WAL; any commit changes one of them
+    stamp = []
+    for path in (db_file, db_file + '-wal'):
+        try:
+            stat = os.stat(path)
+            stamp.append([stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+
+def save_startup_snapshot(db_file, session, rows, path=SNAPSHOT_FILE):
+    # Write what the next launch paints first: the given first page of the grid and the session datasets that
+    # are current, tagged with the database's Usn, the day and the file stamp. A PRAGMA data_version is only
+    # comparable within one connection, so the Usn stands for the data across runs.
+    today = datetime.now().strftime('%Y-%m-%d')
+    conn = open_db(db_file)
+    try:
+        usn = current_usn(conn)
+    finally:
+        conn.close()
+    data = {}
+    if session is not None and session.db_file == db_file:
+        data = {name: value for name, value in session.data.items()
+                if name in SNAPSHOT_DATASETS and session.loaded.get(name) == (usn, today)}
+    # Stamped after the connection is closed, closing the last one may checkpoint the WAL into the file
+    snapshot = {'format': SNAPSHOT_FORMAT, 'db': os.path.abspath(db_file), 'usn': usn, 'date': today, 'stamp': database_stamp(db_file),
+                'rows': rows, 'data': data}
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(path + '.tmp', path)
+
+
+def read_startup_snapshot(db_file, path=SNAPSHOT_FILE):
+    # The snapshot written on the last close if it belongs to this database, else None
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+        if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('db') != os.path.abspath(db_file):
+            return None
+        snapshot['rows'] = [tuple(row) for row in snapshot['rows']]
+        if 'user_metrics' in snapshot['data']:
+            snapshot['data']['user_metrics'] = [tuple(row) for row in snapshot['data']['user_metrics']]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+    return snapshot
+
+
+def revalidate_snapshot(db_file, snapshot, stamp):
+    # Read what the painted snapshot stands for; returns (Usn, full grid store, {dataset: fresh value}). The
+    # datasets are only read again if the file (by its stamp from before it was opened) or the Usn changed, or
+    # the day did (the metrics depend on it). The grid is always loaded, the snapshot only has its first page.
+    today = datetime.now().strftime('%Y-%m-%d')
+    conn = open_db(db_file)
+    try:
+        usn = current_usn(conn)
+        current = snapshot['date'] == today and (snapshot['stamp'] == stamp or snapshot['usn'] == usn)
+        fresh = {}
+        if not current:
+            for name in snapshot['data']:
+                fresh[name] = SNAPSHOT_DATASETS[name](conn)
+        rows = conn.execute("SELECT ID, Date, Email, Equipment, DueDate, Status, RowVersion FROM equipment").fetchall()
+    finally:
+        conn.close()
+    store = LoanStore()
+    store.load(rows)
+    store.sort('Date', reverse=True)
+    return usn, store, fresh
+
+
+class ScanSession:
+    # Barcode scans resolved against an in-memory index of the open loans. A loan ID ('123' or 'L123') returns
+    # that loan, an email selects the user, and an equipment name returns the user's open loan of it with the
+    # earliest due date (or lends one in check-out mode). The resulting writes collect in `pending` until they
+    # are committed in one batch by commit_scans().
+    def __init__(self, db_file, loan_days=SCAN_LOAN_DAYS):
+        self.db_file = db_file
+        self.loan_days = loan_days
+        self.checkout = False
+        self.user = None
+        self.loans = {}  # loan ID -> (email, equipment, due date, row version) of the open loans
+        self.by_user = {}  # (email, equipment) in lower case -> IDs of its open loans, earliest due date first
+        self.open_counts = {}  # email in lower case -> number of open loans
+        self.users = {}  # lower case -> email
+        self.equipment = {}  # lower case -> equipment name
+        self.pending = []
+
+    def load(self):
+        conn = open_db(self.db_file)
+        try:
+            rows = conn.execute(f"SELECT ID, Email, Equipment, DueDate, RowVersion FROM equipment "
+                                f"WHERE Status = 'Not Returned' OR {OVERDUE_STATUS_SQL} ORDER BY DueDate").fetchall()
+            self.users = {email.lower(): email for email, in conn.execute("SELECT Email FROM users")}
+            self.equipment = {name.lower(): name for name, in conn.execute("SELECT Name FROM equipment_types")}
+        finally:
+            conn.close()
+        for row in rows:
+            self.add_open_loan(*row)
+        return len(rows)
+
+    def add_open_loan(self, loan_id, email, equipment, due_date, version):
+        self.loans[loan_id] = (email, equipment, due_date, version)
+        self.by_user.setdefault(((email or '').lower(), (equipment or '').lower()), []).append(loan_id)
+        self.open_counts[(email or '').lower()] = self.open_counts.get((email or '').lower(), 0) + 1
+
+    def scan(self, code):
+        # Resolve one scanned code; returns (ok, message for the scan log)
+        code = code.strip()
+        digits = code[1:] if code[:1] in ('L', 'l') else code
+        if digits.isdigit():
+            return self.check_in(int(digits))
+        if '@' in code:
+            self.user = self.users.get(code.lower(), code)
+            return True, f"User {self.user}: {self.open_counts.get(code.lower(), 0)} open loans"
+        equipment = self.equipment.get(code.lower())
+        if equipment is None:
+            return False, f"Unknown code '{code}'"
+        if self.user is None:
+            return False, f"Scan a user before the {equipment}"
+        if self.checkout:
+            today = datetime.now().date()
+            due_date = (today + timedelta(days=self.loan_days)).strftime('%Y-%m-%d')
+            self.pending.append(('lend', today.strftime('%Y-%m-%d'), self.user, equipment, due_date))
+            return True, f"Lent {equipment} to {self.user}, due {due_date}"
+        ids = self.by_user.get((self.user.lower(), equipment.lower()))
+        if not ids:
+            return False, f"{self.user} has no {equipment} out"
+        return self.check_in(ids[0])
+
+    def check_in(self, loan_id):
+        loan = self.loans.pop(loan_id, None)
+        if loan is None:
+            return False, f"Loan {loan_id} is not out"
+        email, equipment, due_date, version = loan
+        self.by_user[((email or '').lower(), (equipment or '').lower())].remove(loan_id)
+        self.open_counts[(email or '').lower()] -= 1
+        today = datetime.now().date()
+        days_late = (today - datetime.strptime(due_date, "%Y-%m-%d").date()).days if due_date else 0
+        status = f"Returned +{days_late}" if days_late > 0 else "Returned"
+        self.pending.append(('return', loan_id, status, today.strftime('%Y-%m-%d'), version))
+        return True, f"Returned loan {loan_id}: {equipment} of {email}" + (f", {days_late} days late" if days_late > 0 else "")
+
+    def take_batch(self):
+        batch = self.pending[:SCAN_BATCH_SIZE]
+        del self.pending[:SCAN_BATCH_SIZE]
+        return batch
+
+    def committed(self, lent):
+        # New loans are known by their ID once committed, so they can be returned by scanning too
+        for row in lent:
+            self.add_open_loan(*row)
+            self.users.setdefault(row[1].lower(), row[1])
+
+
+def commit_scans(db_file, batch):
+    # Write a batch of scans in one transaction. Returns the new loans as (ID, email, equipment, due date, row
+    # version) and the IDs of returns that were not written because another clerk changed the loan meanwhile.
+    conn = open_db(db_file)
+    try:
+        def write():
+            lent = []
+            conflicts = []
+            try:
+                for scan in batch:
+                    if scan[0] == 'return':
+                        _, loan_id, status, return_date, version = scan
+                        if not conn.execute("UPDATE loans SET Status = ?, ReturnDate = ?, RowVersion = RowVersion + 1 "
+                                            "WHERE ID = ? AND RowVersion = ?",
+                                            (status, return_date, loan_id, version)).rowcount:
+                            conflicts.append(loan_id)
+                    else:
+                        _, date, email, equipment, due_date = scan
+                        loan_id = insert_loans(conn, [(date, email, equipment, due_date, 'Not Returned', None)])
+                        lent.append((loan_id, email, equipment, due_date, 0))
+                conn.commit()
+            except sqlite3.Error:
+                # The retry starts the batch over, nothing of the failed attempt may remain
+                conn.rollback()
+                raise
+            return lent, conflicts
+
+        return run_with_retry(write)
+    finally:
+        conn.close()
+
+
+def parse_emails(text):
+    # Emails separated by new lines, commas or semicolons (a users CSV works too); returns the emails without
+    # duplicates in their order and the entries that are not emails
+    emails = []
+    invalid = []
+    for entry in re.split(r'[\s,;]+', text):
+        entry = entry.strip().strip('"')
+        if not entry or entry == 'User' or entry == 'Email':
+            continue
+        if '@' not in entry:
+            invalid.append(entry)
+        elif entry not in emails:
+            emails.append(entry)
+    return emails, invalid
+
+
+def parse_kit(text):
+    # Equipment names separated by commas; a name given twice is lent twice (e.g. two monitors)
+    return [name.strip() for name in text.split(',') if name.strip()]
+
+
+def checkout_kit(db_file, emails, kit, due_date, today=None):
+    # Lend every item of the kit to every user in one transaction; returns the IDs of the new loans
+    today = today or datetime.now().strftime('%Y-%m-%d')
+    rows = [(today, email, equipment, due_date, 'Not Returned', None) for email in emails for equipment in kit]
+    if not rows:
+        return []
+    conn = open_db(db_file)
+    try:
+        def write():
+            try:
+                last_id = insert_loans(conn, rows)
+                set_state(conn, 'last_kit', ', '.join(kit))
+                conn.commit()
+            except sqlite3.Error:
+                # Nothing of a failed attempt may be left for the retry to insert a second time
+                conn.rollback()
+                raise
+            return last_id
+
+        last_id = run_with_retry(write)
+    finally:
+        conn.close()
+    # The transaction held the write lock, so the new loans got consecutive IDs
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
 
-try:
-    # Try to set DPI awareness to make text and elements clear
-    ctypes.windll.shcore.SetProcessDpiAwareness(1)  # 1: System DPI aware, 2: Per monitor DPI aware
-except AttributeError:
-    # Fallback if SetProcessDpiAwareness does not exist (Windows versions < 8.1)
-    ctypes.windll.user32.SetProcessDPIAware()
+class ScanWindow(tk.Toplevel):
+    # Scan mode (Tools > Scan Mode). Barcode scanners type the code followed by Enter; every code is queued,
+    # resolved by the ScanSession on the spot and committed in the background in small batches. The grid and the
+    # charts are not touched while scanning: the change watch picks the changes up once the scanning pauses.
+    def __init__(self, app, db_file):
+        super().__init__(app)
+        self.app = app
+        self.title(f"Scan Mode - {db_file}")
+        self.geometry("640x460")
+        self.session = ScanSession(db_file)
+        self.codes = deque()
+        self.ready = False
+        self.committing = False
+        self.flush_job = None
+        self.last_scan = 0.0
+        self.closing = False
+        self.counts = {'scans': 0, 'committed': 0, 'errors': 0}
+
+        self.checkout = tk.BooleanVar(value=False)
+        mode_frame = ttk.Frame(self)
+        mode_frame.pack(fill='x', padx=10, pady=5)
+        ttk.Radiobutton(mode_frame, text="Check In", variable=self.checkout, value=False,
+                        command=self.on_mode_change).pack(side=tk.LEFT)
+        ttk.Radiobutton(mode_frame, text="Check Out", variable=self.checkout, value=True,
+                        command=self.on_mode_change).pack(side=tk.LEFT, padx=10)
+
+        self.entry = ttk.Entry(self, width=50)
+        self.entry.pack(padx=10, pady=5)
+        self.entry.bind('<Return>', self.on_scan)
+        self.status_label = tk.Label(self, text="Loading the open loans...", anchor='w')
+        self.status_label.pack(fill='x', padx=10)
+        self.log = tk.Listbox(self, height=20)
+        self.log.pack(fill='both', expand=True, padx=10, pady=5)
+
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.entry.focus_set()
+        self.app.run_in_background(self.session.load, self.on_loaded)
+
+    def busy(self):
+        # True while scans are waiting, being committed or arriving; the change watch waits until then
+        return (bool(self.codes) or bool(self.session.pending) or self.committing
+                or time.monotonic() - self.last_scan < SCAN_IDLE_MS / 1000)
+
+    def on_loaded(self, count, error):
+        if error:
+            self.status_label.config(text=f"Could not load the open loans: {error}")
+            return
+        self.ready = True
+        self.add_log(True, f"{count} open loans loaded")
+        self.process_codes()
+
+    def on_mode_change(self):
+        self.session.checkout = self.checkout.get()
+
+    def on_scan(self, event=None):
+        code = self.entry.get()
+        self.entry.delete(0, 'end')
+        if code.strip():
+            self.last_scan = time.monotonic()
+            self.codes.append(code)
+            self.process_codes()
+
+    @perf.timed('scan')
+    def process_codes(self):
+        if not self.ready:
+            return
+        while self.codes:
+            ok, message = self.session.scan(self.codes.popleft())
+            self.counts['scans'] += 1
+            if not ok:
+                self.counts['errors'] += 1
+            self.add_log(ok, message)
+        if len(self.session.pending) >= SCAN_BATCH_SIZE:
+            self.flush()
+        elif self.session.pending and self.flush_job is None:
+            self.flush_job = self.after(SCAN_FLUSH_MS, self.flush)
+        self.show_counts()
+
+    def add_log(self, ok, message):
+        self.log.insert(0, message)
+        if not ok:
+            self.log.itemconfig(0, foreground='red')
+        if self.log.size() > 200:
+            self.log.delete(200, 'end')
+
+    def show_counts(self):
+        self.status_label.config(text=f"{self.counts['scans']} scans, {self.counts['committed']} saved, "
+                                      f"{len(self.session.pending)} waiting, {self.counts['errors']} not understood")
+
+    def flush(self):
+        self.flush_job = None
+        if self.committing or not self.session.pending:
+            return
+        batch = self.session.take_batch()
+        self.committing = True
+
+        def done(result, error):
+            self.committing = False
+            if error:
+                # Kept for the next attempt, e.g. when the database stayed locked
+                self.session.pending[:0] = batch
+                self.add_log(False, f"Saving failed, retrying: {error}")
+                self.flush_job = self.after(SCAN_FLUSH_MS * 4, self.flush)
+            else:
+                lent, conflicts = result
+                self.session.committed(lent)
+                self.counts['committed'] += len(batch) - len(conflicts)
+                for loan_id in conflicts:
+                    self.add_log(False, f"Loan {loan_id} was changed by another clerk and was not returned")
+                session = self.app.equipment_tab.current_session()
+                if session and session.db_file == self.session.db_file:
+                    session.add_users([email for _, email, _, _, _ in lent])
+                if self.session.pending:
+                    self.flush()
+            self.show_counts()
+            if self.closing and not self.committing:
+                self.close()
+
+        self.app.run_in_background(lambda: commit_scans(self.session.db_file, batch), done)
+
+    def close(self):
+        # Scans that are not saved yet are committed first, the window closes once they are
+        self.closing = True
+        if self.session.pending or self.committing:
+            self.status_label.config(text="Saving the last scans...")
+            self.flush()
+            return
+        self.app.scan_window = None
+        self.destroy()
+
+
+class BulkCheckoutWindow(tk.Toplevel):
+    # Tools > Bulk Checkout...: lends a kit (e.g. the starter kit of new hires) to a list of users at once. The
+    # loans are written in one transaction, the users CSV is appended once and the tabs are refreshed once.
+    def __init__(self, app, db_file):
+        super().__init__(app)
+        self.app = app
+        self.db_file = db_file
+        self.title(f"Bulk Checkout - {db_file}")
+        self.geometry("520x480")
+
+        conn = open_db(db_file)
+        try:
+            last_kit = get_state(conn, 'last_kit', DEFAULT_KIT)
+        except sqlite3.Error:
+            last_kit = DEFAULT_KIT
+        finally:
+            conn.close()
+
+        form = ttk.Frame(self)
+        form.pack(fill='x', padx=10, pady=5)
+        ttk.Label(form, text="Kit (comma-separated):").grid(row=0, column=0, sticky='w')
+        self.kit_entry = ttk.Entry(form, width=45)
+        self.kit_entry.insert(0, last_kit)
+        self.kit_entry.grid(row=0, column=1, sticky='we', pady=2)
+        ttk.Label(form, text="Due date (YYYY-MM-DD):").grid(row=1, column=0, sticky='w')
+        self.due_entry = ttk.Entry(form, width=45)
+        self.due_entry.insert(0, (datetime.now() + timedelta(days=KIT_LOAN_DAYS)).strftime('%Y-%m-%d'))
+        self.due_entry.grid(row=1, column=1, sticky='we', pady=2)
+        form.columnconfigure(1, weight=1)
+
+        users_frame = ttk.Frame(self)
+        users_frame.pack(fill='x', padx=10)
+        ttk.Label(users_frame, text="Users, one email per line:").pack(side=tk.LEFT)
+        ttk.Button(users_frame, text="Load List...", command=self.load_list).pack(side=tk.RIGHT)
+        self.users_text = tk.Text(self, height=18)
+        self.users_text.pack(fill='both', expand=True, padx=10, pady=5)
+
+        self.checkout_button = ttk.Button(self, text="Check Out", command=self.check_out)
+        self.checkout_button.pack(pady=5)
+
+    def load_list(self):
+        path = filedialog.askopenfilename(parent=self, title="List of users",
+                                          filetypes=[("Text and CSV files", "*.txt *.csv"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            with open(path) as f:
+                text = f.read()
+        except OSError as e:
+            messagebox.showerror("Bulk Checkout", f"Could not read the list: {e}", parent=self)
+            return
+        self.users_text.insert('end', text if text.endswith('\n') else text + '\n')
+
+    def check_out(self):
+        emails, invalid = parse_emails(self.users_text.get('1.0', 'end'))
+        kit = parse_kit(self.kit_entry.get())
+        due_date = self.due_entry.get().strip()
+        if invalid:
+            messagebox.showinfo("Bulk Checkout", "These entries are not emails:\n" + '\n'.join(invalid[:20]), parent=self)
+            return
+        if not emails or not kit:
+            messagebox.showinfo("Bulk Checkout", "Please enter the users and the kit.", parent=self)
+            return
+        try:
+            datetime.strptime(due_date, "%Y-%m-%d")
+        except ValueError:
+            messagebox.showinfo("Bulk Checkout", "Please enter the due date as YYYY-MM-DD.", parent=self)
+            return
+        if not messagebox.askyesno("Bulk Checkout", f"Lend {len(emails) * len(kit)} items ({', '.join(kit)}) to "
+                                                    f"{len(emails)} users, due {due_date}?", parent=self):
+            return
+
+        self.checkout_button.config(state='disabled')
+
+        def done(loan_ids, error):
+            self.checkout_button.config(state='normal')
+            if error:
+                messagebox.showerror("Bulk Checkout", f"Nothing was lent: {error}", parent=self)
+                return
+            self.app.kit_checked_out(self.db_file, emails, loan_ids)
+            messagebox.showinfo("Bulk Checkout", f"Lent {len(loan_ids)} items to {len(emails)} users.", parent=self)
+            self.destroy()
+
+        self.app.run_in_background(lambda: checkout_kit(self.db_file, emails, kit, due_date), done)
 
 
 class EquipmentTrackingTab(tk.Frame):
@@ -20,8 +2933,8 @@ class EquipmentTrackingTab(tk.Frame):
 
         self.app = app
 
-        # Initialize the CSV filename as None; it will be set when a database is selected
-        self.emails_file = None
+        # Datasets of the selected database shared by all tabs, replaced when another database is selected
+        self.session = None
 
         # Initialize the entry frame first
         self.entry_frame = tk.Frame(self, background=bg_color)
@@ -48,17 +2961,60 @@ class EquipmentTrackingTab(tk.Frame):
 
         self.due_date_label = tk.Label(self.entry_frame, text="Due Date:", background=bg_color)
         self.due_date_label.pack(pady=5)
-        self.calendar = Calendar(self.entry_frame, selectmode='day', year=datetime.now().year,
-                                 month=datetime.now().month, day=datetime.now().day)
-        self.calendar.pack(pady=5)
+        # The calendar is created once the window is on screen (see create_calendar)
+        self.calendar = None
+        self.calendar_frame = tk.Frame(self.entry_frame, background=bg_color)
+        self.calendar_frame.pack(pady=5)
+        self.calendar_map_binding = self.bind('<Map>', self.on_first_map, add='+')
 
         self.submit_button = ttk.Button(self.entry_frame, text="Submit", command=self.add_entry)
         self.submit_button.pack(pady=10)
 
+        # Status and due-date window filters, combined with the user and equipment selection above
+        self.status_filter_label = tk.Label(self.entry_frame, text="Status Filter:", background=bg_color)
+        self.status_filter_label.pack(pady=5)
+        self.status_filter = ttk.Combobox(self.entry_frame, values=STATUS_FILTERS, state='readonly')
+        self.status_filter.set('All')
+        self.status_filter.pack(pady=5)
+        self.status_filter.bind("<<ComboboxSelected>>", self.apply_filters)
+
+        self.due_window_label = tk.Label(self.entry_frame, text="Due Between (YYYY-MM-DD):", background=bg_color)
+        self.due_window_label.pack(pady=5)
+        self.due_window_frame = tk.Frame(self.entry_frame, background=bg_color)
+        self.due_window_frame.pack(pady=5)
+        self.due_from_entry = ttk.Entry(self.due_window_frame, width=12)
+        self.due_from_entry.pack(side=tk.LEFT, padx=2)
+        self.due_to_entry = ttk.Entry(self.due_window_frame, width=12)
+        self.due_to_entry.pack(side=tk.LEFT, padx=2)
+        self.due_from_entry.bind('<Return>', self.apply_filters)
+        self.due_to_entry.bind('<Return>', self.apply_filters)
+
+        # Full-text search over email, user name and equipment (e.g. "lapt* smith")
+        self.search_label = tk.Label(self.entry_frame, text="Search Loans:", background=bg_color)
+        self.search_label.pack(pady=5)
+        self.search_entry = ttk.Entry(self.entry_frame, width=30)
+        self.search_entry.pack(pady=5)
+        self.search_entry.bind('<KeyRelease>', self.on_search_keyrelease)
+        self.search_entry.bind('<Return>', self.run_search)
+        self.search_job = None
+
+        # As-of-date mode: show the loans that were out on a past day instead of the live list
+        self.as_of_label = tk.Label(self.entry_frame, text="As of Date (YYYY-MM-DD):", background=bg_color)
+        self.as_of_label.pack(pady=5)
+        self.as_of_entry = ttk.Entry(self.entry_frame, width=30)
+        self.as_of_entry.pack(pady=5)
+        self.as_of_entry.bind('<Return>', self.apply_as_of_date)
+        self.as_of_date = None
+
+        # The loans behind the grid; the Treeview only renders them (item ids are the loan IDs)
+        self.loans = LoanStore()
+        self.showing_snapshot = False  # The grid shows the first page from the startup snapshot
+        self.row_values = (None, None)  # Email and equipment a row click put into the entry comboboxes
+
         # Define the columns for the Treeview including the 'Status' column
         self.tree_frame = tk.Frame(self, background=bg_color)
         self.tree_frame.grid(row=0, column=1, sticky="nsew")
-        self.tree_view = ttk.Treeview(self.tree_frame,
+        self.tree_view = InstrumentedTreeview(self.tree_frame,
                                       columns=("ID", "Date", "Email", "Equipment", "Due Date", "Status"),
                                       show="headings")
         # Create and pack the scrollbar
@@ -124,7 +3080,7 @@ class EquipmentTrackingTab(tk.Frame):
         self.on_database_selected()
 
     def generate_fake_data(self):
-        fake = Faker()
+        fake = faker.Faker()
         number_of_emails = 1000
 
         db_index = 0
@@ -139,7 +3095,7 @@ class EquipmentTrackingTab(tk.Frame):
         emails_df.to_csv(csv_filename, index=False)
 
         equipment_names = ['Laptop', 'Projector', 'Camera', 'Microphone', 'Speaker', 'Mouse', 'Keyboard', 'Screen', 'Smartphone']
-        dates, emails, equipments, due_dates, statuses = [], [], [], [], []
+        dates, emails, equipments, due_dates, statuses, return_dates = [], [], [], [], [], []
 
         for _ in range(number_of_emails):
             email = fake.random_element(elements=fake_emails)
@@ -152,27 +3108,12 @@ class EquipmentTrackingTab(tk.Frame):
             equipments.append(equipment)
             due_dates.append(due_date.strftime('%Y-%m-%d'))
             statuses.append(status)
+            return_dates.append(derive_return_date(due_dates[-1], status))
 
-        fake_db_df = pd.DataFrame({
-            'Date': dates,
-            'Email': emails,
-            'Equipment': equipments,
-            'DueDate': due_dates,
-            'Status': statuses
-        })
-
-        conn = sqlite3.connect(db_filename)
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS equipment (
-                            ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                            Date TEXT,
-                            Email TEXT,
-                            Equipment TEXT,
-                            DueDate TEXT,
-                            Status TEXT)''')
+        conn = open_db(db_filename, profile='bulk import')
+        create_loan_tables(conn)
+        insert_loans(conn, zip(dates, emails, equipments, due_dates, statuses, return_dates))
         conn.commit()
-
-        fake_db_df.to_sql('equipment', conn, if_exists='append', index=False)
         conn.close()
 
         messagebox.showinfo("Info", f"Generated a fake database with {number_of_emails} entries.")
@@ -199,12 +3140,13 @@ class EquipmentTrackingTab(tk.Frame):
 
     def on_item_double_click(self, event):
         # Get the selected item
+        import webbrowser
         item = self.tree_view.selection()[0]
-        item_values = self.tree_view.item(item, 'values')
+        loan = self.loans.row(item)
 
-        # Extract email and equipment name assuming they are in known columns
-        email = item_values[2]  # Change index based on your setup
-        equipment_name = item_values[3]  # Change index based on your setup
+        # Extract email and equipment name
+        email = loan[2]
+        equipment_name = loan[3]
 
         # Define the email subject and body
         subject = f"[IT DESK BRUGES] Kind Reminder: Please Return the Equipment ({equipment_name})"
@@ -221,11 +3163,13 @@ class EquipmentTrackingTab(tk.Frame):
         # Open the default mail client
         webbrowser.open(mailto_url)
 
+    @perf.timed('mark_as_returned')
     def mark_as_returned(self):
+        if self.editing_blocked():
+            return
         selected_items = self.tree_view.selection()
         for item in selected_items:
-            item_values = self.tree_view.item(item, 'values')
-            current_status = item_values[-1]  # Assuming Status is the last column
+            current_status, _ = self.displayed_status(item)
 
             # Determine the new status based on the existing status
             if current_status.startswith('+'):
@@ -233,33 +3177,18 @@ class EquipmentTrackingTab(tk.Frame):
             else:
                 new_status = "Returned"
 
-            # Update the TreeView item with the new status
-            new_values = item_values[:-1] + (new_status,)
-            self.tree_view.item(item, values=new_values)
-
-            # Update the status in the database
+            # Update the status in the database (the row is re-rendered from the store)
             self.update_status_in_db(item, new_status)
 
-            # Update the Treeview item color immediately
-            if new_status.startswith("Returned"):
-                self.tree_view.item(item, tags=('returned',))
-            else:
-                self.tree_view.item(item, tags=('default',))
-
-            # Refresh the treeview and the colors
-            self.tree_view.update_idletasks()
-            self.update_row_colors()
-
         # Optionally, refresh the entire TreeView to reflect changes
         self.load_selected_db(None)
         self.app.refresh_pie_charts()
 
     def mark_as_not_returned(self):
+        if self.editing_blocked():
+            return
         selected_items = self.tree_view.selection()
         for item in selected_items:
-            item_values = self.tree_view.item(item, 'values')
-            new_values = item_values[:-1] + ('Not Returned',)
-            self.tree_view.item(item, values=new_values)
             self.update_item_color_and_status(item, 'Not Returned')
         self.app.refresh_pie_charts()
 
@@ -270,6 +3199,19 @@ class EquipmentTrackingTab(tk.Frame):
         self.tree_view.tag_configure('default', background='')
         self.tree_view.tag_configure('overdue', background='red')
 
+    def on_first_map(self, event):
+        # Import tkcalendar and build the due date calendar after the window has been drawn
+        if event.widget is self:
+            self.unbind('<Map>', self.calendar_map_binding)
+            self.after_idle(self.create_calendar)
+
+    def create_calendar(self):
+        if self.calendar is not None:
+            return
+        self.calendar = tkcalendar.Calendar(self.calendar_frame, selectmode='day', year=datetime.now().year,
+                                            month=datetime.now().month, day=datetime.now().day)
+        self.calendar.pack()
+
     def show_context_menu(self, event):
         # Show the menu only if there are selected items
         if self.tree_view.selection():
@@ -283,48 +3225,46 @@ class EquipmentTrackingTab(tk.Frame):
                 db_files.append(file)
         return db_files
 
-    def load_equipment_entries(self):
+    def current_session(self):
+        # The session of the selected database, a new one once another database is selected
         db_file = self.db_combo.get()
-        if db_file:
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
+        if not db_file:
+            self.session = None
+        elif self.session is None or self.session.db_file != db_file:
+            self.session = DatabaseSession(db_file)
+        return self.session
+
+    def data_changed(self):
+        # After a write the shared lists and counts are queried again the next time they are needed
+        if self.session is not None:
+            self.session.changed()
 
+    def load_equipment_entries(self):
+        session = self.current_session()
+        if session:
             try:
-                cursor.execute("SELECT DISTINCT Equipment FROM equipment")
-                equipment_list = [row[0] for row in cursor.fetchall()]
-                self.equipment_combobox['values'] = equipment_list
+                self.equipment_combobox['values'] = session.equipment_types()
             except sqlite3.Error as e:
-                print("Database error:", e)
-            finally:
-                conn.close()
+                perf.error("equipment types", e)
 
     def load_email_entries(self):
-        db_file = self.db_combo.get()
-
-        if db_file:
-            # Extract the base name from the database file and construct the CSV filename
-            base_name = db_file.split('.db')[0]
-            csv_filename = f"{base_name}_users.csv"
+        session = self.current_session()
 
-            try:
-                if os.path.exists(csv_filename):
-                    df = pd.read_csv(csv_filename)
-                    emails = df['User Email'].dropna().unique().tolist()
-                    self.email_combobox['values'] = emails
-                else:
-                    print("CSV file not found. Ensure the file exists in the specified path.")
-                    self.email_combobox['values'] = []  # Clear the combobox if the file doesn't exist
-            except Exception as e:
-                print(f"An error occurred while loading the CSV: {e}")
-                self.email_combobox['values'] = []  # Clear the combobox in case of an error
+        if session:
+            self.email_combobox['values'] = session.user_emails()
         else:
             print("No database selected.")
             self.email_combobox['values'] = []  # Clear the combobox if no database is selected
 
+    @perf.timed('add_entry')
     def add_entry(self):
+        if self.editing_blocked():
+            return
         current_date = datetime.now().strftime("%Y-%m-%d")
         email = self.email_combobox.get()
         equipment = self.equipment_combobox.get()  # Get value from the combobox
+        if self.calendar is None:
+            self.create_calendar()
         due_date = self.calendar.get_date()
         status = 'Not Returned'  # Default status for new entries
 
@@ -336,22 +3276,21 @@ class EquipmentTrackingTab(tk.Frame):
 
         db_file = self.db_combo.get()
         if db_file:
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
-
-            try:
-                cursor.execute(
-                    "INSERT INTO equipment (Date, Email, Equipment, DueDate, Status) VALUES (?, ?, ?, ?, ?)",
-                    (current_date, email, equipment, formatted_due_date, status))
+            conn = open_db(db_file)
 
+            def insert():
+                loan_id = insert_loans(conn, [(current_date, email, equipment, formatted_due_date, status, None)])
                 conn.commit()
+                return loan_id
 
-                # Fetch the last row id
-                last_id = cursor.lastrowid  # This should be the actual ID of the inserted row
+            try:
+                # The ID of the inserted row
+                last_id = run_with_retry(insert)
+                self.data_changed()
 
-                # Insert the new entry into the Treeview with the correct ID and include the status
-                self.tree_view.insert("", "end",
-                                      values=(last_id, current_date, email, equipment, formatted_due_date, status))
+                # Add the new entry to the store and render it with the correct ID and status
+                self.loans.upsert((last_id, current_date, email, equipment, formatted_due_date, status, 0))
+                self.render_item(last_id)
 
                 # Assuming you want to add the new equipment to the combobox values if it's not already there
                 existing_values = self.equipment_combobox['values']
@@ -378,6 +3317,8 @@ class EquipmentTrackingTab(tk.Frame):
             self.app.refresh_pie_charts()
 
     def delete_record(self):
+        if self.editing_blocked():
+            return
         selected_items = self.tree_view.selection()
         if not selected_items:
             messagebox.showinfo("Delete", "No item selected to delete.")
@@ -385,29 +3326,37 @@ class EquipmentTrackingTab(tk.Frame):
 
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete the selected records?"):
             db_file = self.db_combo.get()  # or however you access the current database file
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
+            ids_to_delete = [(int(item),) for item in selected_items]
 
-            for item in selected_items:
-                id_to_delete = self.tree_view.item(item, 'values')[0]
-                # Delete from database
-                cursor.execute("DELETE FROM equipment WHERE ID = ?", (id_to_delete,))
+            def delete():
+                conn = open_db(db_file)
+                try:
+                    # Delete from database
+                    conn.executemany("DELETE FROM loans WHERE ID = ?", ids_to_delete)
+                    conn.commit()
+                finally:
+                    conn.close()
 
-            conn.commit()
-            conn.close()
+            try:
+                run_with_retry(delete)
+            except sqlite3.Error as e:
+                print(f"Database error: {e}")
+                return
+            self.data_changed()
 
-            # Delete from TreeView
-            for item in selected_items:
-                self.tree_view.delete(item)
+            # Delete from the store and the TreeView
+            self.loans.remove(*selected_items)
+            self.tree_view.delete(*selected_items)
 
     def edit_equipment(self):
+        if self.editing_blocked():
+            return
         selected_item = self.tree_view.selection()
         if not selected_item:
             messagebox.showinfo("Edit Equipment", "No item selected to edit.")
             return
 
-        # Assuming the Equipment is the third value in the tree
-        equipment_value = self.tree_view.item(selected_item[0], 'values')[3]
+        equipment_value = self.loans.get(selected_item[0], 'Equipment')
 
         # Open a simple dialog to ask for the new Equipment value
         new_equipment_value = simpledialog.askstring("Edit Equipment", "Enter new equipment name:",
@@ -415,53 +3364,27 @@ class EquipmentTrackingTab(tk.Frame):
 
         # If the user cancels the dialog, `new_equipment_value` will be None
         if new_equipment_value is not None and new_equipment_value != equipment_value:
-            # Update the database
-            db_file = self.db_combo.get()  # or however you access the current database file
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
-            id_to_update = self.tree_view.item(selected_item[0], 'values')[0]
-            cursor.execute("UPDATE equipment SET Equipment = ? WHERE ID = ?", (new_equipment_value, id_to_update))
-            conn.commit()
-            conn.close()
-
-            # Update the TreeView
-            current_values = list(self.tree_view.item(selected_item[0], 'values'))
-            current_values[3] = new_equipment_value
-            self.tree_view.item(selected_item[0], values=current_values)
+            # Update the database, the row is re-rendered from the store
+            if not self.update_loan(selected_item[0], Equipment=new_equipment_value):
+                return
 
         self.load_equipment_entries()
 
     def update_emails_file(self, new_email):
-        # Load existing data
-        df = pd.read_csv(self.emails_file)
-
         # Append new email if it doesn't exist
-        if new_email not in df['User Email'].values:
-            df.loc[len(df)] = [new_email]
-            df.to_csv(self.emails_file, index=False)
+        session = self.current_session()
+        if session:
+            session.add_user(new_email)
 
         # Reload the combobox values
         self.load_emails_into_combobox()
 
     def load_emails_into_combobox(self):
-        db_file = self.db_combo.get()
+        session = self.current_session()
 
-        if db_file:
-            # Extract the base name from the database file and construct the CSV filename
-            base_name = os.path.splitext(os.path.basename(db_file))[0]
-            csv_filename = f"{base_name}_users.csv"
-
-            try:
-                if os.path.exists(csv_filename):
-                    df = pd.read_csv(csv_filename)
-                    self.all_emails = df['User Email'].dropna().unique().tolist()
-                    self.email_combobox['values'] = self.all_emails
-                else:
-                    print("CSV file not found. Ensure the file exists in the specified path.")
-                    self.all_emails = []  # Clear the list if the file doesn't exist
-            except Exception as e:
-                print(f"An error occurred while loading the CSV: {e}")
-                self.all_emails = []  # Clear the list in case of an error
+        if session:
+            self.all_emails = session.user_emails()
+            self.email_combobox['values'] = self.all_emails
         else:
             print("No database selected.")
             self.all_emails = []  # Clear the list if no database is selected
@@ -490,6 +3413,8 @@ class EquipmentTrackingTab(tk.Frame):
             self.email_combobox.event_generate('<Down>')
 
     def edit_due_date(self):
+        if self.editing_blocked():
+            return
         selected_items = self.tree_view.selection()
         if not selected_items:
             messagebox.showinfo("Info", "No item selected.")
@@ -506,13 +3431,15 @@ class EquipmentTrackingTab(tk.Frame):
         date_window.title("Select Date")
 
         # Create a Calendar widget in the new window
-        cal = Calendar(date_window, selectmode='day', date_pattern='yyyy-mm-dd')
+        cal = tkcalendar.Calendar(date_window, selectmode='day', date_pattern='yyyy-mm-dd')
         cal.pack(pady=10)
 
         # Confirmation button to use the selected date
         tk.Button(date_window, text="Ok", command=on_date_selected).pack(pady=10)
 
     def edit_return_date(self):
+        if self.editing_blocked():
+            return
         selected_items = self.tree_view.selection()
         if not selected_items:
             messagebox.showinfo("Info", "No item selected.")
@@ -529,7 +3456,7 @@ class EquipmentTrackingTab(tk.Frame):
         status_window.title("Select Date")
 
         # Calendar widget
-        cal = Calendar(status_window, selectmode='day', date_pattern='yyyy-mm-dd')
+        cal = tkcalendar.Calendar(status_window, selectmode='day', date_pattern='yyyy-mm-dd')
         cal.pack(pady=10)
 
         # Confirmation button to use the selected date
@@ -540,85 +3467,111 @@ class EquipmentTrackingTab(tk.Frame):
 
         if selected_item:
             item = selected_item[0]
-            row = self.tree_view.item(item, 'values')
+            row = self.loans.row(item)
 
-            if len(row) >= 6:  # Ensure there are enough values, including the new 'Status' column
-                # Extracting the Email and Equipment based on their positions in the row
-                email = row[2]  # Assuming Email is the third column
-                equipment = row[3]  # Assuming Equipment is the fourth column
+            if row:
+                # Extracting the Email and Equipment of the selected loan
+                email = row[2]
+                equipment = row[3]
 
                 # Update the Email Entry and Equipment Combobox with the selected values
                 self.email_combobox.set(email)
                 self.equipment_combobox.set(equipment)
+                self.row_values = (email, equipment)
+
+    def clear_row_values(self, keep=None):
+        # Values a row click filled in are there for a new entry, not as filters: they are cleared once a
+        # filter is applied, except the one the user just picked ('email' or 'equipment')
+        email, equipment = self.row_values
+        if keep != 'email' and email and self.email_combobox.get() == email:
+            self.email_combobox.set('')
+        if keep != 'equipment' and equipment and self.equipment_combobox.get() == equipment:
+            self.equipment_combobox.set('')
+        self.row_values = (None, None)
 
+    @perf.timed('filter_by_equipment')
     def filter_tree_view_by_equipment(self, event=None):
-        selected_equipment = self.equipment_combobox.get()
+        # Equipment and user selections no longer replace each other, all filters are applied together
+        self.clear_row_values(keep='equipment')
+        self.apply_filters()
+
+    @perf.timed('filter_by_email')
+    def filter_tree_view_by_email(self, event=None):
+        self.clear_row_values(keep='email')
+        self.apply_filters()
+
+    def current_filter(self):
+        return LoanFilter(email=self.email_combobox.get().strip(), equipment=self.equipment_combobox.get().strip(),
+                          status=self.status_filter.get(), due_from=self.due_from_entry.get().strip(),
+                          due_to=self.due_to_entry.get().strip())
+
+    @perf.timed('apply_filters')
+    def apply_filters(self, event=None):
+        # User, equipment, status and due-date window run as one indexed query (or come from the cache)
+        self.clear_row_values()
+        for text in (self.due_from_entry.get().strip(), self.due_to_entry.get().strip()):
+            if text:
+                try:
+                    datetime.strptime(text, "%Y-%m-%d")
+                except ValueError:
+                    messagebox.showerror("Error", "Please enter the due dates as YYYY-MM-DD.")
+                    return
 
         # Clear the current TreeView
-        for item in self.tree_view.get_children():
-            self.tree_view.delete(item)
+        self.populate_tree([])
 
-        # Connect to the database
         db_file = self.db_combo.get()
         if db_file:
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
-
+            loan_filter = self.current_filter()
+            store = self.cached_result(db_file, loan_filter.key(), loan_filter.fetch)
+            if store is not None:
+                self.show_store(store)
+
+    def apply_as_of_date(self, event=None):
+        text = self.as_of_entry.get().strip()
+        if text:
             try:
-                if selected_equipment:
-                    # Load only the entries that match the selected equipment, including the Status
-                    cursor.execute(
-                        "SELECT ID, Date, Email, Equipment, DueDate, Status FROM equipment WHERE Equipment = ?",
-                        (selected_equipment,))
-                else:
-                    # If no equipment is selected, load all entries, including the Status
-                    cursor.execute("SELECT ID, Date, Email, Equipment, DueDate, Status FROM equipment")
-
-                rows = cursor.fetchall()
-
-                # Populate the TreeView with the fetched rows
-                for row in rows:
-                    # Ensure that the order of the values corresponds to the TreeView columns
-                    self.tree_view.insert("", "end", values=row)
-
-                # Update the row colors based on the Status and Due Date
-                self.update_row_colors()
-
-            except sqlite3.Error as e:
-                print("Database error:", e)
-            finally:
-                conn.close()
+                datetime.strptime(text, "%Y-%m-%d")
+            except ValueError:
+                messagebox.showerror("Error", "Please enter the as-of date as YYYY-MM-DD.")
+                return
 
-    def filter_tree_view_by_email(self, event=None):
-        selected_email = self.email_combobox.get()
+        # An empty entry switches back to the live view
+        self.as_of_date = text or None
+        self.load_selected_db()
+        self.app.refresh_pie_charts()
 
-        # Clear the current TreeView
-        for item in self.tree_view.get_children():
-            self.tree_view.delete(item)
+    def on_search_keyrelease(self, event):
+        # Wait until the clerk stops typing for a moment before querying
+        if event.keysym == 'Return':
+            return
+        if self.search_job:
+            self.after_cancel(self.search_job)
+        self.search_job = self.after(300, self.run_search)
+
+    @perf.timed('search')
+    def run_search(self, event=None):
+        if self.search_job:
+            self.after_cancel(self.search_job)
+            self.search_job = None
+
+        text = self.search_entry.get().strip()
+        if not text:
+            # Empty search box: back to the regular (filtered or complete) list
+            self.apply_filters()
+            return
 
-        # Connect to the database and fetch filtered data
         db_file = self.db_combo.get()
-        if db_file:
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
-            try:
-                if selected_email:
-                    cursor.execute(
-                        "SELECT ID, Date, Email, Equipment, DueDate, Status FROM equipment WHERE Email = ?",
-                        (selected_email,))
-                else:
-                    cursor.execute("SELECT ID, Date, Email, Equipment, DueDate, Status FROM equipment")
-
-                for row in cursor.fetchall():
-                    self.tree_view.insert("", "end", values=row)
+        if not db_file:
+            return
 
-                # Update the row colors based on the Status and Due Date
-                self.update_row_colors()
+        prepare_database(db_file)
+        store = self.cached_result(db_file, ('search', text), lambda conn: search_loans(conn, text), sort='rank')
+        if store is None:
+            return
 
-            except sqlite3.Error as e:
-                print("Database error:", e)
-            finally:
-                conn.close()
+        # Results are shown in rank order, best match first
+        self.show_store(store)
 
     def set_custom_date(self):
         selected_items = self.tree_view.selection()
@@ -637,7 +3590,7 @@ class EquipmentTrackingTab(tk.Frame):
         date_window.title("Select Date")
 
         # Calendar widget
-        cal = Calendar(date_window, selectmode='day', date_pattern='yyyy-mm-dd')
+        cal = tkcalendar.Calendar(date_window, selectmode='day', date_pattern='yyyy-mm-dd')
         cal.pack(pady=10)
 
         # Confirmation button
@@ -656,25 +3609,18 @@ class EquipmentTrackingTab(tk.Frame):
             self.filter_tree_view_by_email()
 
     def handle_double_click(self, event):
+        if self.editing_blocked():
+            return
         selected_items = self.tree_view.selection()
         for item in selected_items:
-            item_values = self.tree_view.item(item, 'values')
-            current_status = item_values[-1]
+            current_status, _ = self.displayed_status(item)
 
             # Check if the status is a digit preceded by '+', and update it to 'Returned +digit'
             if current_status.startswith('+') and current_status[1:].isdigit():
-                new_status = 'Returned ' + current_status
-                new_values = item_values[:-1] + (new_status,)
-                self.tree_view.item(item, values=new_values)
-                self.update_status_in_db(item, new_status)
-                self.tree_view.item(item, tags=('returned',))
+                self.update_status_in_db(item, 'Returned ' + current_status)
             elif not current_status.startswith('Returned'):
                 # If the status is not starting with 'Returned', change it to 'Returned'
-                new_status = 'Returned'
-                new_values = item_values[:-1] + (new_status,)
-                self.tree_view.item(item, values=new_values)
-                self.update_status_in_db(item, new_status)
-                self.tree_view.item(item, tags=('returned',))
+                self.update_status_in_db(item, 'Returned')
             else:
                 # If the status already starts with 'Returned', do nothing
                 pass
@@ -691,96 +3637,227 @@ class EquipmentTrackingTab(tk.Frame):
             print(f"Error processing date: {date_str} - {e}")
             return None  # or some error handling
 
+    def editing_blocked(self):
+        # The as-of view shows the past: statuses are counted up to the as-of date and would be wrong if written
+        # back, so nothing can be changed until the clerk goes back to the live view
+        if not self.as_of_date:
+            return False
+        messagebox.showinfo("As-of View", f"The grid shows the loans as of {self.as_of_date}.\n"
+                                          "Clear the as-of date to make changes.")
+        return True
+
+    def reference_date(self):
+        # Overdue days are counted up to today, or up to the as-of date when looking back in time
+        if self.as_of_date:
+            return datetime.strptime(self.as_of_date, "%Y-%m-%d").date()
+        return datetime.now().date()
+
+    def displayed_status(self, loan_id):
+        # (status text, tag) a loan is rendered with
+        row = self.loans.row(loan_id)
+        return display_status(row[5], row[4], self.reference_date())
+
+    def render_item(self, loan_id, index="end"):
+        # Write one loan from the store into its Treeview item, creating the item if needed
+        row = self.loans.row(loan_id)
+        status, tag = display_status(row[5], row[4], self.reference_date())
+        iid = str(row[0])
+        if self.tree_view.exists(iid):
+            self.tree_view.item(iid, values=row[:5] + (status,), tags=(tag,))
+        else:
+            self.tree_view.insert("", index, iid=iid, values=row[:5] + (status,), tags=(tag,))
+
     def update_row_colors(self):
-        for child in self.tree_view.get_children():
-            item = self.tree_view.item(child)
-            item_values = item['values']
-            due_date_str = item_values[4]  # Adjust the index based on where the Due Date is in your values
-            status = str(item_values[-1])  # Convert status to string in case it's not
-
-            # Continue to the next iteration if the due date string is None or can't be parsed
-            if not due_date_str or due_date_str.lower() == 'none':
-                continue
+        # Re-render every row from the store, bringing '+N' day counts and colors up to date
+        current_date = self.reference_date()
+        for row in self.loans.rows():
+            status, tag = display_status(row[5], row[4], current_date)
+            self.tree_view.item(str(row[0]), values=row[:5] + (status,), tags=(tag,))
+
+    def populate_tree(self, rows):
+        # Rows are (ID, Date, Email, Equipment, DueDate, Status, RowVersion). They are kept in the loan store
+        # and rendered into the Treeview; the loan ID doubles as the item id and the version is used for the
+        # conflict check when the row is written back.
+        self.loans.load(rows)
+        self.showing_snapshot = False
+        self.render_all()
+
+    def show_store(self, store):
+        # Show an already loaded set of loans (e.g. from the result cache)
+        self.loans = store
+        self.showing_snapshot = False
+        self.render_all()
+
+    def show_snapshot(self, snapshot):
+        # The first grid page and the shared datasets saved on the last close, shown until finish_snapshot()
+        session = self.current_session()
+        for name, value in snapshot['data'].items():
+            session.restore(name, value, (snapshot['usn'], snapshot['date']))
+        self.populate_tree(snapshot['rows'])
+        self.showing_snapshot = True
+        self.sort_reverse = False
 
-            try:
-                due_date = datetime.strptime(due_date_str, "%Y-%m-%d").date()
-                current_date = datetime.now().date()
-                days_diff = (current_date - due_date).days
-
-                if status == "Not Returned" and due_date < current_date:
-                    new_status = f"+{days_diff}"
-                    new_values = tuple(item_values[:-1]) + (new_status,)
-                    self.tree_view.item(child, values=new_values, tags=('overdue',))
-                    self.tree_view.tag_configure('overdue', background='red')
-                elif status.startswith('Returned'):
-                    self.tree_view.item(child, tags=('returned',))
-                    self.tree_view.tag_configure('returned', background=self.light_green)
-                elif status.startswith('+') and due_date >= current_date:
-                    new_values = tuple(item_values[:-1]) + ('Not Returned',)
-                    self.tree_view.item(child, values=new_values, tags=('default',))
-                    self.tree_view.tag_configure('default', background='')
-                else:
-                    self.tree_view.item(child, tags=('default',))
-                    self.tree_view.tag_configure('default', background='')
+    def snapshot_page(self):
+        # First page of the unfiltered grid for the startup snapshot: the grid itself while it shows all loans,
+        # else the cached unfiltered result, however old (the next launch checks the page against the database)
+        if self.current_filter().is_empty() and not self.search_entry.get().strip() and not self.as_of_date:
+            return self.loans.page(SNAPSHOT_ROWS)
+        store = result_cache.peek((os.path.abspath(self.db_combo.get()), ('as_of', None), 'Date desc'))
+        return store.page(SNAPSHOT_ROWS) if store is not None else []
+
+    def finish_snapshot(self, store):
+        # Swap the snapshot's page for the full grid. While the page is still what the database has first, its
+        # items stay and only the rows after it are added; a grid that was filtered meanwhile is left alone.
+        if not self.showing_snapshot:
+            return
+        page = self.loans.page(len(self.loans))
+        if store.page(len(page)) != page:
+            self.show_store(store)
+            return
+        self.loans = store
+        self.showing_snapshot = False
+        self.render_all(start=len(page))
+
+    def cached_result(self, db_file, filter_key, fetch, sort=None, arrange=None):
+        # Loan store of a grid query. fetch(conn) returns the rows and arrange(store) puts them in the order
+        # described by sort; the result is served from the cache while the database hasn't changed since.
+        conn = open_db(db_file)
+        try:
+            usn = current_usn(conn)
+            key = (os.path.abspath(db_file), filter_key, sort)
+            store = result_cache.get(key, usn)
+            if store is None:
+                store = LoanStore()
+                store.load(fetch(conn))
+                if arrange:
+                    arrange(store)
+                result_cache.put(key, usn, store)
+            return store
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return None
+        finally:
+            conn.close()
 
-            except ValueError as e:
-                # Skip the row if the date can't be processed
-                print(f"Skipped processing due to invalid date format: {due_date_str}")
-                continue
-
-    def update_item_date(self, item, new_date):
-        item_values = self.tree_view.item(item, 'values')
-        new_values = (item_values[0], new_date.strftime('%Y-%m-%d')) + item_values[2:]  # Update the date
-        self.tree_view.item(item, values=new_values)  # Update the Treeview
-
-        # Update the database
-        id = item_values[0]  # Ensure this is the correct column for your ID
+    def render_all(self, start=0):
+        # Replace the Treeview items with the loans of the store, in display order (or only add the ones from
+        # position `start` on, the ones before are already shown)
+        if start == 0:
+            self.tree_view.delete(*self.tree_view.get_children())
+        current_date = self.reference_date()
+        for row in islice(self.loans.rows(), start, None):
+            status, tag = display_status(row[5], row[4], current_date)
+            self.tree_view.insert("", "end", iid=str(row[0]), values=row[:5] + (status,), tags=(tag,))
+
+    def update_loan(self, item, **fields):
+        # Write the given columns of one loan. The update only applies while the row still has the version
+        # it was loaded with; if another clerk changed it in the meantime the row is reloaded instead.
+        loan_id = int(item)
         db_file = self.db_combo.get()
-        if db_file:
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE equipment SET Date = ? WHERE ID = ?", (new_date.strftime('%Y-%m-%d'), id))
-            conn.commit()
-            conn.close()
+        if not db_file or self.as_of_date:
+            return False
 
-    def update_status_in_db(self, item, new_status):
-        item_values = self.tree_view.item(item, 'values')
-        id = item_values[0]  # Assuming the ID is in the first column
-        db_file = self.db_combo.get()
-        if db_file:
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
+        expected_version = self.loans.get(loan_id, 'RowVersion')
+
+        def write():
+            conn = open_db(db_file)
             try:
-                cursor.execute("UPDATE equipment SET Status = ? WHERE ID = ?", (new_status, id))
+                assignments, params = loan_assignments(conn, fields)
+                sql = f"UPDATE loans SET {assignments}, RowVersion = RowVersion + 1 WHERE ID = ?"
+                params.append(loan_id)
+                if expected_version is not None:
+                    sql += " AND RowVersion = ?"
+                    params.append(expected_version)
+                updated = conn.execute(sql, params).rowcount
                 conn.commit()
-            except sqlite3.Error as e:
-                print(f"Database error: {e}")
+                return updated
             finally:
                 conn.close()
-        self.app.refresh_pie_charts()
 
-    def update_item_color_and_status(self, item, status):
-        id = self.tree_view.item(item, 'values')[0]  # Assuming the ID is the first column
+        try:
+            updated = run_with_retry(write)
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return False
+        self.data_changed()
+
+        if not updated:
+            messagebox.showwarning("Update Conflict",
+                                   f"Loan {loan_id} was changed or deleted by another user in the meantime.\n"
+                                   "The current version has been reloaded, please check it and try again.")
+            self.refresh_rows([loan_id])
+            return False
+
+        if expected_version is not None:
+            self.loans.set(loan_id, RowVersion=expected_version + 1, **fields)
+            self.render_item(loan_id)
+        return True
+
+    def refresh_rows(self, loan_ids, insert_missing=False):
+        # Reload the given loans from the database into the grid; returns True if anything changed
         db_file = self.db_combo.get()
-        if db_file:
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE equipment SET Status = ? WHERE ID = ?", (status, id))
-            conn.commit()
+        if not db_file:
+            return False
+
+        conn = open_db(db_file)
+        try:
+            rows = fetch_loans_by_id(conn, loan_ids)
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            return False
+        finally:
             conn.close()
 
-        # Update the item color
-        if status == 'Returned':
-            self.tree_view.item(item, tags=('returned',))
+        changed = False
+        found = set()
+        for row in rows:
+            found.add(row[0])
+            if row[0] in self.loans:
+                if self.loans.get(row[0], 'RowVersion') != row[6]:
+                    self.loans.upsert(row)
+                    self.render_item(row[0])
+                    changed = True
+            elif insert_missing:
+                self.loans.upsert(row, first=True)
+                self.render_item(row[0], index=0)
+                changed = True
+
+        # Loans that no longer exist disappear from the grid
+        gone = {int(loan_id) for loan_id in loan_ids if int(loan_id) not in found and loan_id in self.loans}
+        if gone:
+            self.loans.remove(*gone)
+            self.tree_view.delete(*map(str, gone))
+            changed = True
+
+        return changed
+
+    def apply_external_changes(self, changes):
+        # changes: (ID, Deleted) pairs written by other clerks. New loans only show up in the unfiltered grid.
+        unfiltered = (self.current_filter().is_empty() and not self.search_entry.get().strip()
+                      and not self.as_of_date)
+        return self.refresh_rows([loan_id for loan_id, _ in changes], insert_missing=unfiltered)
+
+    def update_item_date(self, item, new_date):
+        # Update the database, the row is re-rendered from the store
+        self.update_loan(item, Date=new_date.strftime('%Y-%m-%d'))
+
+    def update_status_in_db(self, item, new_status, return_date=None):
+        # Returned items remember when they came back (today unless a date is given), others have no return date
+        if new_status.startswith('Returned'):
+            return_date = (return_date or datetime.now().date()).strftime('%Y-%m-%d')
         else:
-            self.tree_view.item(item, tags=('default',))
+            return_date = None
 
-        self.update_row_colors()  # Update all row colors
+        self.update_loan(item, Status=new_status, ReturnDate=return_date)
+        self.app.refresh_pie_charts()
+
+    def update_item_color_and_status(self, item, status):
+        return_date = datetime.now().strftime('%Y-%m-%d') if status.startswith('Returned') else None
+        # Only this row is re-rendered (with its color) once the database accepted the change
+        self.update_loan(item, Status=status, ReturnDate=return_date)
 
     def update_status_based_on_date(self, item, pseudo_current_date):
-        item_values = self.tree_view.item(item, 'values')
-        id = item_values[0]  # Assuming the ID is the first value
-        due_date_str = item_values[4]  # Adjust the index as necessary
+        due_date_str = self.loans.get(item, 'DueDate')
         due_date = datetime.strptime(due_date_str, "%Y-%m-%d").date()
 
         # Calculate the difference in days
@@ -790,12 +3867,8 @@ class EquipmentTrackingTab(tk.Frame):
         else:
             new_status = "Returned"
 
-        # Update the item in the Treeview
-        new_values = item_values[:-1] + (new_status,)
-        self.tree_view.item(item, values=new_values)
-
-        # Update the status in the database
-        self.update_status_in_db(item, new_status)
+        # Update the status in the database, the chosen date becomes the return date
+        self.update_status_in_db(item, new_status, pseudo_current_date)
 
         self.app.refresh_pie_charts()
 
@@ -804,55 +3877,48 @@ class EquipmentTrackingTab(tk.Frame):
         self.db_combo['values'] = self.scan_for_databases()
 
     def combined_database_selection_handler(self, event):
-        self.load_selected_db(event)
+        # Selecting another database starts a new session that all tabs load from; selecting the same one again
+        # keeps what is still current
+        if self.session is not None and self.session.db_file == self.db_combo.get():
+            self.session.revalidate()
+        else:
+            self.session = None
         self.on_database_selected(event)
 
+    @perf.timed('load_selected_db')
     def load_selected_db(self, event=None):
         # Clear the existing TreeView entries
-        for item in self.tree_view.get_children():
-            self.tree_view.delete(item)
+        self.populate_tree([])
 
         # Get the selected database file
         db_file = self.db_combo.get()
         if not db_file:
             return  # No database selected
 
-        # Construct the CSV filename based on the selected database name
-        csv_file = db_file.replace('.db', '_users.csv')
-        self.emails_file = csv_file  # Update the attribute to the new CSV file
-
-        if not os.path.exists(csv_file):
-            # If the CSV file does not exist, create an empty one
-            pd.DataFrame(columns=['User Email']).to_csv(csv_file, index=False)
+        # Make sure the search index and the other schema extras exist
+        prepare_database(db_file)
 
-        self.load_emails_into_combobox()  # This method will load emails from the new CSV into the combobox
-
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
+        self.load_emails_into_combobox()  # Emails from the database's users CSV, read once per session
 
-        try:
-            # Fetch data from the database
-            cursor.execute("SELECT ID, Date, Email, Equipment, DueDate, Status FROM equipment")
-            rows = cursor.fetchall()
+        # Fetch data from the database, only what was out on the as-of date in that mode
+        as_of_date = self.as_of_date
 
-            # Populate the TreeView with the database data
-            for row in rows:
-                self.tree_view.insert("", "end", values=row)
+        def fetch(conn):
+            if as_of_date:
+                return loans_out_on(conn, as_of_date)
+            return conn.execute("SELECT ID, Date, Email, Equipment, DueDate, Status, RowVersion FROM equipment").fetchall()
 
-            # Update row colors based on the status
-            self.update_row_colors()
-
-        except sqlite3.Error as e:
-            print(f"Database error: {e}")
-        finally:
-            conn.close()
+        # Populate the TreeView with the database data, colored based on the status, newest first
+        store = self.cached_result(db_file, ('as_of', as_of_date), fetch, sort='Date desc',
+                                   arrange=lambda store: store.sort('Date', reverse=True))
+        if store is not None:
+            self.show_store(store)
+        self.sort_reverse = False  # The next click on a date heading sorts oldest first
 
         self.load_equipment_entries()
-        self.sort_by_date(reverse=True)
 
     def update_due_date(self, item, new_due_date):
-        item_values = self.tree_view.item(item, 'values')
+        current_status = self.loans.get(item, 'Status')
         current_date = datetime.now().date()
         new_due_date_obj = datetime.strptime(new_due_date, "%Y-%m-%d").date()
 
@@ -863,25 +3929,10 @@ class EquipmentTrackingTab(tk.Frame):
             new_status = f"+{days_overdue}"
         else:
             # If the new due date is today or in the future, keep or set the status to 'Not Returned'
-            new_status = 'Not Returned' if 'Returned' not in item_values[-1] else item_values[-1]
-
-        # Update the treeview with new due date and status
-        new_values = item_values[:4] + (new_due_date,) + (new_status,)
-        self.tree_view.item(item, values=new_values)
-
-        # Update the database
-        id = item_values[0]
-        db_file = self.db_combo.get()
-        if db_file:
-            with sqlite3.connect(db_file) as conn:
-                cursor = conn.cursor()
-                cursor.execute("UPDATE equipment SET DueDate = ?, Status = ? WHERE ID = ?",
-                               (new_due_date, new_status, id))
-                conn.commit()
+            new_status = 'Not Returned' if 'Returned' not in current_status else current_status
 
-        # Update the colors and refresh the Treeview
-        self.update_row_colors()
-        self.tree_view.update_idletasks()
+        # Update the database, the row is re-rendered from the store
+        self.update_loan(item, DueDate=new_due_date, Status=new_status)
 
     def create_new_db(self):
         self.new_db_window = tk.Toplevel(self)
@@ -911,18 +3962,11 @@ class EquipmentTrackingTab(tk.Frame):
         db_filename = f'{base_db_name}_{db_index}.db'
         csv_filename = f'{base_db_name}_{db_index}_users.csv'
 
-        # Create the new database and its table
-        conn = sqlite3.connect(db_filename)
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS equipment (
-                              ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                              Date TEXT,
-                              Email TEXT,
-                              Equipment TEXT,
-                              DueDate TEXT,
-                              Status TEXT DEFAULT 'Not Returned')''')
-        conn.commit()
+        # Create the new database and its tables
+        conn = open_db(db_filename)
+        create_loan_tables(conn)
         conn.close()
+        prepare_database(db_filename)
 
         # Create the corresponding CSV file
         if not os.path.exists(csv_filename):
@@ -932,9 +3976,6 @@ class EquipmentTrackingTab(tk.Frame):
         self.update_db_list()
         self.db_combo.set(db_filename)
 
-        # Update the emails_file attribute to the new CSV file
-        self.emails_file = csv_filename
-
         # Refresh the ListBox in the Confidence Index tab with users from the new CSV
         self.app.confidence_index_tab.populate_user_listbox()
 
@@ -947,53 +3988,44 @@ class EquipmentTrackingTab(tk.Frame):
             f.write(self.db_combo.get())
         self.destroy()
 
-    def sort_by_date(self, reverse=False):
-        l = [(self.tree_view.set(k, "Date"), k) for k in self.tree_view.get_children('')]
-        l.sort(reverse=reverse)  # True for descending order (newest to oldest), False for ascending
+    def sort_rows(self, column, reverse):
+        # Sort the loans in the store (no Treeview round trips) and move the items into the new order
+        if column == 'Status':
+            current_date = self.reference_date()
+            self.loans.sort(key=lambda row: display_status(row[5], row[4], current_date)[0], reverse=reverse)
+        else:
+            self.loans.sort(column, reverse=reverse)
+        for index, loan_id in enumerate(self.loans.order):
+            self.tree_view.move(str(loan_id), '', index)
 
-        # Rearrange items in sorted positions
-        for index, (_, k) in enumerate(l):
-            self.tree_view.move(k, '', index)
+    def sort_by_date(self, reverse=False):
+        # True for descending order (newest to oldest), False for ascending
+        self.sort_rows('Date', reverse)
 
         # Switch the order for the next sort
         self.sort_reverse = not reverse
 
     def sort_by_column(self, col, reverse):
-        l = [(self.tree_view.set(k, col), k) for k in self.tree_view.get_children('')]
-        l.sort(reverse=reverse)  # True for descending, False for ascending
-
-        # rearrange items in sorted positions
-        for index, (val, k) in enumerate(l):
-            self.tree_view.move(k, '', index)
+        self.sort_rows(col, reverse)  # True for descending, False for ascending
 
         # reverse sort next time
         reverse = not reverse
         # Change the heading so that it will sort in the opposite direction
         self.tree_view.heading(col, command=lambda: self.sort_by_column(col, reverse))
 
+    @perf.timed('switch_database')
     def on_database_selected(self, event=None):
         # Get the selected database file from the combobox
         db_file = self.db_combo.get()
 
         if db_file:
-            # Extract the base filename without the extension and append '_users.csv' for the CSV filename
-            base_name = os.path.splitext(os.path.basename(db_file))[0]
-            self.emails_file = f"{base_name}_users.csv"
-
-            # Ensure the CSV file exists; if not, create it with the appropriate column header
-            if not os.path.exists(self.emails_file):
-                df = pd.DataFrame(columns=['User Email'])
-                df.to_csv(self.emails_file, index=False)
-
-            # Load email addresses from the corresponding CSV file into the combobox
-            self.load_emails_into_combobox()
-
-            # Load the data from the selected database into the TreeView
+            # Load the data from the selected database into the TreeView and the comboboxes; the other tabs
+            # take the users, borrowers and metrics from the same session instead of reading them again
             self.load_selected_db()
 
             # Trigger the update in the ConfidenceIndexTab
             if self.app.confidence_index_tab:
-                self.app.confidence_index_tab.update_for_new_database(db_file, self.emails_file)
+                self.app.confidence_index_tab.update_for_new_database(db_file)
         else:
             # Optionally, handle the case when no database is selected
             print("No database selected")
@@ -1011,8 +4043,16 @@ class ConfidenceIndexTab(tk.Frame):
         self.equipment_tab = equipment_tab  # Store the reference
         self.all_emails = []  # Initialize the attribute
         self.search_reset_job = None
+        self.charts_ready = False  # The charts (and matplotlib) are only created when the tab is first shown
+
+        # Trust Index counts per email (most recently used last), valid for trust_version (database, Usn, day)
+        self.trust_cache = OrderedDict()
+        self.trust_version = (None, None, None)
+        self.trust_conn = None
+        self.trust_db = None
+        self.prefetch_running = False
+        self.prefetch_pending = None
         self.create_widgets()
-        self.update_overall_chart()  # Call this to update the lower chart immediately
         self.populate_user_listbox()
 
         self.bind("<Visibility>", self.on_visibility)
@@ -1020,6 +4060,7 @@ class ConfidenceIndexTab(tk.Frame):
 
     def on_visibility(self, event):
         if event.widget == self:
+            self.ensure_charts()
             self.update_overall_chart()
 
     def on_listbox_keyrelease(self, event):
@@ -1083,34 +4124,40 @@ class ConfidenceIndexTab(tk.Frame):
         charts_container.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         # Left chart container for the user-specific pie chart
-        left_chart_frame = ttk.Frame(charts_container)
-        left_chart_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.left_chart_frame = ttk.Frame(charts_container)
+        self.left_chart_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
         # Right chart container for the overall stats pie chart
-        right_chart_frame = ttk.Frame(charts_container)
-        right_chart_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.right_chart_frame = ttk.Frame(charts_container)
+        self.right_chart_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # Load user emails into the listbox
+        self.load_user_emails()
+
+    def ensure_charts(self):
+        # Create both pie charts the first time the tab is shown
+        if self.charts_ready:
+            return
+        self.charts_ready = True
 
         # Setup for the first pie chart (User-specific chart)
-        self.figure1 = plt.Figure(figsize=(3, 2), dpi=100)
+        self.figure1 = mpl_figure.Figure(figsize=(3, 2), dpi=100)
         self.ax1 = self.figure1.add_subplot(111)
-        self.canvas1 = FigureCanvasTkAgg(self.figure1, left_chart_frame)
+        self.canvas1 = mpl_tkagg.FigureCanvasTkAgg(self.figure1, self.left_chart_frame)
         self.canvas1.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         self.figure1.patch.set_facecolor('none')
         self.ax1.patch.set_facecolor('none')
 
         # Setup for the second pie chart (Overall stats chart)
-        self.figure2 = plt.Figure(figsize=(3, 2), dpi=100)
+        self.figure2 = mpl_figure.Figure(figsize=(3, 2), dpi=100)
         self.figure2.tight_layout()
         self.ax2 = self.figure2.add_subplot(111)
-        self.canvas2 = FigureCanvasTkAgg(self.figure2, right_chart_frame)
+        self.canvas2 = mpl_tkagg.FigureCanvasTkAgg(self.figure2, self.right_chart_frame)
         self.canvas2.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         self.figure2.patch.set_facecolor('none')
         self.ax2.patch.set_facecolor('none')
 
-        # Load user emails into the listbox
-        self.load_user_emails()
-
-        # Call the update methods for both charts during initialization
+        # Draw both charts right away
         self.update_user_chart(None)  # Assuming a None email parameter for a default message
         self.update_overall_chart()
 
@@ -1129,11 +4176,8 @@ class ConfidenceIndexTab(tk.Frame):
         except Exception as e:
             print(f"An error occurred while loading the emails: {e}")
 
-    def update_for_new_database(self, db_file, emails_file):
-        # Load the new set of emails into the listbox
-        self.load_user_emails(emails_file)
-
-        # Update the pie charts to reflect the new data
+    def update_for_new_database(self, db_file):
+        # Load the borrowers of the new database into the listbox and update the pie charts
         self.populate_user_listbox()
         self.update_overall_chart()
         self.update_user_chart(None)  # Or pass the first email if needed
@@ -1170,7 +4214,10 @@ class ConfidenceIndexTab(tk.Frame):
             print("No email selected or available.")
 
     # Update the upper pie chart with user-specific data
+    @perf.timed('update_user_chart')
     def update_user_chart(self, email):
+        if not self.charts_ready:
+            return  # Drawn when the tab is first shown
         self.ax1.clear()
         self.ax1.set_title('Trust Index', loc='center', fontweight='bold')
 
@@ -1185,10 +4232,6 @@ class ConfidenceIndexTab(tk.Frame):
             user_identifier = email.split('@')[0]
             self.ax1.set_xlabel(f'{user_identifier}', fontsize=10, fontstyle='italic')
 
-        returned_on_time = 0
-        pending = 0
-        total_items = 0
-
         db_file = self.equipment_tab.db_combo.get()
 
         if not os.path.exists(db_file):
@@ -1199,19 +4242,7 @@ class ConfidenceIndexTab(tk.Frame):
             return
 
         try:
-            with sqlite3.connect(db_file) as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM equipment WHERE Email = ? AND Status = 'Returned'", (email,))
-                returned_on_time = cursor.fetchone()[0]
-
-                cursor.execute(
-                    "SELECT COUNT(*) FROM equipment WHERE Email = ? AND Status LIKE 'Returned +%' AND DueDate < ?",
-                    (email, datetime.now().strftime('%Y-%m-%d')))
-                pending = cursor.fetchone()[0]
-
-                cursor.execute("SELECT COUNT(*) FROM equipment WHERE Email = ?", (email,))
-                total_items = cursor.fetchone()[0]
-
+            returned_on_time, pending, total_items = self.user_trust_counts(db_file, email)
         except sqlite3.Error as e:
             print(f"Database error: {e}")
             self.ax1.axis('off')
@@ -1220,42 +4251,90 @@ class ConfidenceIndexTab(tk.Frame):
             self.canvas1.draw()
             return
 
-        if total_items > 0:
-            # Calculate percentages
-            on_time_pct = (returned_on_time / total_items) * 100
-            pending_pct = (pending / total_items) * 100
-            late_pct = 100 - on_time_pct - pending_pct
-
-            # Enhance the pie chart with a pseudo-3D effect
-            explode = (0.1, 0.1, 0.1)  # 'Explode' all slices a bit for a 3D effect
-            colors = ['green', 'red', 'grey']  # Adjust colors for a modern look
-            wedgeprops = {"edgecolor": "1", 'linewidth': 1, 'linestyle': 'solid', 'antialiased': True}
-
-            self.ax1.pie(
-                [on_time_pct, pending_pct, late_pct],
-                labels=['', '', ''],
-                autopct='%1.1f%%',
-                startangle=90,
-                colors=colors,
-                explode=explode,
-                shadow=True,
-                wedgeprops=wedgeprops,
-                textprops={'weight': 'bold'}
-            )
+        draw_trust_pie(self.ax1, returned_on_time, pending, total_items)
+        self.canvas1.draw()
 
-            self.ax1.axis('equal')
-        else:
-            self.ax1.axis('off')
-            self.ax1.text(0.5, 0.5, 'No items to display', horizontalalignment='center',
-                          verticalalignment='center', transform=self.ax1.transAxes)
+        # Get the users around this one ready for keyboard navigation through the listbox
+        self.prefetch_neighbors(db_file, email)
+
+    def trust_connection(self, db_file):
+        # One connection to the selected database is kept open for the Trust Index lookups
+        if self.trust_db != db_file:
+            if self.trust_conn is not None:
+                self.trust_conn.close()
+            prepare_database(db_file)
+            self.trust_conn = open_db(db_file)
+            self.trust_db = db_file
+        return self.trust_conn
+
+    def check_trust_cache(self, db_file, usn):
+        # Cached counts are only valid for the database, change sequence number and day they were read at
+        version = (db_file, usn, datetime.now().strftime('%Y-%m-%d'))
+        if version != self.trust_version:
+            self.trust_cache.clear()
+            self.trust_version = version
+
+    def remember_trust(self, email, counts):
+        self.trust_cache[email] = counts
+        self.trust_cache.move_to_end(email)
+        while len(self.trust_cache) > TRUST_CACHE_SIZE:
+            self.trust_cache.popitem(last=False)
+
+    def user_trust_counts(self, db_file, email):
+        # (returned on time, returned late, total items) of a user: from the cache while the database is unchanged,
+        # otherwise from one query
+        conn = self.trust_connection(db_file)
+        self.check_trust_cache(db_file, current_usn(conn))
+        counts = self.trust_cache.get(email)
+        if counts is None:
+            counts = trust_counts(conn, [email]).get(email, (0, 0, 0))
+        self.remember_trust(email, counts)
+        return counts
+
+    def prefetch_neighbors(self, db_file, email):
+        # Fetch the counts of the listbox entries around the displayed user in a background thread
+        emails = self.user_listbox.get(0, tk.END)
+        if email not in emails:
+            return
+        index = emails.index(email)
+        neighbors = [emails[i] for i in range(index - TRUST_PREFETCH_NEIGHBORS, index + TRUST_PREFETCH_NEIGHBORS + 1)
+                     if 0 <= i < len(emails) and i != index and emails[i] not in self.trust_cache]
+        if not neighbors:
+            return
+        if self.prefetch_running:
+            # Only the latest request matters once the running one is done
+            self.prefetch_pending = (db_file, email)
+            return
 
-        self.canvas1.draw()
+        self.prefetch_running = True
+
+        def fetch():
+            conn = open_db(db_file)
+            try:
+                return current_usn(conn), trust_counts(conn, neighbors)
+            finally:
+                conn.close()
 
+        def done(result, error):
+            self.prefetch_running = False
+            if error:
+                perf.error("trust prefetch", error)
+            elif self.trust_version[:2] == (db_file, result[0]):
+                for neighbor in neighbors:
+                    if neighbor not in self.trust_cache:
+                        self.remember_trust(neighbor, result[1].get(neighbor, (0, 0, 0)))
+            if self.prefetch_pending:
+                pending, self.prefetch_pending = self.prefetch_pending, None
+                self.prefetch_neighbors(*pending)
+
+        self.winfo_toplevel().run_in_background(fetch, done)
+
+    @perf.timed('update_overall_chart')
     def update_overall_chart(self):
+        if not self.charts_ready:
+            return  # Drawn when the tab is first shown
         self.ax2.clear()
 
-        # Define 'labels' for the pie chart
-        labels = ['Pending', 'Returned On Time', 'Returned Late', 'Currently Late']
         sizes = [0, 0, 0, 0]  # Initialize the sizes for each category
 
         db_file = self.equipment_tab.db_combo.get()
@@ -1263,28 +4342,23 @@ class ConfidenceIndexTab(tk.Frame):
             self.display_message_on_chart(self.ax2, 'Database file not found.\nPlease check the database settings.')
             return
 
-        try:
-            with sqlite3.connect(db_file) as conn:
-                cursor = conn.cursor()
-
-                # Count items that are pending (not returned but not overdue)
-                cursor.execute("SELECT COUNT(*) FROM equipment WHERE Status = 'Not Returned'")
-                sizes[0] = cursor.fetchone()[0]
-
-                # Count items that have been returned on time
-                cursor.execute("SELECT COUNT(*) FROM equipment WHERE Status = 'Returned'")
-                sizes[1] = cursor.fetchone()[0]
+        as_of_date = self.equipment_tab.as_of_date
 
-                # Count items that have been returned late
-                cursor.execute("SELECT COUNT(*) FROM equipment WHERE Status LIKE 'Returned +%'")
-                sizes[2] = cursor.fetchone()[0]
-
-                # Count items that are late (not returned and overdue)
-                cursor.execute("SELECT COUNT(*) FROM equipment WHERE Status LIKE '+%'")
-                sizes[3] = cursor.fetchone()[0]
+        try:
+            if as_of_date:
+                # Past state, answered from the loan interval index
+                prepare_database(db_file)
+                conn = open_db(db_file)
+                try:
+                    sizes = status_counts_as_of(conn, as_of_date)
+                finally:
+                    conn.close()
+            else:
+                # Pending, returned on time, returned late and currently late items, shared by the session
+                sizes = self.equipment_tab.current_session().status_counts()
 
         except sqlite3.Error as e:
-            print(f"Database error: {e}")
+            perf.error("overall chart", e)
             self.display_message_on_chart(self.ax2, 'Database error.\nPlease check the database integrity.')
             return
         except Exception as e:
@@ -1296,60 +4370,24 @@ class ConfidenceIndexTab(tk.Frame):
             self.display_message_on_chart(self.ax2, 'No data available')
             return
 
-        slice_colors = ['grey', 'green', 'red', 'orange']  # Define slice colors
-        wedges, texts, autotexts = self.ax2.pie(
-            sizes,
-            autopct='%1.1f%%',
-            startangle=90,
-            colors=slice_colors,
-            wedgeprops={'edgecolor': 'white', 'linewidth': 1.0, 'width': 0.3},
-            textprops={'fontsize': 9, 'color': 'black', 'weight': 'bold'},
-            shadow=True
-        )
-
-        # Improve the autopct positioning
-        for autotext in autotexts:
-            autotext.set_color('black')
-            autotext.set_fontsize('10')
-
-        # Place the legend below the pie chart
-        self.ax2.legend(
-            wedges,
-            labels,
-            title="",
-            loc='upper center',
-            bbox_to_anchor=(0.5, -0.1),
-            frameon=False
-        )
-
-        # Equal aspect ratio ensures that pie is drawn as a circle
-        self.ax2.axis('equal')
-        self.ax2.set_title('Overall Equipment Status', loc='center', fontweight='bold')
+        title = f'Equipment Status as of {as_of_date}' if as_of_date else 'Overall Equipment Status'
+        draw_status_pie(self.ax2, sizes, title)
 
         # Adjust layout to make room for the legend
         self.figure2.tight_layout()
         self.canvas2.draw()
 
     def get_borrower_emails_from_db(self):
-        db_file = self.equipment_tab.db_combo.get()
+        session = self.equipment_tab.current_session()
 
-        if not db_file or not os.path.exists(db_file):
+        if session is None or not os.path.exists(session.db_file):
             return []
 
-        emails = set()
         try:
-            conn = sqlite3.connect(db_file)
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT Email FROM equipment")
-            for row in cursor.fetchall():
-                emails.add(row[0])
+            return list(session.borrower_emails())
         except sqlite3.Error as e:
-            pass  # Optionally, handle the error e.g., logging it or displaying a user-friendly message
-        finally:
-            if conn:
-                conn.close()
-
-        return list(emails)
+            perf.error("borrowers", e)
+            return []
 
     def display_message_on_chart(self, axis, message):
         """ Helper function to display a message on a given chart axis. """
@@ -1375,7 +4413,7 @@ class SummaryTab(tk.Frame):
         # Configure a new style named Custom.Treeview that inherits from the default Treeview style
         style.configure("Custom.Treeview", background="#cccccc")  # Grey background
 
-        tree_view = ttk.Treeview(tree_frame, columns=columns, show='headings', style="Custom.Treeview")
+        tree_view = InstrumentedTreeview(tree_frame, columns=columns, show='headings', style="Custom.Treeview")
 
         # Setting the width of the 'Email' column to be wider
         tree_view.column("Email", anchor="center", width=300)
@@ -1399,6 +4437,7 @@ class SummaryTab(tk.Frame):
 
         return tree_view
 
+    @perf.timed('summary_refresh')
     def populate_treeview(self):
         self.tree_view.delete(*self.tree_view.get_children())  # Clear existing data
         data = self.calculate_user_metrics()
@@ -1406,54 +4445,19 @@ class SummaryTab(tk.Frame):
             self.tree_view.insert('', 'end', values=row)
 
     def calculate_user_metrics(self):
-        db_path = self.equipment_tab.db_combo.get()  # Dynamically get the database path
-        print(db_path)
-        if not db_path:
-            return []  # Early exit if db_path is not set
-
-        with sqlite3.connect(db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT Email FROM equipment")
-            emails = [email[0] for email in cursor.fetchall()]
+        session = self.equipment_tab.current_session()  # The selected database's shared datasets
+        if session is None:
+            return []  # Early exit if no database is selected
 
-            data = []
-            for email in emails:
-                metrics = self.calculate_metrics_for_email(conn, email)
-                data.append((email, *metrics))
-
-            # Sort data based on standing, higher standing first
-            data.sort(key=lambda x: x[-1], reverse=True)
-        return data
-
-    def calculate_metrics_for_email(self, conn, email):
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM equipment WHERE Email = ?", (email,))
-        total_items = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM equipment WHERE Email = ? AND Status = 'Returned'", (email,))
-        returned_on_time = cursor.fetchone()[0]
-
-        cursor.execute(
-            "SELECT COUNT(*) FROM equipment WHERE Email = ? AND Status LIKE 'Returned +%' AND DueDate < datetime('now')",
-            (email,))
-        returned_late = cursor.fetchone()[0]
-
-        cursor.execute(
-            "SELECT COUNT(*) FROM equipment WHERE Email = ? AND (Status = 'Not Returned' OR (Status LIKE 'Returned +%' AND DueDate >= datetime('now')))",
-            (email,))
-        pending = cursor.fetchone()[0]
-
-        # Calculate standing based on your own logic
-        # Example formula:
-        # - Awarding points for on-time returns,
-        # - Deducting more points for late returns and pending items
-        if total_items > 0:
-            standing = ((returned_on_time / total_items) * 100) - ((returned_late + pending) / total_items * 50)
-            standing = max(0, min(standing, 100))  # Ensuring standing is between 0 and 100
-        else:
-            standing = 0  # Minimum grade if no items are borrowed
+        # Every user's counts come from one grouped query (the same one the JSON API serves)
+        try:
+            data = session.user_metrics()
+        except sqlite3.Error as e:
+            perf.error("summary", e)
+            return []
 
-        return total_items, returned_on_time, returned_late, pending, int(standing)
+        # Sort data based on standing, higher standing first
+        return sorted(data, key=lambda x: x[-1], reverse=True)
 
     def sort_treeview(self, col, reverse=False):
         l = [(self.tree_view.set(k, col), k) for k in self.tree_view.get_children('')]
@@ -1463,6 +4467,191 @@ class SummaryTab(tk.Frame):
         self.tree_view.heading(col, command=lambda: self.sort_treeview(col, not reverse))
 
 
+class TrendsTab(tk.Frame):
+    def __init__(self, parent, background_color, equipment_tab):
+        super().__init__(parent, background=background_color)
+        self.equipment_tab = equipment_tab
+
+        # Grain and equipment type selection
+        controls = tk.Frame(self, background=background_color)
+        controls.pack(fill='x', pady=5)
+        tk.Label(controls, text="Period:", background=background_color).pack(side=tk.LEFT, padx=5)
+        self.grain_combobox = ttk.Combobox(controls, values=('Week', 'Month'), state='readonly', width=10)
+        self.grain_combobox.set('Month')
+        self.grain_combobox.pack(side=tk.LEFT, padx=5)
+        self.grain_combobox.bind("<<ComboboxSelected>>", lambda e: self.update_chart())
+        tk.Label(controls, text="Equipment:", background=background_color).pack(side=tk.LEFT, padx=5)
+        self.equipment_combobox = ttk.Combobox(controls, state='readonly', width=25)
+        self.equipment_combobox.set('All')
+        self.equipment_combobox.pack(side=tk.LEFT, padx=5)
+        self.equipment_combobox.bind("<<ComboboxSelected>>", lambda e: self.update_chart())
+        tk.Label(controls, text="View:", background=background_color).pack(side=tk.LEFT, padx=5)
+        self.view_combobox = ttk.Combobox(controls, values=('Volume', 'Concurrent Use'), state='readonly', width=15)
+        self.view_combobox.set('Volume')
+        self.view_combobox.pack(side=tk.LEFT, padx=5)
+        self.view_combobox.bind("<<ComboboxSelected>>", lambda e: self.update_chart())
+
+        # Last concurrent-use sweep: (database, change sequence number, peaks, curve)
+        self.utilization = None
+        # The latest trends refresh; results of older ones that finish later are dropped
+        self.trends_request = None
+
+        # The chart (and matplotlib) is created when the tab is first shown
+        self.figure = None
+
+    def ensure_chart(self):
+        if self.figure is not None:
+            return
+        self.figure = mpl_figure.Figure(figsize=(8, 4), dpi=100)
+        self.ax = self.figure.add_subplot(111)
+        self.ax_outstanding = self.ax.twinx()
+        self.canvas = mpl_tkagg.FigureCanvasTkAgg(self.figure, self)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        self.figure.patch.set_facecolor('none')
+
+    @perf.timed('trends_refresh')
+    def update_chart(self):
+        self.ensure_chart()
+        self.ax.clear()
+        self.ax_outstanding.clear()
+        self.trends_request = None  # A refresh still running is out of date now
+
+        db_file = self.equipment_tab.db_combo.get()
+        if not db_file or not os.path.exists(db_file):
+            self.show_message('Database file not found.')
+            return
+
+        if self.view_combobox.get() == 'Concurrent Use':
+            self.update_utilization_chart(db_file)
+            return
+
+        grain = self.grain_combobox.get().lower()
+        equipment = self.equipment_combobox.get()
+        prepare_database(db_file)
+        self.show_message('Loading trends...')
+        self.trends_request = request = object()
+
+        def read():
+            # Writes the rollups, so it runs in a worker thread instead of holding up the window
+            conn = open_db(db_file)
+            try:
+                # Only the periods touched since the last refresh are recomputed
+                refresh_rollups(conn)
+                types = [row[0] for row in conn.execute(
+                    "SELECT DISTINCT Equipment FROM loan_rollups WHERE Grain = 'month' ORDER BY Equipment")]
+                return types, read_trends(conn, grain, None if equipment == 'All' else equipment)
+            finally:
+                conn.close()
+
+        def done(result, error):
+            if request is not self.trends_request:
+                return
+            self.ax.clear()
+            if error:
+                perf.error("trends", error)
+                self.show_message('Database error.')
+                return
+            types, trends = result
+            self.equipment_combobox['values'] = ['All'] + types
+            if not trends:
+                self.show_message('No data available')
+                return
+            self.draw_trends(trends)
+
+        self.winfo_toplevel().run_in_background(read, done)
+
+    def draw_trends(self, trends):
+        periods = [row[0] for row in trends]
+        positions = range(len(periods))
+        self.ax.axis('on')
+        self.ax_outstanding.axis('on')
+        self.ax.plot(positions, [row[1] for row in trends], color='grey', label='Opened')
+        self.ax.plot(positions, [row[2] for row in trends], color='green', label='Returned')
+        self.ax.plot(positions, [row[3] for row in trends], color='red', label='Returned Late')
+        self.ax_outstanding.plot(positions, [row[4] for row in trends], color='orange', linestyle='--',
+                                 label='Outstanding')
+
+        # Label at most about 12 periods so the axis stays readable
+        step = max(1, len(periods) // 12)
+        self.ax.set_xticks(list(positions)[::step])
+        self.ax.set_xticklabels(periods[::step], rotation=45, ha='right', fontsize=8)
+        self.ax.set_ylabel('Loans per period')
+        self.ax_outstanding.set_ylabel('Outstanding')
+
+        lines = self.ax.get_lines() + self.ax_outstanding.get_lines()
+        self.ax.legend(lines, [line.get_label() for line in lines], loc='upper left', frameon=False)
+        self.ax.set_title('Borrowing Trends', loc='center', fontweight='bold')
+        self.figure.tight_layout()
+        self.canvas.draw()
+
+    def update_utilization_chart(self, db_file):
+        # The sweep covers every loan, so it runs in the background and is reused until the data changes
+        prepare_database(db_file)
+        conn = open_db(db_file)
+        try:
+            usn = current_usn(conn)
+        finally:
+            conn.close()
+
+        if self.utilization and self.utilization[:2] == (db_file, usn):
+            self.draw_utilization(*self.utilization[2:])
+            return
+
+        self.show_message('Computing concurrent use...')
+
+        def sweep():
+            conn = open_db(db_file)
+            try:
+                return concurrent_utilization(conn)
+            finally:
+                conn.close()
+
+        def done(result, error):
+            if error:
+                perf.error("concurrent use", error)
+                self.ax.clear()
+                self.show_message('Database error.')
+                return
+            self.utilization = (db_file, usn) + result
+            if self.view_combobox.get() == 'Concurrent Use':
+                self.ax.clear()
+                self.draw_utilization(*result)
+
+        self.winfo_toplevel().run_in_background(sweep, done)
+
+    def draw_utilization(self, peaks, curve):
+        equipment = self.equipment_combobox.get()
+        self.equipment_combobox['values'] = ['All'] + sorted(curve)
+        if equipment == 'All':
+            points = combine_utilization_curves(curve)
+            peak = max(points, key=lambda point: point[1], default=(None, 0))
+            peak = (peak[1], peak[0])
+        else:
+            points = curve.get(equipment, [])
+            peak = peaks.get(equipment, (0, None))
+
+        if not points:
+            self.show_message('No data available')
+            return
+
+        self.ax.axis('on')
+        self.ax_outstanding.axis('off')
+        days = [datetime.strptime(day, "%Y-%m-%d") for day, _ in points]
+        self.ax.step(days, [count for _, count in points], where='post', color='orange')
+        self.ax.set_ylabel('Loans out at once')
+        self.ax.set_title(f'Concurrent Use ({equipment}) - peak {peak[0]} on {peak[1]}', loc='center', fontweight='bold')
+        self.figure.autofmt_xdate()
+        self.figure.tight_layout()
+        self.canvas.draw()
+
+    def show_message(self, message):
+        self.ax.axis('off')
+        self.ax_outstanding.axis('off')
+        self.ax.text(0.5, 0.5, message, horizontalalignment='center', verticalalignment='center',
+                     transform=self.ax.transAxes)
+        self.canvas.draw()
+
+
 class TechTachoApp(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -1494,6 +4683,10 @@ class TechTachoApp(tk.Tk):
         self.summary_tab = SummaryTab(self.tab_control, background_color, self.equipment_tab)
         self.tab_control.add(self.summary_tab, text='Summary')
 
+        # Initialize the Trends tab
+        self.trends_tab = TrendsTab(self.tab_control, background_color, self.equipment_tab)
+        self.tab_control.add(self.trends_tab, text='Trends')
+
         # Make sure EquipmentTrackingTab has a reference to SummaryTab
         self.equipment_tab.summary_tab = self.summary_tab
 
@@ -1509,12 +4702,206 @@ class TechTachoApp(tk.Tk):
         # Set up window close event handling
         self.protocol("WM_DELETE_WINDOW", self.on_app_close)
 
+        # Tools menu
+        self.menu_bar = tk.Menu(self)
+        self.tools_menu = tk.Menu(self.menu_bar, tearoff=0)
+        self.tools_menu.add_command(label="Send Overdue Reminders", command=self.send_overdue_reminders)
+        self.tools_menu.add_separator()
+        self.compress_backups = tk.BooleanVar(value=False)
+        self.backup_progress = None
+        self.tools_menu.add_command(label="Back Up Database", command=self.back_up_database)
+        self.tools_menu.add_checkbutton(label="Compress Backups", variable=self.compress_backups)
+        self.tools_menu.add_command(label="Database Maintenance", command=self.maintain_database)
+        self.tools_menu.add_command(label="Sync With Copy...", command=self.sync_with_copy)
+        self.tools_menu.add_separator()
+        self.scan_window = None
+        self.tools_menu.add_command(label="Scan Mode", command=self.open_scan_mode)
+        self.tools_menu.add_command(label="Bulk Checkout...", command=self.open_bulk_checkout)
+        self.menu_bar.add_cascade(label="Tools", menu=self.tools_menu)
+        self.config(menu=self.menu_bar)
+
+        # Hidden diagnostics window with the per-action performance records
+        self.bind_all("<Control-Shift-P>", lambda e: self.show_diagnostics())
+
+        # Pick up changes other clerks make to the same database file
+        self.watch_conn = None
+        self.watch_db = None
+        self.after(CHANGE_POLL_MS, self.poll_external_changes)
+
+        # Keep the stored overdue statuses current (the change watcher then refreshes the affected rows)
+        self.after(10000, self.run_overdue_scheduler)
+
+        # Weekly database maintenance, started once nobody used the app for a while
+        self.last_input = time.monotonic()
+        self.maintenance_running = False
+        self.bind_all("<Any-KeyPress>", self.note_input, add='+')
+        self.bind_all("<Any-ButtonPress>", self.note_input, add='+')
+        self.after(MAINTENANCE_CHECK_MS, self.run_maintenance_scheduler)
+
     def on_tab_changed(self, event):
         selected_tab = event.widget.select()
         tab_text = event.widget.tab(selected_tab, "text")
-        if tab_text == "Confidence Index":
-            self.confidence_index_tab.update_overall_chart()
+        with perf.action(f'tab_switch:{tab_text}'):
+            if tab_text == "Confidence Index":
+                self.confidence_index_tab.ensure_charts()
+                self.confidence_index_tab.update_overall_chart()
+            elif tab_text == "Trends":
+                self.trends_tab.update_chart()
+
+    def run_in_background(self, work, on_done):
+        # Run work() in a worker thread and hand its result (or exception) to on_done() on the Tk thread
+        result = {}
+
+        def worker():
+            try:
+                result['value'] = work()
+            except Exception as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+        def check():
+            if thread.is_alive():
+                self.after(200, check)
+            else:
+                on_done(result.get('value'), result.get('error'))
+
+        self.after(200, check)
 
+    def send_overdue_reminders(self):
+        db_file = self.equipment_tab.db_combo.get()
+        if not db_file:
+            messagebox.showinfo("Reminders", "No database selected.")
+            return
+
+        settings = load_smtp_settings()
+        if not settings:
+            messagebox.showerror("Reminders", f"No SMTP settings found, please create {SMTP_SETTINGS_FILE}.")
+            return
+
+        engine = ReminderEngine.from_settings(db_file, settings)
+        digests = engine.find_due_reminders()
+        if not digests:
+            messagebox.showinfo("Reminders", "No overdue loans need a reminder.")
+            return
+
+        loans = sum(len(user_loans) for user_loans in digests.values())
+        if not messagebox.askyesno("Reminders", f"Send {len(digests)} reminder emails covering {loans} overdue loans?"):
+            return
+
+        def done(report, error):
+            if error:
+                messagebox.showerror("Reminders", f"Sending reminders failed: {error}")
+            else:
+                messagebox.showinfo("Reminders", f"Sent {report['sent']} reminder emails ({report['loans']} loans), "
+                                                 f"{report['failed']} failed, in {report['seconds']} s.")
+
+        self.run_in_background(engine.run, done)
+
+    def back_up_database(self):
+        # Online snapshot in a worker thread; clerks keep working and the title shows the progress
+        db_file = self.equipment_tab.db_combo.get()
+        if not db_file or not os.path.exists(db_file):
+            messagebox.showinfo("Backup", "No database selected.")
+            return
+        if self.backup_progress is not None:
+            messagebox.showinfo("Backup", "A backup is already running.")
+            return
+
+        self.backup_progress = [0, 0]
+        compress = self.compress_backups.get()
+
+        def progress(copied, total):
+            self.backup_progress = [copied, total]
+
+        def done(result, error):
+            self.backup_progress = None
+            self.title("TechTacho - IT Equipment Tracker")
+            if error:
+                messagebox.showerror("Backup", f"The backup failed: {error}")
+            else:
+                messagebox.showinfo("Backup", f"Snapshot written to {result['path']}\n"
+                                              f"{result['bytes'] / 1048576:.0f} MB in {result['seconds']} s "
+                                              f"({result['mb_per_s']} MB/s)")
+
+        self.run_in_background(lambda: backup_database(db_file, compress=compress, progress=progress), done)
+        self.show_backup_progress()
+
+    def sync_with_copy(self):
+        # Exchange the changed loans with another copy of the open database (e.g. a field laptop's); the grid
+        # picks up the received changes through the change watch
+        db_file = self.equipment_tab.db_combo.get()
+        if not db_file or not os.path.exists(db_file):
+            messagebox.showinfo("Sync", "No database selected.")
+            return
+        peer_file = filedialog.askopenfilename(title="Copy of the database to sync with",
+                                               filetypes=[("Database files", "*.db"), ("All files", "*.*")])
+        if not peer_file:
+            return
+        if os.path.abspath(peer_file) == os.path.abspath(db_file):
+            messagebox.showinfo("Sync", "Please choose another copy of the database.")
+            return
+
+        def done(report, error):
+            if error:
+                messagebox.showerror("Sync", f"The sync failed: {error}")
+            else:
+                messagebox.showinfo("Sync", format_sync_report(report))
+
+        self.run_in_background(lambda: sync_databases(db_file, peer_file), done)
+
+    def open_scan_mode(self):
+        db_file = self.equipment_tab.db_combo.get()
+        if not db_file or not os.path.exists(db_file):
+            messagebox.showinfo("Scan Mode", "No database selected.")
+            return
+        if self.equipment_tab.editing_blocked():
+            return
+        if self.scan_window is not None:
+            self.scan_window.lift()
+            return
+        prepare_database(db_file)
+        self.scan_window = ScanWindow(self, db_file)
+
+    def open_bulk_checkout(self):
+        db_file = self.equipment_tab.db_combo.get()
+        if not db_file or not os.path.exists(db_file):
+            messagebox.showinfo("Bulk Checkout", "No database selected.")
+            return
+        if self.equipment_tab.editing_blocked():
+            return
+        prepare_database(db_file)
+        BulkCheckoutWindow(self, db_file)
+
+    def kit_checked_out(self, db_file, emails, loan_ids):
+        # One refresh for the whole checkout: the users CSV, the comboboxes, the new rows and the counters
+        tab = self.equipment_tab
+        session = tab.current_session()
+        if session is None or session.db_file != db_file:
+            return
+        session.add_users(emails)
+        tab.data_changed()
+        tab.load_emails_into_combobox()
+        tab.load_equipment_entries()
+        # The new loans are added to the grid like loans written by another clerk (the change watch then finds
+        # them there already and redraws nothing)
+        tab.apply_external_changes([(loan_id, 0) for loan_id in loan_ids])
+        self.refresh_pie_charts()
+        self.summary_tab.populate_treeview()
+
+    def show_backup_progress(self):
+        if self.backup_progress is None:
+            return
+        copied, total = self.backup_progress
+        if total:
+            self.title(f"TechTacho - IT Equipment Tracker (backing up {copied * 100 // total}%)")
+        self.after(250, self.show_backup_progress)
+
+    def show_diagnostics(self):
+        DiagnosticsWindow(self)
+
+    @perf.timed('refresh_pie_charts')
     def refresh_pie_charts(self):
         self.confidence_index_tab.update_overall_chart()
 
@@ -1526,9 +4913,125 @@ class TechTachoApp(tk.Tk):
             # Handle the case where there are no emails, perhaps clearing the chart or showing default info
             self.confidence_index_tab.update_user_chart(None)
 
+    def poll_external_changes(self):
+        # PRAGMA data_version only changes when another connection committed to the file, so the check is
+        # free while nobody writes. Once it moves, equipment_changes tells exactly which loans changed.
+        db_file = self.equipment_tab.db_combo.get()
+        try:
+            if db_file != self.watch_db:
+                self.stop_change_watch()
+                if db_file and os.path.exists(db_file):
+                    prepare_database(db_file)
+                    self.watch_conn = open_db(db_file)
+                    self.watch_db = db_file
+                    self.data_version = self.watch_conn.execute("PRAGMA data_version").fetchone()[0]
+                    self.last_usn = current_usn(self.watch_conn)
+            elif self.watch_conn is not None and not (self.scan_window is not None and self.scan_window.busy()):
+                # During a scan session the grid and the charts catch up once, when the scanning pauses
+                data_version = self.watch_conn.execute("PRAGMA data_version").fetchone()[0]
+                if data_version != self.data_version:
+                    self.data_version = data_version
+                    changes = self.watch_conn.execute("SELECT ID, Deleted, Usn FROM equipment_changes WHERE Usn > ?",
+                                                      (self.last_usn,)).fetchall()
+                    if changes:
+                        self.last_usn = max(usn for _, _, usn in changes)
+                        self.equipment_tab.data_changed()
+                        if self.equipment_tab.apply_external_changes([(loan_id, deleted) for loan_id, deleted, _ in changes]):
+                            # Only the counters depend on the other rows
+                            self.refresh_pie_charts()
+                            self.summary_tab.populate_treeview()
+        except sqlite3.Error as e:
+            perf.error("change watch", e)
+
+        self.after(CHANGE_POLL_MS, self.poll_external_changes)
+
+    def run_overdue_scheduler(self):
+        # The marking runs in a worker thread; the change watch then refreshes the rows that became overdue
+        db_file = self.equipment_tab.db_combo.get()
+        if db_file and os.path.exists(db_file):
+            prepare_database(db_file)
+
+            def done(marked, error):
+                if error:
+                    perf.error("mark overdue", error)
+
+            self.run_in_background(lambda: mark_newly_overdue(db_file), done)
+        self.after(OVERDUE_CHECK_MS, self.run_overdue_scheduler)
+
+    def note_input(self, event=None):
+        self.last_input = time.monotonic()
+
+    def idle_seconds(self):
+        return time.monotonic() - self.last_input
+
+    def run_maintenance_scheduler(self):
+        db_file = self.equipment_tab.db_combo.get()
+        if (not self.maintenance_running and self.backup_progress is None and db_file and os.path.exists(db_file)
+                and self.idle_seconds() >= MAINTENANCE_IDLE_SECONDS):
+            try:
+                if maintenance_due(db_file):
+                    # The vacuum stops as soon as somebody uses the app again
+                    self.start_maintenance(db_file, quiet=True)
+            except sqlite3.Error as e:
+                print(f"Database error while checking for maintenance: {e}")
+        self.after(MAINTENANCE_CHECK_MS, self.run_maintenance_scheduler)
+
+    def maintain_database(self):
+        db_file = self.equipment_tab.db_combo.get()
+        if not db_file or not os.path.exists(db_file):
+            messagebox.showinfo("Maintenance", "No database selected.")
+            return
+        if self.maintenance_running:
+            messagebox.showinfo("Maintenance", "Maintenance is already running.")
+            return
+
+        full_vacuum = False
+        conn = open_db(db_file)
+        try:
+            pages = database_pages(conn)
+        finally:
+            conn.close()
+        if pages['auto_vacuum'] != 2 and pages['freelist_count']:
+            full_vacuum = messagebox.askyesno(
+                "Maintenance", f"{pages['freelist_count']} pages of this database are unused. Reclaiming them takes "
+                               "one full VACUUM, which blocks other clerks' changes while it runs; afterwards free "
+                               "pages are reclaimed in small steps.\n\nRun the full VACUUM now?")
+        self.start_maintenance(db_file, full_vacuum=full_vacuum)
+
+    def start_maintenance(self, db_file, full_vacuum=False, quiet=False):
+        self.maintenance_running = True
+        prepare_database(db_file)
+        should_stop = (lambda: self.idle_seconds() < MAINTENANCE_IDLE_SECONDS) if quiet else None
+
+        def done(report, error):
+            self.maintenance_running = False
+            if error:
+                print(f"Database maintenance failed: {error}")
+                if not quiet:
+                    messagebox.showerror("Maintenance", f"Maintenance failed: {error}")
+            elif quiet:
+                print(format_maintenance_report(report))
+            else:
+                messagebox.showinfo("Maintenance", format_maintenance_report(report))
+
+        self.run_in_background(lambda: run_maintenance(db_file, full_vacuum, should_stop=should_stop), done)
+
+    def stop_change_watch(self):
+        if self.watch_conn is not None:
+            self.watch_conn.close()
+        self.watch_conn = None
+        self.watch_db = None
+
     def on_app_close(self):
+        self.stop_change_watch()
+        db_file = self.equipment_tab.db_combo.get()
         with open('last_db.txt', 'w') as f:
-            f.write(self.equipment_tab.db_combo.get())
+            f.write(db_file)
+        if db_file and os.path.exists(db_file):
+            try:
+                save_startup_snapshot(db_file, self.equipment_tab.session, self.equipment_tab.snapshot_page())
+            except (sqlite3.Error, OSError) as e:
+                print(f"Could not save the startup snapshot: {e}")
         self.destroy()
 
     def load_last_selected_db(self):
@@ -1537,11 +5040,1153 @@ class TechTachoApp(tk.Tk):
                 last_db = f.read().strip()
                 if last_db and os.path.exists(last_db):
                     self.equipment_tab.db_combo.set(last_db)
-                    self.equipment_tab.load_selected_db(None)
+                    # Paint what was shown on the last close right away and check it against the database once
+                    # the window is up; the stamp is taken before anything opens the file
+                    stamp = database_stamp(last_db)
+                    snapshot = read_startup_snapshot(last_db)
+                    if snapshot is not None:
+                        self.equipment_tab.show_snapshot(snapshot)
+                        self.after(100, lambda: self.revalidate_startup_snapshot(last_db, snapshot, stamp))
+                    else:
+                        self.equipment_tab.load_selected_db(None)
                     self.after(500, self.confidence_index_tab.populate_user_listbox)  # Delayed population
                 else:
                     print("The last database file was not found.")
 
+    def revalidate_startup_snapshot(self, db_file, snapshot, stamp):
+        prepare_database(db_file)
+
+        def done(result, error):
+            tab = self.equipment_tab
+            if tab.db_combo.get() != db_file:
+                return  # Another database was selected meanwhile
+            if error:
+                perf.error("startup snapshot", error)
+                tab.load_selected_db()
+                return
+            usn, store, fresh = result
+            result_cache.put((os.path.abspath(db_file), ('as_of', None), 'Date desc'), usn, store)
+            tab.finish_snapshot(store)
+
+            # Only the views whose numbers changed are redrawn; datasets already dropped by a write meanwhile are
+            # read again when needed anyway
+            session = tab.current_session()
+            changed = set()
+            for name, value in fresh.items():
+                if name in session.data:
+                    if session.data[name] != value:
+                        changed.add(name)
+                    session.restore(name, value, (usn, datetime.now().strftime('%Y-%m-%d')))
+            if 'user_metrics' in changed:
+                self.summary_tab.populate_treeview()
+            if 'status_counts' in changed:
+                self.confidence_index_tab.update_overall_chart()
+
+            # Left out of the snapshot: the users CSV and the equipment list behind the comboboxes
+            tab.load_emails_into_combobox()
+            tab.load_equipment_entries()
+
+        self.run_in_background(lambda: revalidate_snapshot(db_file, snapshot, stamp), done)
+
+def cmd_remind(args):
+    settings = load_smtp_settings() or {}
+    if args.host:
+        settings['host'] = args.host
+    if 'host' not in settings:
+        print(f"No SMTP host given (use --host or {SMTP_SETTINGS_FILE}).")
+        return 1
+
+    prepare_database(args.db)
+    engine = ReminderEngine.from_settings(args.db, settings)
+    engine.port = args.port or engine.port
+    engine.sender = args.sender or engine.sender
+    engine.cooldown_days = args.cooldown_days if args.cooldown_days is not None else engine.cooldown_days
+    engine.concurrency = args.concurrency
+    engine.rate_per_second = args.rate
+
+    report = engine.run(dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+    return 1 if report['failed'] else 0
+
+
+def cmd_mark_overdue(args):
+    marked = mark_newly_overdue(args.db, force=args.force)
+    if marked is None:
+        print("Overdue statuses are already up to date for today (use --force to run again).")
+    else:
+        print(f"{marked} loans marked as overdue.")
+    return 0
+
+
+def cmd_report(args):
+    prepare_database(args.db)
+    conn = open_db(args.db, profile='reporting')
+    try:
+        counts = overall_status_counts(conn)
+        print("Overall equipment status")
+        for label, count in zip(STATUS_LABELS, counts):
+            print(f"  {label:<18}{count:>10}")
+
+        started = time.perf_counter()
+        peaks, curve = concurrent_utilization(conn)
+        print(f"\nPeak concurrent loans per equipment type ({time.perf_counter() - started:.2f} s)")
+        for equipment, (peak, day) in sorted(peaks.items(), key=lambda item: -item[1][0]):
+            print(f"  {equipment or '(none)':<18}{peak:>10}  on {day}")
+    finally:
+        conn.close()
+
+    if args.curve:
+        with open(args.curve, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Day', 'Equipment', 'Loans Out'])
+            for equipment, points in sorted(curve.items()):
+                writer.writerows((day, equipment, count) for day, count in points)
+        print(f"\nUtilization curve written to {args.curve}")
+    return 0
+
+
+BENCH_EQUIPMENT_TYPES = ['Laptop', 'Charger', 'Mouse', 'Keyboard', 'Headset', 'Monitor', 'Docking Station', 'Webcam']
+
+
+def generate_loans(count):
+    # (ID, Date, Email, Equipment, DueDate, Status) rows with realistic cardinalities for benchmarks: a few
+    # thousand users (about a hundred loans each at larger sizes), a handful of equipment types, three years of
+    # dates and a mix of open, overdue, returned and late returned loans
+    users = max(3000, count // 100)
+    start = datetime(2021, 1, 1)
+    for loan_id in range(1, count + 1):
+        borrowed = start + timedelta(days=loan_id % 1100)
+        due = borrowed + timedelta(days=7 + loan_id % 21)
+        if loan_id % 7 == 0:
+            status = 'Not Returned' if loan_id % 2 else f"+{loan_id % 30 + 1}"
+        else:
+            status = 'Returned +3' if loan_id % 11 == 0 else 'Returned'
+        yield (loan_id, borrowed.strftime('%Y-%m-%d'), f"user{loan_id % users}@example.com",
+               BENCH_EQUIPMENT_TYPES[loan_id % len(BENCH_EQUIPMENT_TYPES)], due.strftime('%Y-%m-%d'), status)
+
+
+def create_bench_table(conn, count):
+    # The loans, users and equipment types tables (and the equipment view) filled with generate_loans(count)
+    create_loan_tables(conn)
+    users = {}
+    types = {}
+
+    def rows():
+        for loan_id, date, email, equipment, due_date, status in generate_loans(count):
+            yield (loan_id, date, users.setdefault(email, len(users) + 1), types.setdefault(equipment, len(types) + 1),
+                   due_date, status)
+
+    conn.executemany("INSERT INTO loans (ID, Date, UserID, EquipmentTypeID, DueDate, Status) VALUES (?, ?, ?, ?, ?, ?)",
+                     rows())
+    conn.executemany("INSERT INTO users (ID, Email) VALUES (?, ?)", ((user_id, email) for email, user_id in users.items()))
+    conn.executemany("INSERT INTO equipment_types (ID, Name) VALUES (?, ?)",
+                     ((type_id, name) for name, type_id in types.items()))
+    conn.commit()
+
+
+def synthetic_loans(count):
+    # Benchmark loans read back through sqlite3 like the grid's rows, so every text value is its own string object
+    conn = sqlite3.connect(':memory:')
+    try:
+        create_bench_table(conn, count)
+        return conn.execute("SELECT ID, Date, Email, Equipment, DueDate, Status, RowVersion FROM equipment "
+                            "ORDER BY ID").fetchall()
+    finally:
+        conn.close()
+
+
+def process_rss():
+    # Resident memory of this process in bytes, or None when it can't be read on this platform
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+def traced_bytes(build):
+    # Python heap growth while building (and keeping) a structure
+    import tracemalloc
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    used = tracemalloc.get_traced_memory()[0] - before
+    if started:
+        tracemalloc.stop()
+    return used, result
+
+
+def cmd_serve(args):
+    import asyncio
+    if not os.path.exists(args.db):
+        print(f"Database {args.db} not found.")
+        return 1
+    prepare_database(args.db)
+    server = LoanApiServer(args.db, pool_size=args.pool)
+
+    def ready(address):
+        print(f"Serving {args.db} on http://{address[0]}:{address[1]} (Ctrl+C to stop)", flush=True)
+
+    try:
+        asyncio.run(server.serve(args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+async def http_get(reader, writer, target, headers=()):
+    # One GET over an open keep-alive connection; returns (status, body bytes)
+    request = [f"GET {target} HTTP/1.1", "Host: localhost"] + list(headers)
+    writer.write(('\r\n'.join(request) + '\r\n\r\n').encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def api_load_test(host, port, targets, clients, seconds):
+    # `clients` keep-alive connections sending random requests from targets for `seconds`
+    import asyncio
+    import random
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                status, _ = await http_get(reader, writer, random.choice(targets))
+                latencies.append(time.perf_counter() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def cmd_bench_serve(args):
+    import asyncio
+    import socket
+    import subprocess
+    db_file = args.db or os.path.join(tempfile.gettempdir(), f"techtacho_bench_{args.rows}.db")
+    if not os.path.exists(db_file):
+        print(f"Creating {db_file} with {args.rows} loans...")
+        conn = sqlite3.connect(db_file)
+        try:
+            create_bench_table(conn, args.rows)
+        finally:
+            conn.close()
+    print("Preparing the database (indexes, change tracking)...")
+    prepare_database(db_file)
+
+    conn = open_db(db_file)
+    try:
+        emails = borrower_emails(conn)[:2000]
+        equipment = equipment_names(conn)
+    finally:
+        conn.close()
+
+    # A mix of the dashboard's requests: user pages, equipment/status filters, summary pages and the status chart
+    quote = urllib.parse.quote
+    targets = ([f"/loans?email={quote(email)}" for email in emails] + [f"/users/{quote(email)}" for email in emails]
+               + [f"/loans?equipment={quote(name)}&status={quote(status)}&limit=100"
+                  for name in equipment for status in STATUS_FILTERS]
+               + [f"/summary?after={quote(email)}&limit=50" for email in emails[::20]]
+               + ["/status", "/equipment", "/loans?limit=100"])
+
+    # The server runs in its own process, like in production, so the load generator doesn't share its GIL
+    with socket.socket() as probe:
+        probe.bind((args.host, 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', db_file, '--host', args.host,
+                               '--port', str(port), '--pool', str(args.pool)], stdout=subprocess.PIPE, text=True)
+    try:
+        if not server.stdout.readline().startswith('Serving'):
+            print("The server did not start.")
+            return 1
+        print(f"{args.clients} clients for {args.seconds} s against {len(targets)} distinct requests...")
+        latencies, statuses, elapsed = asyncio.run(
+            api_load_test(args.host, port, targets, args.clients, args.seconds))
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"{len(latencies)} requests in {elapsed:.1f} s: {len(latencies) / elapsed:.0f} requests/s")
+    print(f"latency p50 {percentile(0.5):.1f} ms, p95 {percentile(0.95):.1f} ms, p99 {percentile(0.99):.1f} ms")
+    print("statuses: " + ', '.join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+    return 0
+
+
+def cmd_render_report(args):
+    if not os.path.exists(args.db):
+        print(f"Database {args.db} not found.")
+        return 1
+    started = time.perf_counter()
+    drawn, skipped = render_report(args.db, args.out, args.pdf, args.workers, args.force)
+    print(f"{drawn} charts drawn, {skipped} unchanged charts skipped in {time.perf_counter() - started:.1f} s "
+          f"({args.out})")
+    if args.pdf:
+        print(f"Report written to {args.pdf}")
+    return 0
+
+
+def cmd_bench_memory(args):
+    results = {}
+
+    used, rows = traced_bytes(lambda: synthetic_loans(args.rows))
+    results['list of row tuples'] = used
+
+    store = LoanStore()
+    used, _ = traced_bytes(lambda: store.load(rows))
+    results['LoanStore'] = used
+
+    # The Treeview keeps its values in Tcl objects that tracemalloc can't see, so it is measured by the
+    # growth of the process' resident memory instead
+    if args.skip_treeview:
+        print("Treeview measurement skipped.")
+    else:
+        try:
+            root = tk.Tk()
+        except tk.TclError as e:
+            root = None
+            print(f"Treeview measurement skipped, no display available ({e}).")
+        if root is not None:
+            root.withdraw()
+            tree = ttk.Treeview(root, columns=("ID", "Date", "Email", "Equipment", "Due Date", "Status"),
+                                show='headings')
+            before = process_rss()
+            for row in rows:
+                tree.insert("", "end", iid=str(row[0]), values=row[:6], tags=('default',))
+            after = process_rss()
+            if before is not None and after is not None:
+                results['Treeview items'] = after - before
+            root.destroy()
+
+    print(f"Memory per loan at {args.rows} rows")
+    for name, used in results.items():
+        print(f"  {name:<20}{used / args.rows:>10.1f} bytes  ({used / 1048576:.1f} MiB)")
+    return 0
+
+
+def cmd_bench_filter(args):
+    db_file = args.db or os.path.join(tempfile.gettempdir(), f"techtacho_bench_{args.rows}.db")
+    if not os.path.exists(db_file):
+        print(f"Creating {db_file} with {args.rows} loans...")
+        conn = sqlite3.connect(db_file)
+        try:
+            create_bench_table(conn, args.rows)
+        finally:
+            conn.close()
+
+    conn = open_db(db_file)
+    try:
+        started = time.perf_counter()
+        ensure_filter_indexes(conn)
+        print(f"Filter indexes ready ({time.perf_counter() - started:.1f} s)")
+
+        email, equipment, due_date = conn.execute(
+            "SELECT Email, Equipment, DueDate FROM equipment ORDER BY ID LIMIT 1").fetchone()
+        window_end = (datetime.strptime(due_date, "%Y-%m-%d") + timedelta(days=7)).strftime("%Y-%m-%d")
+        filters = [
+            ("user", LoanFilter(email=email)),
+            ("user + equipment", LoanFilter(email=email, equipment=equipment)),
+            ("overdue " + equipment, LoanFilter(equipment=equipment, status='Overdue')),
+            (equipment + " due in a week", LoanFilter(equipment=equipment, due_from=due_date, due_to=window_end)),
+            ("late returns in a week", LoanFilter(status='Returned Late', due_from=due_date, due_to=window_end)),
+            ("all due in a week", LoanFilter(due_from=due_date, due_to=window_end)),
+        ]
+
+        print(f"{'Filter':<28}{'Rows':>9}{'Median ms':>12}{'p95 ms':>10}  Plan")
+        for name, loan_filter in filters:
+            where, params = loan_filter.where()
+            plan = '; '.join(row[3] for row in conn.execute(
+                f"EXPLAIN QUERY PLAN SELECT ID, Date, Email, Equipment, DueDate, Status, RowVersion FROM equipment {where}",
+                params))
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                rows = loan_filter.fetch(conn)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(f"{name:<28}{len(rows):>9}{timings[len(timings) // 2]:>12.2f}{p95:>10.2f}  {plan}")
+    finally:
+        conn.close()
+    return 0
+
+
+def cmd_maintain(args):
+    if not os.path.exists(args.db):
+        print(f"Database {args.db} not found.")
+        return 1
+    prepare_database(args.db)
+    if args.if_due and not maintenance_due(args.db):
+        print("Maintenance is not due yet.")
+        return 0
+    report = run_maintenance(args.db, args.full_vacuum, args.max_seconds, timings=not args.skip_timings)
+    print(format_maintenance_report(report))
+    return 0 if report['integrity'] == 'ok' else 2
+
+
+def cmd_calibrate(args):
+    if not os.path.exists(args.db):
+        print(f"Database {args.db} not found.")
+        return 1
+    prepare_database(args.db)
+    print(f"Running the standard workload with {len(STORAGE_PROFILES)} storage profiles on copies of {args.db}...")
+    report = calibrate_storage(args.db, args.repeat, args.writes)
+    results = report['results']
+    names = list(results)
+    print(f"{'Workload ms':<20}" + ''.join(f"{name:>17}" for name in names))
+    for workload in results[names[0]]:
+        print(f"{workload:<20}" + ''.join(f"{results[name][workload]:>17.1f}" for name in names))
+    unsafe = [name for name in names if not STORAGE_PROFILES[name]['safe']]
+    if unsafe:
+        print(f"Not recommended, can corrupt the database on a power cut: {', '.join(unsafe)}")
+    recommended = report['recommended']
+    print(f"Recommended profile: {recommended}")
+    if args.apply:
+        page_size = set_storage_profile(args.db, recommended)
+        print(f"{args.db} now opens with the '{recommended}' profile.")
+        if page_size != STORAGE_PROFILES[recommended]['page_size']:
+            print(f"Its page size of {STORAGE_PROFILES[recommended]['page_size']} bytes takes effect with "
+                  f"'maintain --full-vacuum' (currently {page_size}).")
+    return 0
+
+
+def cmd_backup(args):
+    if not os.path.exists(args.db):
+        print(f"Database {args.db} not found.")
+        return 1
+    result = backup_database(args.db, args.out, args.gzip, args.keep, args.pages)
+    print(f"Snapshot written to {result['path']}: {result['bytes'] / 1048576:.1f} MB in {result['steps']} steps, "
+          f"{result['restarts']} restarts, {result['seconds']} s ({result['mb_per_s']} MB/s)")
+    return 0
+
+
+def cmd_sync(args):
+    for path in (args.db, args.peer):
+        if not os.path.exists(path):
+            print(f"Database {path} not found.")
+            return 1
+    if os.path.abspath(args.db) == os.path.abspath(args.peer):
+        print("Both arguments are the same database.")
+        return 1
+    print(format_sync_report(sync_databases(args.db, args.peer)))
+    return 0
+
+
+def cmd_checkout_kit(args):
+    if not os.path.exists(args.db):
+        print(f"Database {args.db} not found.")
+        return 1
+    text = []
+    for entry in args.users:
+        # Files with one email per line (or a users CSV) and single emails can be mixed
+        if os.path.isfile(entry):
+            with open(entry) as f:
+                text.append(f.read())
+        else:
+            text.append(entry)
+    emails, invalid = parse_emails('\n'.join(text))
+    kit = parse_kit(args.kit)
+    if invalid:
+        print("These entries are not emails: " + ', '.join(invalid))
+        return 1
+    if not emails or not kit:
+        print("No users or no kit given.")
+        return 1
+    due_date = args.due or (datetime.now() + timedelta(days=KIT_LOAN_DAYS)).strftime('%Y-%m-%d')
+    try:
+        datetime.strptime(due_date, "%Y-%m-%d")
+    except ValueError:
+        print("The due date has to be YYYY-MM-DD.")
+        return 1
+
+    prepare_database(args.db)
+    started = time.perf_counter()
+    loan_ids = checkout_kit(args.db, emails, kit, due_date)
+    seconds = time.perf_counter() - started
+    added = DatabaseSession(args.db).add_users(emails)
+    print(f"Lent {len(loan_ids)} items ({', '.join(kit)}) to {len(emails)} users, due {due_date}: loans "
+          f"{loan_ids[0]}-{loan_ids[-1]} in {seconds:.2f} s; {len(added)} new users added to the users CSV")
+    return 0
+
+
+def sync_contents(db_file):
+    # Every loan of a database by sync key, for comparing copies
+    conn = open_db(db_file)
+    try:
+        return sorted(conn.execute("SELECT COALESCE(l.Uid, 'L' || l.ID), l.Date, u.Email, t.Name, l.DueDate, l.Status, "
+                                   "l.ReturnDate FROM loans l LEFT JOIN users u ON u.ID = l.UserID "
+                                   "LEFT JOIN equipment_types t ON t.ID = l.EquipmentTypeID"))
+    finally:
+        conn.close()
+
+
+def cmd_bench_sync(args):
+    # A site database and a laptop copy drift apart (returns, new due dates, new loans and deletions, some of them
+    # to the same loans on both sides) and are synced twice; the copies have to end up identical
+    import random
+    template = args.db or os.path.join(tempfile.gettempdir(), f"techtacho_bench_{args.rows}.db")
+    if not os.path.exists(template):
+        print(f"Creating {template} with {args.rows} loans...")
+        conn = sqlite3.connect(template)
+        try:
+            create_bench_table(conn, args.rows)
+        finally:
+            conn.close()
+    print("Preparing the database (indexes, change tracking)...")
+    prepare_database(template)
+    conn = open_db(template)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        max_id = conn.execute("SELECT MAX(ID) FROM loans").fetchone()[0] or 1
+        emails = borrower_emails(conn)[:2000]
+    finally:
+        conn.close()
+
+    work_dir = tempfile.mkdtemp(prefix='techtacho_sync_')
+    site = os.path.join(work_dir, 'site.db')
+    laptop = os.path.join(work_dir, 'laptop.db')
+    try:
+        for path in (site, laptop):
+            shutil.copyfile(template, path)
+        rng = random.Random(1)
+        both = rng.sample(range(1, max_id + 1), min(max_id, args.changes // 10))
+        today = datetime.now().date()
+        for path in (site, laptop):
+            conn = open_db(path)
+            try:
+                for i, loan_id in enumerate(rng.sample(range(1, max_id + 1), min(max_id, args.changes)) + both):
+                    due_date = (today + timedelta(days=rng.randint(-20, 20))).strftime("%Y-%m-%d")
+                    if i % 10 == 0:
+                        conn.execute("DELETE FROM loans WHERE ID = ?", (loan_id,))
+                    elif i % 10 < 3:
+                        insert_loans(conn, [(today.strftime("%Y-%m-%d"), rng.choice(emails),
+                                             rng.choice(BENCH_EQUIPMENT_TYPES), due_date, 'Not Returned', None)])
+                    elif i % 10 < 6:
+                        conn.execute("UPDATE loans SET Status = 'Returned', ReturnDate = ?, "
+                                     "RowVersion = RowVersion + 1 WHERE ID = ?", (due_date, loan_id))
+                    else:
+                        conn.execute("UPDATE loans SET DueDate = ?, RowVersion = RowVersion + 1 WHERE ID = ?",
+                                     (due_date, loan_id))
+                conn.commit()
+            finally:
+                conn.close()
+
+        print(f"Two copies of {max_id} loans ({os.path.getsize(site) / 1048576:.0f} MB), "
+              f"{args.changes} changes on each side, {len(both)} loans changed on both")
+        print("First sync:  " + format_sync_report(sync_databases(laptop, site)))
+        print("Second sync: " + format_sync_report(sync_databases(laptop, site)))
+        differences = len(set(sync_contents(site)) ^ set(sync_contents(laptop)))
+        print("The copies are identical." if not differences else f"The copies differ in {differences} rows.")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0 if not differences else 1
+
+
+def cmd_bench_scan(args):
+    # A term-end return rush through scan mode without the window: the codes are resolved on this thread (the Tk
+    # thread in the app) and the batches committed by one worker thread, as fast as the scanner sends them.
+    # For comparison, some returns are also written one commit per loan like the grid's Returned command.
+    import concurrent.futures
+    import random
+    template = args.db or os.path.join(tempfile.gettempdir(), f"techtacho_bench_{args.rows}.db")
+    if not os.path.exists(template):
+        print(f"Creating {template} with {args.rows} loans...")
+        conn = sqlite3.connect(template)
+        try:
+            create_bench_table(conn, args.rows)
+        finally:
+            conn.close()
+    print("Preparing the database (indexes, change tracking)...")
+    prepare_database(template)
+    conn = open_db(template)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    work_dir = tempfile.mkdtemp(prefix='techtacho_scan_')
+    db_file = os.path.join(work_dir, 'scan.db')
+    shutil.copyfile(template, db_file)
+    prepare_database(db_file)
+
+    def percentile(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+    try:
+        session = ScanSession(db_file)
+        started = time.perf_counter()
+        open_count = session.load()
+        print(f"{open_count} open loans indexed in {time.perf_counter() - started:.2f} s")
+
+        # Half of the returns scan the loan slip, the other half the user's badge and then the equipment, which
+        # returns the user's open loan of it that is due first
+        rng = random.Random(1)
+        returns = []
+        returned = set()
+        for i, loan_id in enumerate(rng.sample(sorted(session.loans), min(args.scans, len(session.loans)))):
+            if loan_id in returned:
+                continue
+            email, equipment = session.loans[loan_id][:2]
+            if i % 2:
+                returns.append([f"L{loan_id}"])
+                returned.add(loan_id)
+            else:
+                returns.append([email, equipment])
+                returned.add(next(first for first in session.by_user[(email.lower(), equipment.lower())]
+                                  if first not in returned))
+        single = returns[len(returns) - args.single:] if args.single else []
+        codes = [code for scans in returns[:len(returns) - len(single)] for code in scans]
+
+        resolve_ms = []
+        commit_ms = []
+        backlog = 0
+        writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        running = None
+        last_flush = time.perf_counter()
+
+        def commit(batch):
+            batch_started = time.perf_counter()
+            commit_scans(db_file, batch)
+            commit_ms.append((time.perf_counter() - batch_started) * 1000)
+
+        started = time.perf_counter()
+        for code in codes:
+            scan_started = time.perf_counter()
+            ok, message = session.scan(code)
+            resolve_ms.append((time.perf_counter() - scan_started) * 1000)
+            if not ok:
+                print(f"Unexpected: {message}")
+            backlog = max(backlog, len(session.pending))
+            due = (len(session.pending) >= SCAN_BATCH_SIZE
+                   or time.perf_counter() - last_flush >= SCAN_FLUSH_MS / 1000)
+            if session.pending and due and (running is None or running.done()):
+                running = writer.submit(commit, session.take_batch())
+                last_flush = time.perf_counter()
+            if args.interval_ms:
+                time.sleep(args.interval_ms / 1000)
+        while session.pending:
+            if running is not None:
+                running.result()
+            running = writer.submit(commit, session.take_batch())
+        if running is not None:
+            running.result()
+        writer.shutdown()
+        seconds = time.perf_counter() - started
+
+        print(f"{len(codes)} scans in {seconds:.2f} s: {len(codes) / seconds:.0f} scans/s, "
+              f"{len(commit_ms)} batches, at most {backlog} scans waiting")
+        print(f"Resolving a scan (on the UI thread): p50 {percentile(resolve_ms, 0.5):.3f} ms, "
+              f"p99 {percentile(resolve_ms, 0.99):.3f} ms")
+        print(f"Committing a batch (worker thread): p50 {percentile(commit_ms, 0.5):.1f} ms, "
+              f"p99 {percentile(commit_ms, 0.99):.1f} ms")
+
+        if single:
+            # One connection and one commit per return, like update_loan
+            batches = []
+            for scans in single:
+                for code in scans:
+                    session.scan(code)
+                batches.append(session.take_batch())
+            started = time.perf_counter()
+            for batch in batches:
+                commit_scans(db_file, batch)
+            per_return = (time.perf_counter() - started) * 1000 / max(len(batches), 1)
+            print(f"One commit per return instead: {per_return:.1f} ms per return "
+                  f"({1000 / max(per_return, 1e-9):.0f} returns/s)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+def cmd_bench_backup(args):
+    # Back up a database of the given size while a writer keeps changing loans (like a clerk) and the main thread
+    # plays the Tk event loop: it wakes every 10 ms and records how late it was
+    import random
+    db_file = args.db or os.path.join(tempfile.gettempdir(), f"techtacho_bench_backup_{args.size_mb}.db")
+    if not os.path.exists(db_file):
+        print(f"Creating {db_file} ({args.size_mb} MB, {args.rows} loans plus filler pages)...")
+        conn = sqlite3.connect(db_file)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            create_bench_table(conn, args.rows)
+            # Filler with about half compressible content, so --gzip has something realistic to do
+            conn.execute("CREATE TABLE bench_filler (Data BLOB)")
+            while os.path.getsize(db_file) < args.size_mb * 1048576:
+                conn.executemany("INSERT INTO bench_filler VALUES (randomblob(2048) || zeroblob(2048))",
+                                 [()] * 16384)
+                conn.commit()
+        finally:
+            conn.close()
+
+    out_dir = tempfile.mkdtemp(prefix='techtacho_backup_')
+    stop = threading.Event()
+    writes = [0]
+
+    def writer():
+        conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_SECONDS)
+        try:
+            while not stop.is_set():
+                conn.execute("UPDATE loans SET RowVersion = RowVersion + 1 WHERE ID = ?",
+                             (random.randint(1, args.rows),))
+                conn.commit()
+                writes[0] += 1
+                stop.wait(args.write_interval)
+        finally:
+            conn.close()
+
+    result = {}
+
+    def run_backup():
+        try:
+            result.update(backup_database(db_file, out_dir, args.gzip, 1, args.pages))
+        except Exception as e:
+            result['error'] = e
+
+    threads = [threading.Thread(target=run_backup)]
+    if args.write_interval > 0:
+        threads.append(threading.Thread(target=writer, daemon=True))
+    for thread in threads:
+        thread.start()
+    lags = []
+    while threads[0].is_alive():
+        expected = time.perf_counter() + 0.01
+        time.sleep(0.01)
+        lags.append((time.perf_counter() - expected) * 1000)
+    stop.set()
+    shutil.rmtree(out_dir, ignore_errors=True)
+    if 'error' in result:
+        print(f"Backup failed: {result['error']}")
+        return 1
+
+    lags.sort()
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0
+    print(f"Database: {result['bytes'] / 1048576:.0f} MB, snapshot file {result['file_bytes'] / 1048576:.0f} MB"
+          f"{' (gzip)' if args.gzip else ''}")
+    print(f"Backup: {result['seconds']} s ({result['copy_seconds']} s copying), {result['mb_per_s']} MB/s, "
+          f"{result['steps']} steps of {args.pages} pages, {result['restarts']} restarts, {writes[0]} concurrent writes")
+    print(f"Event loop lag while backing up: p99 {p99:.1f} ms, max {lags[-1] if lags else 0:.1f} ms")
+    return 0
+
+
+# What one helpdesk station does in bench-contention, with relative weights
+CONTENTION_MIX = [('add_entry', 20), ('mark_as_returned', 25), ('update_due_date', 15), ('delete_record', 5),
+                  ('user_filter', 25), ('status_counts', 7), ('user_metrics', 3)]
+CONTENTION_WRITES = ('add_entry', 'mark_as_returned', 'update_due_date', 'delete_record')
+
+
+def contention_action(db_file, action, rng, max_id, emails):
+    # One action of a station with the SQL the app runs for it: a connection per operation, writes retried on
+    # locks like the app does, updates guarded by the row version the station has loaded
+    loan_id = rng.randint(1, max_id)
+    today = datetime.now().date()
+    conn = open_db(db_file)
+    try:
+        if action in ('mark_as_returned', 'update_due_date'):
+            row = run_with_retry(lambda: conn.execute("SELECT RowVersion FROM loans WHERE ID = ?",
+                                                      (loan_id,)).fetchone())
+            if row is None:
+                return
+            if action == 'mark_as_returned':
+                fields = {'Status': 'Returned', 'ReturnDate': today.strftime("%Y-%m-%d")}
+            else:
+                fields = {'DueDate': (today + timedelta(days=rng.randint(-5, 30))).strftime("%Y-%m-%d"),
+                          'Status': 'Not Returned'}
+
+            def write():
+                assignments, params = loan_assignments(conn, fields)
+                updated = conn.execute(f"UPDATE loans SET {assignments}, RowVersion = RowVersion + 1 "
+                                       "WHERE ID = ? AND RowVersion = ?", params + [loan_id, row[0]]).rowcount
+                conn.commit()
+                return updated
+        elif action == 'add_entry':
+            def write():
+                loan = (today.strftime("%Y-%m-%d"), rng.choice(emails), rng.choice(BENCH_EQUIPMENT_TYPES),
+                        (today + timedelta(days=14)).strftime("%Y-%m-%d"), 'Not Returned', None)
+                insert_loans(conn, [loan])
+                conn.commit()
+        elif action == 'delete_record':
+            def write():
+                conn.execute("DELETE FROM loans WHERE ID = ?", (loan_id,))
+                conn.commit()
+        elif action == 'user_filter':
+            def write():
+                return LoanFilter(email=rng.choice(emails)).fetch(conn)
+        elif action == 'status_counts':
+            def write():
+                return overall_status_counts(conn)
+        else:
+            def write():
+                return user_metrics(conn)
+        try:
+            run_with_retry(write)
+        except sqlite3.OperationalError:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+
+
+def contention_worker(task):
+    # Runs in its own process: replays the action mix until end_at and returns (action, seconds, lock retries,
+    # failed) per action
+    import random
+    db_file, start_at, end_at, think, seed, max_id, emails = task
+    rng = random.Random(seed)
+    actions = [name for name, _ in CONTENTION_MIX]
+    weights = [weight for _, weight in CONTENTION_MIX]
+    results = []
+    time.sleep(max(0.0, start_at - time.time()))
+    while time.time() < end_at:
+        action = rng.choices(actions, weights)[0]
+        failed = False
+        started = time.perf_counter()
+        with perf.action(action) as record:
+            try:
+                contention_action(db_file, action, rng, max_id, emails)
+            except sqlite3.OperationalError as e:
+                if not is_lock_error(e):
+                    raise
+                failed = True
+        results.append((action, time.perf_counter() - started, record['lock_retries'], failed))
+        if think:
+            time.sleep(rng.uniform(0, 2 * think))
+    return results
+
+
+def cmd_bench_contention(args):
+    # N processes share one database file like N helpdesk stations on a shared drive, once per journal mode
+    import concurrent.futures
+    template = args.db or os.path.join(tempfile.gettempdir(), f"techtacho_bench_{args.rows}.db")
+    if not os.path.exists(template):
+        print(f"Creating {template} with {args.rows} loans...")
+        conn = sqlite3.connect(template)
+        try:
+            create_bench_table(conn, args.rows)
+        finally:
+            conn.close()
+    print("Preparing the database (indexes, change tracking)...")
+    prepare_database(template)
+    conn = open_db(template)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        emails = borrower_emails(conn)[:2000]
+        max_id = conn.execute("SELECT MAX(ID) FROM loans").fetchone()[0] or 1
+    finally:
+        conn.close()
+
+    modes = [mode.strip().upper() for mode in args.journal_modes.split(',')]
+    station_counts = [int(count) for count in args.workers.split(',')]
+    work_dir = tempfile.mkdtemp(prefix='techtacho_contention_')
+    print(f"{args.seconds:g} s per run, think time {args.think_ms:g} ms, p95 budget {args.budget_ms:g} ms")
+    print(f"{'Journal':<9}{'Stations':>9}{'Actions/s':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'Write p95':>11}{'Retries':>9}{'Failed':>8}")
+    supported = {}
+    try:
+        for mode in modes:
+            for stations in station_counts:
+                # Every run starts from a fresh copy, so earlier runs' inserts and deletes don't pile up
+                db_file = os.path.join(work_dir, f"{mode.lower()}_{stations}.db")
+                shutil.copyfile(template, db_file)
+                conn = sqlite3.connect(db_file)
+                try:
+                    conn.execute(f"PRAGMA journal_mode={mode}")
+                finally:
+                    conn.close()
+
+                start_at = time.time() + 1.0 + 0.05 * stations
+                tasks = [(db_file, start_at, start_at + args.seconds, args.think_ms / 1000, stations * 1000 + i,
+                          max_id, emails) for i in range(stations)]
+                with concurrent.futures.ProcessPoolExecutor(max_workers=stations) as pool:
+                    results = [result for worker in pool.map(contention_worker, tasks) for result in worker]
+
+                latencies = sorted(seconds for _, seconds, _, _ in results)
+                writes = sorted(seconds for action, seconds, _, _ in results if action in CONTENTION_WRITES)
+
+                def percentile(values, p):
+                    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+                retries = sum(result[2] for result in results)
+                failed = sum(1 for result in results if result[3])
+                p95 = percentile(latencies, 0.95)
+                print(f"{mode:<9}{stations:>9}{len(results) / args.seconds:>11.0f}{percentile(latencies, 0.5):>9.1f}"
+                      f"{p95:>9.1f}{percentile(latencies, 0.99):>9.1f}{percentile(writes, 0.95):>11.1f}"
+                      f"{retries:>9}{failed:>8}")
+                if p95 <= args.budget_ms and not failed:
+                    supported[mode] = max(supported.get(mode, 0), stations)
+                for suffix in ('', '-wal', '-shm', '-journal'):
+                    if os.path.exists(db_file + suffix):
+                        os.remove(db_file + suffix)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for mode in modes:
+        if mode in supported:
+            print(f"{mode}: up to {supported[mode]} stations stay within the p95 budget without failed actions")
+        else:
+            print(f"{mode}: no tested station count stays within the p95 budget")
+    return 0
+
+
+def cmd_startup_probe(args):
+    # Started by bench-startup: open the window, report once it has been drawn and quit
+    set_dpi_awareness()
+    try:
+        app = TechTachoApp()
+    except tk.TclError as e:
+        print(f"no window: {e}", flush=True)
+        return 2
+    app.wait_visibility()
+    app.update_idletasks()
+    print("ready", flush=True)
+    app.destroy()
+    return 0
+
+
+def parse_importtime(output):
+    # {top-level module: cumulative import seconds} from the stderr of `python -X importtime`
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # Nested imports are indented below their importer
+            modules[name.strip()] = int(cumulative) / 1e6
+    return modules
+
+
+def cmd_bench_startup(args):
+    # Cold start, measured from outside: every run is a fresh interpreter started with -X importtime until
+    # the probe reports the window on screen
+    import subprocess
+    timings = []
+    imports = {}
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        probe = subprocess.Popen([sys.executable, '-X', 'importtime', os.path.abspath(__file__), 'startup-probe'],
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        line = probe.stdout.readline().strip()
+        elapsed = time.perf_counter() - started
+        _, errors = probe.communicate()
+        imports = parse_importtime(errors)
+        if line != 'ready':
+            print(f"The window could not be opened ({line or 'probe failed'}), only import times are reported.")
+            break
+        timings.append(elapsed)
+
+    print("Slowest imports at startup")
+    for name, seconds in sorted(imports.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<40}{seconds * 1000:>9.1f} ms")
+    print(f"  {'all imports':<40}{sum(imports.values()) * 1000:>9.1f} ms")
+
+    if not timings:
+        return 0
+    timings.sort()
+    median = timings[len(timings) // 2]
+    print(f"\nTime to window over {len(timings)} runs: median {median:.2f} s, best {timings[0]:.2f} s, "
+          f"worst {timings[-1]:.2f} s (budget {args.budget:.2f} s)")
+    if median > args.budget:
+        print("Startup is over budget.")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='TechTacho', description="TechTacho - IT Equipment Tracker. "
+                                     "Without a command the desktop application is started.")
+    commands = parser.add_subparsers(dest='command')
+
+    remind = commands.add_parser('remind', help="send one overdue reminder digest per user over SMTP")
+    remind.add_argument('db', help="equipment database file")
+    remind.add_argument('--host', help=f"SMTP host (default from {SMTP_SETTINGS_FILE})")
+    remind.add_argument('--port', type=int)
+    remind.add_argument('--sender')
+    remind.add_argument('--cooldown-days', type=int, help="don't remind a loan again within this many days")
+    remind.add_argument('--concurrency', type=int, default=4, help="parallel SMTP deliveries")
+    remind.add_argument('--rate', type=float, default=5.0, help="maximum messages per second")
+    remind.add_argument('--dry-run', action='store_true', help="only count the digests that would be sent")
+    remind.set_defaults(func=cmd_remind)
+
+    overdue = commands.add_parser('mark-overdue', help="store the overdue status of loans that became overdue")
+    overdue.add_argument('db', help="equipment database file")
+    overdue.add_argument('--force', action='store_true', help="run even if it already ran today")
+    overdue.set_defaults(func=cmd_mark_overdue)
+
+    report = commands.add_parser('report', help="print the status counts and the peak concurrent use per equipment")
+    report.add_argument('db', help="equipment database file")
+    report.add_argument('--curve', help="also write the loans-out-over-time curve to this CSV file")
+    report.set_defaults(func=cmd_report)
+
+    serve = commands.add_parser('serve', help="serve the loan data as a local JSON HTTP API")
+    serve.add_argument('db', help="equipment database file")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--pool', type=int, default=4, help="pooled read connections")
+    serve.set_defaults(func=cmd_serve)
+
+    render = commands.add_parser('render-report', help="render every user's Trust Index chart and the overall "
+                                                       "status chart to PNG (and PDF) without a display")
+    render.add_argument('db', help="equipment database file")
+    render.add_argument('--out', default='report', help="directory for the PNG charts (default: report)")
+    render.add_argument('--pdf', help="also collect the charts into this PDF file")
+    render.add_argument('--workers', type=int, help="rendering processes (default: one per CPU)")
+    render.add_argument('--force', action='store_true', help="redraw charts even if their numbers didn't change")
+    render.set_defaults(func=cmd_render_report)
+
+    maintain = commands.add_parser('maintain', help="ANALYZE, incremental vacuum and a quick integrity check")
+    maintain.add_argument('db', help="equipment database file")
+    maintain.add_argument('--full-vacuum', action='store_true',
+                          help="switch to incremental vacuum with one full VACUUM (blocks writers while it runs)")
+    maintain.add_argument('--max-seconds', type=float, help="stop the incremental vacuum after this long")
+    maintain.add_argument('--if-due', action='store_true',
+                          help=f"only run if the last run is over {MAINTENANCE_INTERVAL_DAYS} days ago (for cron)")
+    maintain.add_argument('--skip-timings', action='store_true', help="don't time the standard views")
+    maintain.set_defaults(func=cmd_maintain)
+
+    calibrate = commands.add_parser('calibrate', help="time the standard workload with each storage profile and "
+                                                      "recommend the fastest safe one")
+    calibrate.add_argument('db', help="equipment database file")
+    calibrate.add_argument('--repeat', type=int, default=3, help="runs of the standard views per profile")
+    calibrate.add_argument('--writes', type=int, default=200, help="single loan updates per profile")
+    calibrate.add_argument('--apply', action='store_true', help="open the database with the recommended profile")
+    calibrate.set_defaults(func=cmd_calibrate)
+
+    backup = commands.add_parser('backup', help="write a rotated, timestamped snapshot of a live database")
+    backup.add_argument('db', help="equipment database file")
+    backup.add_argument('--out', default=BACKUP_DIR, help=f"snapshot directory (default: {BACKUP_DIR})")
+    backup.add_argument('--gzip', action='store_true', help="compress the snapshot")
+    backup.add_argument('--keep', type=int, default=BACKUP_KEEP, help="number of snapshots kept")
+    backup.add_argument('--pages', type=int, default=BACKUP_PAGES_PER_STEP, help="pages copied per step")
+    backup.set_defaults(func=cmd_backup)
+
+    sync = commands.add_parser('sync', help="exchange the loans changed since the last sync between two copies of "
+                                            "a database")
+    sync.add_argument('db', help="equipment database file")
+    sync.add_argument('peer', help="another copy of it, e.g. a laptop's")
+    sync.set_defaults(func=cmd_sync)
+
+    checkout = commands.add_parser('checkout-kit', help="lend a kit of equipment to a list of users in one "
+                                                        "transaction")
+    checkout.add_argument('db', help="equipment database file")
+    checkout.add_argument('users', nargs='+', help="emails, or files with one email per line (a users CSV works too)")
+    checkout.add_argument('--kit', default=DEFAULT_KIT, help=f"comma-separated equipment names (default: {DEFAULT_KIT})")
+    checkout.add_argument('--due', help=f"due date as YYYY-MM-DD (default: in {KIT_LOAN_DAYS} days)")
+    checkout.set_defaults(func=cmd_checkout_kit)
+
+    bench_serve = commands.add_parser('bench-serve', help="load test the JSON API on localhost")
+    bench_serve.add_argument('--rows', type=int, default=1000000, help="size of the generated benchmark database")
+    bench_serve.add_argument('--db', help="load test this database instead of a generated one")
+    bench_serve.add_argument('--host', default='127.0.0.1')
+    bench_serve.add_argument('--pool', type=int, default=4)
+    bench_serve.add_argument('--clients', type=int, default=32)
+    bench_serve.add_argument('--seconds', type=float, default=10)
+    bench_serve.set_defaults(func=cmd_bench_serve)
+
+    bench_memory = commands.add_parser('bench-memory', help="compare the memory used per loan by the loan store, "
+                                                            "plain row tuples and Treeview items")
+    bench_memory.add_argument('--rows', type=int, default=1000000)
+    bench_memory.add_argument('--skip-treeview', action='store_true', help="don't measure the Treeview")
+    bench_memory.set_defaults(func=cmd_bench_memory)
+
+    bench_filter = commands.add_parser('bench-filter', help="time selective grid filters on a large database")
+    bench_filter.add_argument('--rows', type=int, default=5000000, help="size of the generated benchmark database")
+    bench_filter.add_argument('--db', help="benchmark this database instead of a generated one")
+    bench_filter.add_argument('--repeat', type=int, default=20)
+    bench_filter.set_defaults(func=cmd_bench_filter)
+
+    bench_backup = commands.add_parser('bench-backup', help="time an online backup of a large database while "
+                                                            "it is being written to")
+    bench_backup.add_argument('--size-mb', type=int, default=2048, help="size of the generated benchmark database")
+    bench_backup.add_argument('--rows', type=int, default=1000000, help="loans in the generated database")
+    bench_backup.add_argument('--db', help="back up this database instead of a generated one")
+    bench_backup.add_argument('--gzip', action='store_true')
+    bench_backup.add_argument('--pages', type=int, default=BACKUP_PAGES_PER_STEP)
+    bench_backup.add_argument('--write-interval', type=float, default=0.05,
+                              help="seconds between concurrent writes (0: no writer)")
+    bench_backup.set_defaults(func=cmd_bench_backup)
+
+    bench_contention = commands.add_parser('bench-contention', help="replay the clerks' actions from several "
+                                                                    "processes against one database file")
+    bench_contention.add_argument('--rows', type=int, default=100000, help="size of the generated benchmark database")
+    bench_contention.add_argument('--db', help="copy this database instead of a generated one")
+    bench_contention.add_argument('--workers', default='1,2,4,8,16', help="comma-separated station counts")
+    bench_contention.add_argument('--journal-modes', default='wal,delete', help="comma-separated journal modes")
+    bench_contention.add_argument('--seconds', type=float, default=10, help="length of each run")
+    bench_contention.add_argument('--think-ms', type=float, default=50,
+                                  help="average pause between a station's actions (0: as fast as possible)")
+    bench_contention.add_argument('--budget-ms', type=float, default=250,
+                                  help="p95 latency a station count has to stay within")
+    bench_contention.set_defaults(func=cmd_bench_contention)
+
+    bench_sync = commands.add_parser('bench-sync', help="change two copies of a generated database, sync them and "
+                                                        "check that they end up identical")
+    bench_sync.add_argument('--rows', type=int, default=1000000, help="size of the generated benchmark database")
+    bench_sync.add_argument('--db', help="start from a copy of this database instead of a generated one")
+    bench_sync.add_argument('--changes', type=int, default=10000, help="changes made on each copy")
+    bench_sync.set_defaults(func=cmd_bench_sync)
+
+    bench_scan = commands.add_parser('bench-scan', help="replay a rush of barcode returns through scan mode")
+    bench_scan.add_argument('--rows', type=int, default=1000000, help="size of the generated benchmark database")
+    bench_scan.add_argument('--db', help="start from a copy of this database instead of a generated one")
+    bench_scan.add_argument('--scans', type=int, default=5000, help="loans returned")
+    bench_scan.add_argument('--interval-ms', type=float, default=0, help="pause between scans (0: as fast as possible)")
+    bench_scan.add_argument('--single', type=int, default=200, help="returns also timed with one commit each")
+    bench_scan.set_defaults(func=cmd_bench_scan)
+
+    bench_startup = commands.add_parser('bench-startup', help="measure the time until the window is on screen and "
+                                                              "the slowest imports; fails when over budget")
+    bench_startup.add_argument('--runs', type=int, default=5)
+    bench_startup.add_argument('--budget', type=float, default=1.0, help="allowed median seconds to window")
+    bench_startup.add_argument('--top', type=int, default=15, help="number of imports listed")
+    bench_startup.set_defaults(func=cmd_bench_startup)
+
+    probe = commands.add_parser('startup-probe', help="used by bench-startup")
+    probe.set_defaults(func=cmd_startup_probe)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        set_dpi_awareness()
+        app = TechTachoApp()
+        app.mainloop()
+        return 0
+    return args.func(args)
+
+
 if __name__ == "__main__":
-    app = TechTachoApp()
-    app.mainloop()
+    sys.exit(main())
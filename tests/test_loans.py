@@ -0,0 +1,139 @@
+import sqlite3
+
+import pytest
+
+import TechTacho
+
+
+class GridStub:
+    # The parts of EquipmentTrackingTab that update_loan uses, without a window
+    update_loan = TechTacho.EquipmentTrackingTab.update_loan
+
+    def __init__(self, db_file, rows):
+        self.db_combo = self
+        self.as_of_date = None
+        self.db_file = db_file
+        self.loans = TechTacho.LoanStore()
+        self.loans.load(rows)
+        self.refreshed = []
+
+    def get(self):
+        return self.db_file
+
+    def data_changed(self):
+        pass
+
+    def render_item(self, loan_id):
+        pass
+
+    def refresh_rows(self, loan_ids):
+        self.refreshed.extend(loan_ids)
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    db_file = str(tmp_path / 'loans.db')
+    conn = sqlite3.connect(db_file)
+    TechTacho.create_bench_table(conn, 20)
+    conn.commit()
+    conn.close()
+    TechTacho.prepare_database(db_file)
+    return db_file
+
+
+def test_edit_after_return_has_no_conflict(db_file, monkeypatch):
+    warnings = []
+    monkeypatch.setattr(TechTacho.messagebox, 'showwarning', lambda *args: warnings.append(args))
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute("SELECT ID, Date, Email, Equipment, DueDate, Status, RowVersion FROM equipment").fetchall()
+    conn.close()
+    grid = GridStub(db_file, rows)
+    loan_id = rows[0][0]
+
+    # Returning writes ReturnDate, which the store doesn't hold
+    assert grid.update_loan(loan_id, Status='Returned', ReturnDate='2026-10-19')
+    assert grid.loans.get(loan_id, 'Status') == 'Returned'
+    assert grid.loans.get(loan_id, 'RowVersion') == rows[0][6] + 1
+
+    assert grid.update_loan(loan_id, DueDate='2026-12-01')
+    assert not warnings and not grid.refreshed
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT Status, ReturnDate, DueDate FROM equipment WHERE ID = ?", (loan_id,)).fetchone() == \
+        ('Returned', '2026-10-19', '2026-12-01')
+    conn.close()
+
+
+def test_as_of_view_writes_nothing(db_file):
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute("SELECT ID, Date, Email, Equipment, DueDate, Status, RowVersion FROM equipment").fetchall()
+    conn.close()
+    grid = GridStub(db_file, rows)
+    grid.as_of_date = '2020-01-01'
+    loan_id = rows[0][0]
+
+    assert not grid.update_loan(loan_id, Status='Returned +5', ReturnDate='2026-10-19')
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT Status, RowVersion FROM equipment WHERE ID = ?", (loan_id,)).fetchone() == \
+        (rows[0][5], rows[0][6])
+    conn.close()
+
+
+def test_scan_batch_retry_after_busy_commit(db_file, monkeypatch):
+    conn = sqlite3.connect(db_file)
+    loan_id, version = conn.execute("SELECT ID, RowVersion FROM loans ORDER BY ID LIMIT 1").fetchone()
+    count = conn.execute("SELECT COUNT(*) FROM loans").fetchone()[0]
+    conn.close()
+
+    # The first commit fails as if the database were busy
+    commits = []
+    original_commit = TechTacho.InstrumentedConnection.commit
+
+    def busy_once(self):
+        commits.append(1)
+        if len(commits) == 1:
+            raise sqlite3.OperationalError('database is locked')
+        return original_commit(self)
+
+    monkeypatch.setattr(TechTacho.InstrumentedConnection, 'commit', busy_once)
+    batch = [('return', loan_id, 'Returned', '2026-10-19', version),
+             ('lend', '2026-10-19', 'new@example.com', 'Laptop', '2026-11-02')]
+    lent, conflicts = TechTacho.commit_scans(db_file, batch)
+
+    assert len(commits) == 2
+    assert conflicts == [] and len(lent) == 1
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT COUNT(*) FROM loans").fetchone()[0] == count + 1
+    conn.close()
+
+
+def test_store_removes_several_loans_at_once():
+    store = TechTacho.LoanStore()
+    store.load([(loan_id, f'2026-10-{loan_id:02}', f'u{loan_id}@example.com', 'Laptop', '2026-11-01',
+                 'Not Returned', 1) for loan_id in (5, 3, 9, 1, 7)])
+
+    store.remove('3', 9, 4)
+    store.remove(7)
+
+    assert list(store.ids) == [1, 5]
+    assert [row[0] for row in store.rows()] == [5, 1]
+    assert store.row(5)[2] == 'u5@example.com'
+    assert 9 not in store and store.get(1, 'RowVersion') == 1
+
+
+def test_kit_checkout_resolves_users_in_one_pass(db_file):
+    emails = [f'student{i}@example.com' for i in range(40)] + ['student0@example.com']
+    kit = ['Laptop', 'Charger', 'Mouse']
+
+    with TechTacho.perf.action('checkout_kit') as record:
+        loan_ids = TechTacho.checkout_kit(db_file, emails, kit, '2026-11-02', today='2026-10-19')
+
+    # Add and read back the users, the same for the equipment types, then the loans, the last ID and the kit,
+    # however many users there are
+    assert record['queries'] == 7
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute(f"SELECT Email, Equipment FROM equipment WHERE ID IN ({', '.join('?' * len(loan_ids))}) "
+                        "ORDER BY ID", loan_ids).fetchall()
+    users = conn.execute("SELECT COUNT(*) FROM users WHERE Email LIKE 'student%'").fetchone()[0]
+    conn.close()
+    assert rows == [(email, equipment) for email in emails for equipment in kit]
+    assert users == 40
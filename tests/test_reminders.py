@@ -0,0 +1,92 @@
+import smtplib
+import sqlite3
+from datetime import date
+
+import pytest
+
+import TechTacho
+
+TODAY = date(2026, 10, 19)
+
+
+class FakeSMTP:
+    # Local SMTP stand-in: records every delivered message; `fail_once` recipients get one transient error
+    delivered = []
+    fail_once = set()
+    connections = 0
+
+    def __init__(self, host, port, timeout=None):
+        FakeSMTP.connections += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def send_message(self, message):
+        if message['To'] in FakeSMTP.fail_once:
+            FakeSMTP.fail_once.discard(message['To'])
+            raise smtplib.SMTPServerDisconnected("connection dropped")
+        FakeSMTP.delivered.append(message)
+
+
+@pytest.fixture
+def smtp():
+    FakeSMTP.delivered = []
+    FakeSMTP.fail_once = set()
+    FakeSMTP.connections = 0
+    return FakeSMTP
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    db_file = str(tmp_path / 'loans.db')
+    conn = sqlite3.connect(db_file)
+    TechTacho.create_bench_table(conn, 0)
+    TechTacho.insert_loans(conn, [
+        ('2026-09-01', 'ann@example.com', 'Laptop', '2026-09-15', 'Not Returned', None),
+        ('2026-09-01', 'ann@example.com', 'Mouse', '2026-09-20', '+29', None),
+        ('2026-09-01', 'bob@example.com', 'Monitor', '2026-10-01', 'Not Returned', None),
+        ('2026-09-01', 'bob@example.com', 'Keyboard', '2099-12-01', 'Not Returned', None),  # not due yet
+        ('2026-09-01', 'cid@example.com', 'Headset', '2026-09-10', 'Returned +3', '2026-09-13'),  # returned
+    ])
+    conn.commit()
+    conn.close()
+    return db_file
+
+
+def engine(db_file, smtp):
+    return TechTacho.ReminderEngine(db_file, 'localhost', rate_per_second=1000, retries=2, smtp_factory=smtp)
+
+
+def test_one_digest_per_user(db_file, smtp):
+    digests = engine(db_file, smtp).find_due_reminders(today=TODAY)
+    assert {email: [equipment for _, equipment, _ in loans] for email, loans in digests.items()} == \
+        {'ann@example.com': ['Laptop', 'Mouse'], 'bob@example.com': ['Monitor']}
+
+    message = engine(db_file, smtp).build_message('ann@example.com', digests['ann@example.com'])
+    assert "2 Equipment Items" in message['Subject']
+    assert "Laptop (due 2026-09-15)" in message.get_content()
+    assert "Mouse (due 2026-09-20)" in message.get_content()
+
+
+def test_transient_error_is_retried(db_file, smtp):
+    smtp.fail_once.add('bob@example.com')
+    report = engine(db_file, smtp).run()
+    assert (report['sent'], report['failed'], report['loans']) == (2, 0, 3)
+    assert sorted(message['To'] for message in smtp.delivered) == ['ann@example.com', 'bob@example.com']
+    assert smtp.connections == 3
+
+
+def test_sent_log_suppresses_a_second_send_within_the_cooldown(db_file, smtp):
+    assert engine(db_file, smtp).run()['sent'] == 2
+    smtp.delivered.clear()
+
+    report = engine(db_file, smtp).run()
+    assert (report['digests'], report['sent']) == (0, 0)
+    assert smtp.delivered == []
+
+    # Once the cooldown is over the loans are due again
+    later = TechTacho.ReminderEngine(db_file, 'localhost', cooldown_days=0, smtp_factory=smtp)
+    assert len(later.find_due_reminders()) == 2
@@ -0,0 +1,130 @@
+import sqlite3
+import tkinter as tk
+
+import pytest
+
+import TechTacho
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    db_file = str(tmp_path / 'loans.db')
+    conn = sqlite3.connect(db_file)
+    TechTacho.create_bench_table(conn, 200)
+    conn.commit()
+    conn.close()
+    TechTacho.prepare_database(db_file)
+    return db_file
+
+
+def read_datasets(session):
+    # What the equipment, Trust Index and summary tabs ask for after a database switch, some of it twice
+    for _ in range(2):
+        session.borrower_emails()
+        session.equipment_types()
+        session.user_metrics()
+        session.status_counts()
+
+
+def add_loan(db_file):
+    conn = TechTacho.open_db(db_file)
+    TechTacho.insert_loans(conn, [('2026-10-19', 'new@example.com', 'Laptop', '2026-11-02', 'Not Returned', None)])
+    conn.commit()
+    conn.close()
+
+
+def test_select_runs_each_query_once(db_file):
+    # One query per dataset plus one Usn read that tags them
+    with TechTacho.perf.action('switch_database') as record:
+        session = TechTacho.DatabaseSession(db_file)
+        read_datasets(session)
+    assert record['queries'] == 5
+
+    # Selected again while nothing changed: only the Usn is read
+    with TechTacho.perf.action('switch_database') as record:
+        session.revalidate()
+        read_datasets(session)
+    assert record['queries'] == 1
+
+
+def test_reselect_after_a_change_reads_the_datasets_again(db_file):
+    session = TechTacho.DatabaseSession(db_file)
+    read_datasets(session)
+    add_loan(db_file)
+
+    with TechTacho.perf.action('switch_database') as record:
+        session.revalidate()
+        read_datasets(session)
+    assert record['queries'] == 5
+    assert 'new@example.com' in session.borrower_emails()
+
+
+def test_users_csv_read_once(db_file):
+    pytest.importorskip('pandas')
+    with TechTacho.perf.action('switch_database') as record:
+        session = TechTacho.DatabaseSession(db_file)
+        for _ in range(3):
+            session.user_emails()
+        session.add_user('new@example.com')
+        read_datasets(session)
+    assert record['file_reads'] == 1
+    assert record['queries'] == 5
+
+    with TechTacho.perf.action('switch_database') as record:
+        session.revalidate()
+        assert 'new@example.com' in session.user_emails()
+        read_datasets(session)
+    assert record['file_reads'] == 0
+    assert record['queries'] == 1
+
+
+class AppStub:
+    # The tab only asks the application for the other tabs, which are left out here
+    confidence_index_tab = None
+
+
+@pytest.fixture
+def equipment_tab(db_file):
+    pytest.importorskip('pandas')
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        pytest.skip("no display")
+    root.withdraw()
+    tab = TechTacho.EquipmentTrackingTab(root, '#d9d9d9', AppStub())
+    tab.db_combo['values'] = [db_file]
+    tab.db_combo.set(db_file)
+    yield tab
+    root.destroy()
+
+
+def test_switching_to_the_same_database_again(equipment_tab, db_file):
+    TechTacho.result_cache.clear()
+
+    # Grid Usn check and grid query, the session's Usn read and the equipment list; the users CSV once
+    equipment_tab.combined_database_selection_handler(None)
+    record = TechTacho.perf.records[-1]
+    assert record['action'] == 'switch_database'
+    assert (record['queries'], record['file_reads']) == (4, 1)
+    assert len(equipment_tab.loans) == 200
+
+    # Unchanged: the grid comes from the result cache and the session keeps its datasets
+    equipment_tab.combined_database_selection_handler(None)
+    record = TechTacho.perf.records[-1]
+    assert (record['queries'], record['file_reads']) == (2, 0)
+
+    # Changed by another clerk: the grid and the equipment list are read again, the CSV is not
+    add_loan(db_file)
+    equipment_tab.combined_database_selection_handler(None)
+    record = TechTacho.perf.records[-1]
+    assert (record['queries'], record['file_reads']) == (4, 0)
+    assert len(equipment_tab.loans) == 201
+
+
+def test_database_error_is_not_an_empty_result(db_file):
+    session = TechTacho.DatabaseSession(db_file)
+
+    with pytest.raises(sqlite3.Error):
+        session.load('broken', lambda conn: conn.execute("SELECT * FROM no_such_table").fetchall())
+    assert 'broken' not in session.data
+    assert session.equipment_types()
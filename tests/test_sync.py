@@ -0,0 +1,148 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import TechTacho
+
+CONTENTS_SQL = '''SELECT l.Uid, l.Date, u.Email, t.Name, l.DueDate, l.Status, l.ReturnDate
+                  FROM loans l JOIN users u ON u.ID = l.UserID JOIN equipment_types t ON t.ID = l.EquipmentTypeID
+                  ORDER BY l.Uid'''
+
+
+def contents(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute(CONTENTS_SQL).fetchall()
+    finally:
+        conn.close()
+
+
+def change(db_file, sql, params, changed_at):
+    # Run one write on a loan and date its change log entry, so the tests decide which side changed last
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute(sql, params)
+        conn.execute("UPDATE equipment_changes SET ChangedAt = ? WHERE ID = ?", (changed_at, params[-1]))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def loan_id(db_file, equipment):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("SELECT ID FROM equipment WHERE Equipment = ?", (equipment,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def copies(tmp_path):
+    # Two copies of one database that have been synced once, so both start with the same loans and watermarks
+    local = str(tmp_path / 'local.db')
+    conn = sqlite3.connect(local)
+    TechTacho.create_bench_table(conn, 0)
+    conn.close()
+    TechTacho.prepare_database(local)
+    conn = sqlite3.connect(local)
+    TechTacho.insert_loans(conn, [
+        ('2026-10-01', 'ann@example.com', 'Laptop', '2026-10-15', 'Not Returned', None),
+        ('2026-10-02', 'bob@example.com', 'Monitor', '2026-10-16', 'Not Returned', None),
+        ('2026-10-03', 'cid@example.com', 'Headset', '2026-10-17', 'Not Returned', None),
+    ])
+    conn.execute("UPDATE equipment_changes SET ChangedAt = '2026-10-01 08:00:00.000'")
+    conn.commit()
+    conn.close()
+    peer = str(tmp_path / 'peer.db')
+    shutil.copy(local, peer)
+    TechTacho.sync_databases(local, peer)
+    return local, peer
+
+
+def test_later_change_wins_on_both_sides(copies):
+    local, peer = copies
+    laptop = loan_id(local, 'Laptop')
+    change(local, "UPDATE loans SET DueDate = ? WHERE ID = ?", ('2026-11-01', laptop), '2026-10-18 09:00:00.000')
+    change(peer, "UPDATE loans SET DueDate = ? WHERE ID = ?", ('2026-12-01', laptop), '2026-10-18 10:00:00.000')
+
+    report = TechTacho.sync_databases(local, peer)
+
+    assert report['conflicts'] == 1
+    assert (report['applied_here'], report['applied_there']) == (1, 0)
+    assert contents(local) == contents(peer)
+    assert [row[4] for row in contents(local) if row[3] == 'Laptop'] == ['2026-12-01']
+
+
+def test_later_delete_wins_over_an_edit(copies):
+    local, peer = copies
+    monitor = loan_id(local, 'Monitor')
+    change(peer, "UPDATE loans SET Status = ? WHERE ID = ?", ('Returned', monitor), '2026-10-18 09:00:00.000')
+    change(local, "DELETE FROM loans WHERE ID = ?", (monitor,), '2026-10-18 10:00:00.000')
+
+    TechTacho.sync_databases(local, peer)
+
+    assert contents(local) == contents(peer)
+    assert 'Monitor' not in [row[3] for row in contents(peer)]
+
+
+def test_later_edit_brings_a_deleted_loan_back(copies):
+    local, peer = copies
+    monitor = loan_id(local, 'Monitor')
+    change(local, "DELETE FROM loans WHERE ID = ?", (monitor,), '2026-10-18 09:00:00.000')
+    change(peer, "UPDATE loans SET Status = ? WHERE ID = ?", ('Returned', monitor), '2026-10-18 10:00:00.000')
+
+    TechTacho.sync_databases(local, peer)
+
+    assert contents(local) == contents(peer)
+    assert [row[5] for row in contents(local) if row[3] == 'Monitor'] == ['Returned']
+
+
+def test_change_older_than_the_peers_version_converges(copies):
+    # The peer's version of the headset is already below this copy's watermark, so only sending the winner
+    # back keeps the copies together
+    local, peer = copies
+    headset = loan_id(local, 'Headset')
+    change(peer, "UPDATE loans SET DueDate = ? WHERE ID = ?", ('2026-11-01', headset), '2026-10-18 10:00:00.000')
+    TechTacho.sync_databases(local, peer)
+    change(local, "UPDATE loans SET Status = ? WHERE ID = ?", ('Returned', headset), '2026-10-18 09:00:00.000')
+
+    report = TechTacho.sync_databases(local, peer)
+
+    assert report['applied_here'] == 1
+    assert contents(local) == contents(peer)
+    assert [row[4:6] for row in contents(local) if row[3] == 'Headset'] == [('2026-11-01', 'Not Returned')]
+
+
+def test_sync_again_changes_nothing(copies):
+    local, peer = copies
+    change(local, "UPDATE loans SET Status = ? WHERE ID = ?", ('Returned', loan_id(local, 'Headset')),
+           '2026-10-18 09:00:00.000')
+    TechTacho.sync_databases(local, peer)
+    synced = contents(local)
+
+    again = TechTacho.sync_databases(local, peer)
+    # What the first sync wrote to the peer comes back once and is skipped as identical; after that the
+    # watermarks leave nothing to send
+    assert (again['applied_here'], again['applied_there']) == (0, 0)
+    third = TechTacho.sync_databases(local, peer)
+    assert (third['sent'], third['received']) == (0, 0)
+    assert contents(local) == contents(peer) == synced
+
+
+def test_moved_database_resends_everything_once(copies, tmp_path):
+    # A file opened at another path may be a copy, which must not reuse the original's watermarks, so it gets a
+    # new database ID and the next sync sends all of its loans. The peer already has them all and applies none.
+    local, peer = copies
+    moved = str(tmp_path / 'moved.db')
+    os.replace(local, moved)
+
+    report = TechTacho.sync_databases(moved, peer)
+
+    assert report['sent'] == len(contents(moved))
+    assert (report['applied_here'], report['applied_there']) == (0, 0)
+    assert contents(moved) == contents(peer)
+    again = TechTacho.sync_databases(moved, peer)
+    assert (again['applied_here'], again['applied_there']) == (0, 0)
+    assert TechTacho.sync_databases(moved, peer)['sent'] == 0